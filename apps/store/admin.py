@@ -6,6 +6,7 @@ from apps.store.models import (
     Product,
     Recommendation,
     RecommendationItem,
+    RecommendationJob,
     Sale,
     Store,
     SubCategory
@@ -17,6 +18,7 @@ admin.site.register(Client)
 admin.site.register(Product)
 admin.site.register(Recommendation)
 admin.site.register(RecommendationItem)
+admin.site.register(RecommendationJob)
 admin.site.register(Sale)
 admin.site.register(Store)
 admin.site.register(SubCategory)
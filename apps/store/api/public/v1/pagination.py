@@ -0,0 +1,41 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+        Cursor pagination over `-id` or `-updated_at` (`?ordering=`).
+        Every page is an indexed range scan from the previous one, without
+        OFFSET and without counting the whole table. Views can set their
+        own `keyset_orderings`, the first one is their default.
+    """
+    ordering = '-id'
+    orderings = {
+        '-id': ('-id',),
+        '-updated_at': ('-updated_at', '-id'),
+    }
+    ordering_param = 'ordering'
+    page_size_query_param = 'limit'
+    max_page_size = 50
+
+    def get_ordering(self, request, queryset, view):
+        orderings = getattr(view, 'keyset_orderings', self.orderings)
+        default = next(iter(orderings))
+        ordering = request.query_params.get(self.ordering_param, default)
+        return orderings.get(ordering, orderings[default])
+
+
+class KeysetPaginationMixin:
+    """
+        Use `KeysetPagination` instead of the default pagination when the
+        request asks for it with `?pagination=cursor` or sends a cursor
+    """
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = KeysetPagination()
+            else:
+                return super().paginator
+        return self._paginator
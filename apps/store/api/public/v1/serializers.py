@@ -8,6 +8,25 @@ from apps.store.models import (
 )
 
 
+class SparseFieldsetMixin:
+    """
+        Keep only the fields listed in the `fields` query parameter,
+        e.g. `?fields=id,name,price`
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None:
+            return
+        fields = request.query_params.get('fields')
+        if not fields:
+            return
+        requested = {name.strip() for name in fields.split(',')}
+        for name in set(self.fields) - requested:
+            self.fields.pop(name)
+
+
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
@@ -15,6 +34,35 @@ class ProductSerializer(serializers.ModelSerializer):
         depth = 1
 
 
+class ProductListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    category_name = serializers.CharField(
+        source='category.name',
+        read_only=True
+    )
+    subcategory_name = serializers.CharField(
+        source='subcategory.name',
+        read_only=True
+    )
+
+    class Meta:
+        model = Product
+        fields = (
+            'id',
+            'name',
+            'description',
+            'price',
+            'stock',
+            'brand',
+            'image_url',
+            'category',
+            'category_name',
+            'subcategory',
+            'subcategory_name',
+            'created_at',
+            'updated_at',
+        )
+
+
 class SubCategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = SubCategory
@@ -39,3 +87,18 @@ class SimilarProductSerializer(serializers.Serializer):
     same_category = serializers.BooleanField(default=True)
     category_name = serializers.CharField(required=False)
     n_results = serializers.IntegerField(min_value=1, max_value=10)
+
+    def validate(self, attrs):
+        if attrs.get('add_condition') and not attrs.get('category_name'):
+            raise serializers.ValidationError({
+                'category_name': 'Required when add_condition is true.'
+            })
+        return attrs
+
+
+class SimilarProductBatchSerializer(serializers.Serializer):
+    queries = SimilarProductSerializer(
+        many=True,
+        min_length=1,
+        max_length=50
+    )
@@ -4,6 +4,9 @@ from apps.store.api.public.v1.views import (
     ProductListAPIView,
     CategoryListAPIView,
     SimilarProductCreateAPIView,
+    SimilarProductBatchAPIView,
+    SimilarProductAsyncView,
+    RecommendationMetricsAPIView,
 )
 
 
@@ -23,4 +26,19 @@ urlpatterns = [
         SimilarProductCreateAPIView.as_view(),
         name='product-similar'
     ),
+    path(
+        'products/similar/batch/',
+        SimilarProductBatchAPIView.as_view(),
+        name='product-similar-batch'
+    ),
+    path(
+        'products/similar/async/',
+        SimilarProductAsyncView.as_view(),
+        name='product-similar-async'
+    ),
+    path(
+        'metrics',
+        RecommendationMetricsAPIView.as_view(),
+        name='recommendation-metrics'
+    ),
 ]
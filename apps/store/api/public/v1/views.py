@@ -1,23 +1,54 @@
+import inspect
+
+from asgiref.sync import sync_to_async
 from rest_framework.response import Response
 from rest_framework import status, generics
+from rest_framework.views import APIView
 
+from apps.store.api.public.v1.pagination import KeysetPaginationMixin
+from apps.store.api.public.v1.renderers import PlainTextRenderer
 from apps.store.api.public.v1.serializers import (
     ProductSerializer,
+    ProductListSerializer,
     CategorySerializer,
     SimilarProductSerializer,
+    SimilarProductBatchSerializer,
 )
 from apps.store.models import Product, Category
-from apps.store.utils import get_similar_objects
+from apps.store.recommendations.metrics import metrics
+from apps.store.utils import (
+    aget_similar_objects,
+    get_similar_objects,
+    get_similar_objects_batch,
+)
 
 
-class ProductListAPIView(generics.ListAPIView):
+class ProductListAPIView(KeysetPaginationMixin, generics.ListAPIView):
+    """
+        Products with their nested category and subcategory. With
+        `?mode=compact` or `?fields=...` they are returned flat, with only
+        the ids and names of the category and subcategory.
+        `?pagination=cursor` walks the list with keyset pagination.
+    """
     serializer_class = ProductSerializer
-    queryset = Product.objects.all().order_by('-id')
+    queryset = Product.objects.select_related(
+        'category', 'subcategory'
+    ).order_by('-id')
+
+    def get_serializer_class(self):
+        params = self.request.query_params
+        if params.get('mode') == 'compact' or params.get('fields'):
+            return ProductListSerializer
+        return super().get_serializer_class()
 
 
-class CategoryListAPIView(generics.ListAPIView):
+class CategoryListAPIView(KeysetPaginationMixin, generics.ListAPIView):
     serializer_class = CategorySerializer
-    queryset = Category.objects.all().order_by('-name')
+    queryset = Category.objects.prefetch_related(
+        'subcategory_set'
+    ).order_by('-name')
+    # The cursor keeps the order of the offset pages
+    keyset_orderings = {'-name': ('-name', '-id')}
 
 
 class SimilarProductCreateAPIView(generics.CreateAPIView):
@@ -40,3 +71,119 @@ class SimilarProductCreateAPIView(generics.CreateAPIView):
         serializer = ProductSerializer(products, many=True)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class SimilarProductBatchAPIView(generics.GenericAPIView):
+    """
+        Similar products of many queries in one request, keyed by the index
+        of the query: `{"results": {"0": [...], "1": [...]}}`. Queries with
+        the same filter share one vector query and every product is read
+        and serialized once.
+    """
+    serializer_class = SimilarProductBatchSerializer
+    queryset = Product.objects.none()
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        found = get_similar_objects_batch([
+            {
+                'query': query.get('query'),
+                'add_condition': query.get('add_condition'),
+                'product_category': query.get('category_name'),
+                'same_category': query.get('same_category'),
+                'n': query.get('n_results'),
+            }
+            for query in serializer.validated_data['queries']
+        ])
+
+        products = {
+            product.id: product for query_products in found
+            for product in query_products
+        }
+        serialized = dict(zip(
+            products,
+            ProductSerializer(list(products.values()), many=True).data
+        ))
+
+        return Response(
+            {
+                'results': {
+                    str(index): [
+                        serialized[product.id] for product in query_products
+                    ]
+                    for index, query_products in enumerate(found)
+                }
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+class SimilarProductAsyncView(APIView):
+    """
+        Same as `SimilarProductCreateAPIView`, served without holding a
+        thread while the search runs: under ASGI the request waits on the
+        event loop, the search runs in a bounded executor and identical
+        searches in flight are run once. DRF views are synchronous, so
+        `dispatch` is an async copy of `APIView.dispatch`: the request goes
+        through the same parsers, authentication, permissions, throttles
+        and serializer as the other views.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            # Authentication and throttles may read the database
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            handler = getattr(
+                self, request.method.lower(), self.http_method_not_allowed
+            )
+            response = handler(request, *args, **kwargs)
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs
+        )
+        return self.response
+
+    async def post(self, request, *args, **kwargs):
+        serializer = SimilarProductSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        products, result = await aget_similar_objects(
+            query=data.get('query'),
+            add_condition=data.get('add_condition'),
+            product_category=data.get('category_name'),
+            same_category=data.get('same_category'),
+            n=data.get('n_results'),
+        )
+
+        serializer = ProductSerializer(products, many=True)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class RecommendationMetricsAPIView(APIView):
+    """
+        Stage timings and event counters of the recommendation pipeline in
+        this process, in the Prometheus text format. Empty unless
+        RECOMMENDATION_METRICS is enabled.
+    """
+    renderer_classes = [PlainTextRenderer]
+
+    def get(self, request, *args, **kwargs):
+        return Response(
+            metrics.prometheus(),
+            status=status.HTTP_200_OK,
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
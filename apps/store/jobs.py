@@ -0,0 +1,164 @@
+import logging
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from apps.store.models import JobStatus, RecommendationJob, Sale
+from apps.store.utils import create_recomendation
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 30  # seconds, doubled on every failed attempt
+LEASE_TIMEOUT = 300  # seconds before a stuck job is picked up again
+
+
+def enqueue_recommendation(sale: Sale) -> RecommendationJob:
+    """
+    Queue the generation of the recommendation of a sale.
+    ---
+    A sale has at most one job, so enqueueing it again only resets the
+    existing job to pending. The job is written in the caller's transaction,
+    so it becomes visible to the workers together with the sale products.
+
+    Args:
+        sale (Sale): The sale to generate the recommendation for.
+
+    Returns:
+        RecommendationJob: The pending job of the sale.
+    """
+
+    job, _ = RecommendationJob.objects.update_or_create(
+        sale=sale,
+        defaults=dict(
+            status=JobStatus.PENDING,
+            attempts=0,
+            available_at=timezone.now(),
+            last_error=None,
+        )
+    )
+
+    return job
+
+
+def claim_jobs(
+    batch_size: int,
+    lease_timeout: int = LEASE_TIMEOUT,
+) -> list[int]:
+    """
+    Mark the next batch of runnable jobs as processing.
+    ---
+    Runnable jobs are the pending ones whose retry delay has expired and the
+    processing ones whose worker did not report back within `lease_timeout`.
+    Without `skip_locked` (SQLite) two workers may read the same jobs, only
+    one of them updates each job, so the claimed jobs are read back by the
+    claim time.
+
+    Args:
+        batch_size (int): The maximum number of jobs to claim.
+        lease_timeout (int, optional): Seconds after which a processing job
+            is considered abandoned.
+
+    Returns:
+        list[int]: The ids of the claimed jobs.
+    """
+
+    now = timezone.now()
+    runnable = (
+        Q(status=JobStatus.PENDING, available_at__lte=now)
+        | Q(
+            status=JobStatus.PROCESSING,
+            updated_at__lt=now - timedelta(seconds=lease_timeout)
+        )
+    )
+
+    with transaction.atomic():
+        jobs = RecommendationJob.objects.filter(runnable).order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            jobs = jobs.select_for_update(skip_locked=True)
+        ids = list(jobs.values_list('id', flat=True)[:batch_size])
+
+        RecommendationJob.objects.filter(runnable, id__in=ids).update(
+            status=JobStatus.PROCESSING,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+
+        claimed = RecommendationJob.objects.filter(
+            id__in=ids,
+            status=JobStatus.PROCESSING,
+            updated_at=now,
+        ).order_by('id')
+
+        return list(claimed.values_list('id', flat=True))
+
+
+def process_job(
+    job_id: int,
+    max_attempts: int = MAX_ATTEMPTS,
+    retry_delay: int = RETRY_DELAY,
+) -> bool:
+    """
+    Generate the recommendation of a claimed job.
+    ---
+    Failed jobs go back to the queue with an exponential delay until they
+    reach `max_attempts`, then they are moved to the dead letter state with
+    the last error. A job that was enqueued again while it was processed is
+    left pending so the latest products of the sale are used. A job deleted
+    with its sale after it was claimed is skipped.
+
+    Args:
+        job_id (int): The id of a job claimed with `claim_jobs`.
+        max_attempts (int, optional): Attempts before giving up on the job.
+        retry_delay (int, optional): Seconds to wait before the first retry.
+
+    Returns:
+        bool: Whether the recommendation was created.
+    """
+
+    job = None
+    try:
+        job = RecommendationJob.objects.select_related(
+            'sale__client'
+        ).get(id=job_id)
+        with transaction.atomic():
+            create_recomendation(job.sale)
+    except RecommendationJob.DoesNotExist:
+        logger.warning('Job %s no longer exists, skipping it', job_id)
+        return False
+    except Exception as e:
+        logger.exception('Error creating recommendation for job %s', job_id)
+        now = timezone.now()
+        # The job couldn't be read, it was claimed at least once
+        attempts = job.attempts if job is not None else 1
+        if attempts >= max_attempts:
+            status, available_at = JobStatus.DEAD, now
+        else:
+            delay = retry_delay * 2 ** max(attempts - 1, 0)
+            status = JobStatus.PENDING
+            available_at = now + timedelta(seconds=delay)
+
+        RecommendationJob.objects.filter(
+            id=job_id,
+            status=JobStatus.PROCESSING,
+        ).update(
+            status=status,
+            available_at=available_at,
+            last_error=repr(e),
+            updated_at=now,
+        )
+        return False
+
+    RecommendationJob.objects.filter(
+        id=job_id,
+        status=JobStatus.PROCESSING,
+    ).update(
+        status=JobStatus.DONE,
+        last_error=None,
+        updated_at=timezone.now(),
+    )
+
+    return True
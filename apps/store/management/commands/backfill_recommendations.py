@@ -0,0 +1,215 @@
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from apps.store.models import (
+    Recommendation,
+    RecommendationItem,
+    Sale,
+    SyncState,
+)
+from apps.store.recommendations.documents import product_document
+from apps.store.recommendations.recommendation_service import (
+    get_batch_recommendations,
+)
+from apps.store.utils import recommendation_hits, save_recommendations
+
+
+BACKFILL = 'recommendations_backfill'
+
+
+def recommend_chunk(sales, n_results, same_category):
+    """
+        Run the vector queries of a chunk of sales, given as
+        (sale id, [(product id, category, document), ...]) pairs. Only the
+        vector store is used here, pool workers never touch the database.
+
+        Out-of-stock products are filtered by the store. A filter on the
+        products of every sale would split the chunk into one query per
+        sale, so each query asks for as many extra results as the largest
+        sale has products and the sale's own products are dropped here.
+    """
+    products = [
+        (category, name)
+        for _, sale_products in sales
+        for _, category, name in sale_products
+    ]
+    extra = max((len(sale_products) for _, sale_products in sales), default=0)
+    results = iter(get_batch_recommendations(
+        products,
+        n_results=n_results + extra,
+        same_category=same_category,
+        use_cache=False,
+    ))
+
+    chunk_hits = []
+    for sale_id, sale_products in sales:
+        sale_ids = {product_id for product_id, _, _ in sale_products}
+        hits = []
+        for _ in sale_products:
+            hits.extend([
+                hit for hit in recommendation_hits([next(results)])
+                if hit[0] not in sale_ids
+            ][:n_results])
+        chunk_hits.append((sale_id, hits))
+
+    return chunk_hits
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate again the recommendations of the stored sales. Sales are '
+        'processed in id order and an interrupted run is resumed where it '
+        'stopped, a completed run starts from the first sale again'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            type=parse_datetime,
+            help='Only process the sales created after this date (ISO 8601)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of chunks queried in parallel'
+        )
+        parser.add_argument(
+            '--pool',
+            choices=['thread', 'process'],
+            default='thread',
+            help='Kind of pool used to run the vector queries'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of sales read, queried and written at once'
+        )
+        parser.add_argument(
+            '--n-results',
+            type=int,
+            default=4,
+            help='Number of recommended products for each sold product'
+        )
+        parser.add_argument(
+            '--same-category',
+            action='store_true',
+            help='Recommend products of the same category'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Start from the first sale instead of resuming'
+        )
+
+    def handle(self, *args, **options):
+        state, _ = SyncState.objects.get_or_create(name=BACKFILL)
+        if options['restart']:
+            state.last_id = None
+            state.save(update_fields=['last_id', 'updated_at'])
+
+        sales = Sale.objects.order_by('id').only('id', 'client_id')
+        if options['since']:
+            sales = sales.filter(created_at__gt=options['since'])
+        if state.last_id is not None:
+            self.stdout.write(f'Resuming after sale {state.last_id}')
+            sales = sales.filter(id__gt=state.last_id)
+        sales = sales.prefetch_related('products__category')
+
+        if options['pool'] == 'process':
+            # Spawned workers get their own Django setup and Chroma client
+            executor = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=options['workers'])
+
+        total = sales.count()
+        self.stdout.write(f'Backfilling {total} sales...')
+        start = time.perf_counter()
+        done = 0
+        pending = deque()
+        with executor:
+            for chunk in self.chunks(sales, options['chunk_size']):
+                pending.append((chunk, executor.submit(
+                    recommend_chunk,
+                    [
+                        (
+                            sale.id,
+                            [
+                                (
+                                    product.id,
+                                    product.category.name,
+                                    product_document(product),
+                                )
+                                for product in sale.products.all()
+                            ],
+                        )
+                        for sale in chunk
+                    ],
+                    options['n_results'],
+                    options['same_category'],
+                )))
+                # Keep every worker busy without reading the whole table
+                if len(pending) > options['workers']:
+                    done += self.write(state, *pending.popleft())
+                    self.progress(done, total, start)
+
+            while pending:
+                done += self.write(state, *pending.popleft())
+                self.progress(done, total, start)
+
+        # Nothing left to resume, the next run starts over
+        state.last_id = None
+        state.save(update_fields=['last_id', 'updated_at'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled {done} sales in {time.perf_counter() - start:.1f}s'
+        ))
+
+    def chunks(self, sales, chunk_size):
+        # Keyset pagination: every chunk is one indexed range query plus
+        # the prefetch queries, whatever the depth
+        last_id = 0
+        while chunk := list(sales.filter(id__gt=last_id)[:chunk_size]):
+            yield chunk
+            last_id = chunk[-1].id
+
+    def write(self, state, chunk, future):
+        """
+            Replace the recommendations of a chunk and record it as done,
+            in one transaction. Chunks are written in id order, so
+            `last_id` never skips an unwritten sale.
+        """
+        hits = dict(future.result())
+        entries = [(sale, hits[sale.id]) for sale in chunk if hits[sale.id]]
+
+        with transaction.atomic():
+            RecommendationItem.objects.filter(
+                recommendation__sale__in=chunk
+            ).delete()
+            Recommendation.objects.filter(sale__in=chunk).delete()
+            save_recommendations(entries)
+            state.last_id = chunk[-1].id
+            state.save(update_fields=['last_id', 'updated_at'])
+
+        return len(chunk)
+
+    def progress(self, done, total, start):
+        elapsed = time.perf_counter() - start
+        rate = done / elapsed if elapsed else 0
+        eta = timedelta(seconds=round((total - done) / rate)) if rate else '?'
+        self.stdout.write(
+            f'{done}/{total} sales, {rate:.0f} sales/s, ETA {eta}'
+        )
@@ -0,0 +1,180 @@
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from apps.store.recommendations.batching import MicroBatcher
+from apps.store.recommendations.recommendation_service import search_many
+from apps.store.recommendations.vector_store import NumpyVectorStore
+
+
+class BenchEmbedding:
+    """
+        Embedding function of the benchmark. Loading returns the stored
+        random vectors; queries keep the CPU busy `call_ms` per call plus
+        `text_ms` per text, like a CPU model with a fixed overhead per
+        batch, and return a vector derived from the text.
+    """
+
+    def __init__(self, vectors, call_ms, text_ms):
+        self.vectors = vectors
+        self.call_ms = call_ms
+        self.text_ms = text_ms
+        self.loading = True
+
+    def __call__(self, input):
+        if self.loading:
+            return self.vectors[[int(text) for text in input]]
+        end = time.perf_counter() + (
+            self.call_ms + self.text_ms * len(input)
+        ) / 1000
+        while time.perf_counter() < end:
+            pass
+        return np.stack([
+            np.random.default_rng(abs(hash(text))).standard_normal(
+                self.vectors.shape[1]
+            )
+            for text in input
+        ])
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the throughput and latency of concurrent single-text '
+        'searches sent on their own and through the micro-batching '
+        'scheduler, on a NumPy store of random vectors'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            nargs='+',
+            default=[1, 8, 32, 128],
+            help='Numbers of threads searching at once'
+        )
+        parser.add_argument(
+            '--searches',
+            type=int,
+            default=1000,
+            help='Searches of every run'
+        )
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=50_000,
+            help='Size of the catalog'
+        )
+        parser.add_argument(
+            '--categories',
+            type=int,
+            default=20,
+            help='Number of categories of the catalog'
+        )
+        parser.add_argument(
+            '--dim',
+            type=int,
+            default=384,
+            help='Dimension of the vectors'
+        )
+        parser.add_argument(
+            '--call-ms',
+            type=float,
+            default=5,
+            help='Simulated cost of every embedding call'
+        )
+        parser.add_argument(
+            '--text-ms',
+            type=float,
+            default=0.5,
+            help='Simulated cost of every embedded text'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=32,
+            help='Largest batch of the scheduler'
+        )
+        parser.add_argument(
+            '--wait-ms',
+            type=float,
+            default=2,
+            help='Longest wait of the scheduler for a batch to fill'
+        )
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((options['rows'], options['dim']))
+        vectors = vectors.astype(np.float32)
+        categories = rng.integers(options['categories'], size=options['rows'])
+        embedding = BenchEmbedding(
+            vectors, options['call_ms'], options['text_ms']
+        )
+
+        path = tempfile.mkdtemp()
+        try:
+            store = NumpyVectorStore(path, embedding)
+            ids = [str(i) for i in range(options['rows'])]
+            store.upsert(
+                ids, ids,
+                [{'category': f'category {i}'} for i in categories]
+            )
+            store.compact()
+            embedding.loading = False
+
+            batcher = MicroBatcher(
+                lambda searches: search_many(searches, store),
+                max_batch_size=options['batch_size'],
+                max_wait=options['wait_ms'] / 1000,
+            )
+            modes = {
+                'single': lambda text, where: store.query([text], 4, where),
+                'batched': lambda text, where: batcher.query(text, 4, where),
+            }
+
+            self.stdout.write(
+                f'{"threads":>8} {"mode":>8} {"searches/s":>11} '
+                f'{"p50 ms":>8} {"p99 ms":>8} {"batch":>6}'
+            )
+            for concurrency in options['concurrency']:
+                for mode, search in modes.items():
+                    batcher.batches = batcher.searches = 0
+                    rate, p50, p99 = self.run(
+                        search, concurrency, options
+                    )
+                    batch = batcher.stats()['average_batch'] or 1
+                    self.stdout.write(
+                        f'{concurrency:>8} {mode:>8} {rate:>11.0f} '
+                        f'{p50:>8.2f} {p99:>8.2f} {batch:>6.1f}'
+                    )
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def run(self, search, concurrency, options):
+        # Checkout queries: products of any other category
+        wheres = [
+            {'category': {'$nin': [f'category {i}']}}
+            for i in range(options['categories'])
+        ]
+
+        def timed(i):
+            start = time.perf_counter()
+            search(f'query {i}', wheres[i % len(wheres)])
+            return (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = sorted(
+                executor.map(timed, range(options['searches']))
+            )
+        elapsed = time.perf_counter() - start
+
+        return (
+            options['searches'] / elapsed,
+            median(latencies),
+            latencies[int(0.99 * (len(latencies) - 1))],
+        )
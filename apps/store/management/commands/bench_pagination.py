@@ -0,0 +1,112 @@
+import time
+from decimal import Decimal
+from statistics import median
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from rest_framework.pagination import Cursor
+from rest_framework.test import APIRequestFactory
+
+from apps.store.api.public.v1.pagination import KeysetPagination
+from apps.store.api.public.v1.views import ProductListAPIView
+from apps.store.models import Category, Product, SubCategory
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare offset and keyset pagination of the product list at '
+        'several depths, on a throwaway test database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=1_000_000,
+            help='Number of products in the benchmark table'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Requests per depth, the median is reported'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=20,
+            help='Page size'
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            self.populate(options['rows'])
+            self.run(options['rows'], options['repeat'], options['limit'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+    def populate(self, rows, batch_size=10_000):
+        self.stdout.write(f'Inserting {rows} products...')
+        category = Category.objects.create(name='Benchmark')
+        subcategory = SubCategory.objects.create(
+            name='Benchmark', category=category
+        )
+        for start in range(0, rows, batch_size):
+            Product.objects.bulk_create(
+                Product(
+                    name=f'Product {i}',
+                    description='',
+                    price=Decimal('1.00'),
+                    category=category,
+                    subcategory=subcategory,
+                )
+                for i in range(start, min(start + batch_size, rows))
+            )
+
+    def run(self, rows, repeat, limit):
+        factory = APIRequestFactory()
+        view = ProductListAPIView.as_view()
+        max_id = Product.objects.order_by('-id').values_list(
+            'id', flat=True
+        )[0]
+
+        self.stdout.write(f'{"depth":>10} {"offset ms":>12} {"keyset ms":>12}')
+        for depth in (0, rows // 100, rows // 10, rows // 2, rows - limit):
+            offset_request = factory.get('/', {
+                'mode': 'compact', 'limit': limit, 'offset': depth,
+            })
+
+            # Same page as the offset one: the rows after id `max_id - depth`
+            paginator = KeysetPagination()
+            paginator.base_url = 'http://testserver/'
+            url = paginator.encode_cursor(
+                Cursor(offset=0, reverse=False, position=max_id - depth + 1)
+            )
+            keyset_request = factory.get('/', {
+                'mode': 'compact', 'limit': limit, 'pagination': 'cursor',
+                'cursor': parse_qs(urlparse(url).query)['cursor'][0],
+            })
+
+            self.stdout.write(
+                f'{depth:>10} '
+                f'{self.measure(view, offset_request, repeat):>12.2f} '
+                f'{self.measure(view, keyset_request, repeat):>12.2f}'
+            )
+
+    def measure(self, view, request, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = view(request)
+            response.render()
+            timings.append((time.perf_counter() - start) * 1000)
+        return median(timings)
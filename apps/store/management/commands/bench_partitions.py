@@ -0,0 +1,176 @@
+import shutil
+import tempfile
+import time
+from statistics import median
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from apps.store.recommendations.vector_store import NumpyVectorStore
+
+
+class VectorsByText:
+    """
+        Embedding function of the benchmark: the text is the row of the
+        vector to return
+    """
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def __call__(self, input):
+        return self.vectors[[int(text) for text in input]]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare category filtered queries of Chroma, the NumPy store with '
+        'a metadata mask and the NumPy store with category partitions, on '
+        'random vectors'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            nargs='+',
+            default=[10_000, 50_000, 200_000],
+            help='Catalog sizes to benchmark'
+        )
+        parser.add_argument(
+            '--categories',
+            type=int,
+            default=20,
+            help='Number of categories of the catalog'
+        )
+        parser.add_argument(
+            '--dim',
+            type=int,
+            default=384,
+            help='Dimension of the vectors'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Queries per measure, the median is reported'
+        )
+        parser.add_argument(
+            '--n-results',
+            type=int,
+            default=4,
+            help='Number of results of every query'
+        )
+        parser.add_argument(
+            '--skip-chroma',
+            action='store_true',
+            help='Only benchmark the NumPy store'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"rows":>8} {"filter":>7} {"chroma ms":>10} '
+            f'{"mask ms":>10} {"partition ms":>13}'
+        )
+        for rows in options['rows']:
+            self.run(rows, options)
+
+    def run(self, rows, options):
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((rows + 1, options['dim']))
+        vectors = vectors.astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        # Products are not inserted grouped by category
+        categories = [
+            f'category {i}'
+            for i in rng.integers(options['categories'], size=rows)
+        ]
+        ids = [str(i) for i in range(rows)]
+        metadatas = [{'category': category} for category in categories]
+        query = str(rows)
+        filters = {
+            '$in': {'category': {'$in': ['category 0']}},
+            '$nin': {'category': {'$nin': ['category 0']}},
+        }
+
+        path = tempfile.mkdtemp()
+        try:
+            store = NumpyVectorStore(
+                f'{path}/numpy', VectorsByText(vectors)
+            )
+            for start in range(0, rows, 50_000):
+                end = start + 50_000
+                store.upsert(
+                    ids[start:end], ids[start:end], metadatas[start:end]
+                )
+            # Every batch is written unsorted, only the mask can be used
+            store.partitioned = 0
+            mask = {
+                name: self.measure(
+                    lambda: store.query([query], options['n_results'], where),
+                    options['repeat']
+                )
+                for name, where in filters.items()
+            }
+            store.compact()
+            partition = {
+                name: self.measure(
+                    lambda: store.query([query], options['n_results'], where),
+                    options['repeat']
+                )
+                for name, where in filters.items()
+            }
+
+            chroma = dict.fromkeys(filters)
+            if not options['skip_chroma']:
+                collection = self.chroma_collection(
+                    f'{path}/chroma', ids, vectors[:rows], metadatas
+                )
+                chroma = {
+                    name: self.measure(
+                        lambda: collection.query(
+                            query_embeddings=vectors[rows:],
+                            n_results=options['n_results'],
+                            where=where
+                        ),
+                        options['repeat']
+                    )
+                    for name, where in filters.items()
+                }
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+        for name in filters:
+            chroma_ms = (
+                '-' if chroma[name] is None else f'{chroma[name]:.2f}'
+            )
+            self.stdout.write(
+                f'{rows:>8} {name:>7} {chroma_ms:>10} '
+                f'{mask[name]:>10.2f} {partition[name]:>13.2f}'
+            )
+
+    def chroma_collection(self, path, ids, vectors, metadatas):
+        import chromadb
+
+        client = chromadb.PersistentClient(path=path)
+        collection = client.create_collection(
+            'bench', embedding_function=None
+        )
+        batch_size = client.get_max_batch_size()
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            collection.add(
+                ids=ids[start:end],
+                embeddings=vectors[start:end],
+                metadatas=metadatas[start:end]
+            )
+        return collection
+
+    def measure(self, function, repeat):
+        function()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000)
+        return median(timings)
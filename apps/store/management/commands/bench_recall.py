@@ -0,0 +1,135 @@
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from apps.store.recommendations.documents import product_document
+from apps.store.recommendations.hashing_embedding import HashingEmbedding
+from apps.store.recommendations.sync import indexed_products
+from apps.store.recommendations.vector_store import NumpyVectorStore
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the recall@k of similar product searches with name-only '
+        'documents and with `product_document`. A hit is a product of the '
+        'same subcategory as the queried one'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--k',
+            type=int,
+            nargs='+',
+            default=[1, 5, 10],
+            help='Numbers of results to measure'
+        )
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=5000,
+            help='Products indexed, the first ones by id'
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=500,
+            help='Indexed products searched for'
+        )
+        parser.add_argument(
+            '--embedding',
+            choices=['default', 'hashing'],
+            default='default',
+            help=(
+                'The embedding model of the index, or a bag of hashed words '
+                'when the model is not available'
+            )
+        )
+
+    def handle(self, *args, **options):
+        products = list(
+            indexed_products().order_by('id')[:options['products']]
+        )
+        if not products:
+            self.stdout.write(self.style.WARNING('No products to index'))
+            return
+
+        if options['embedding'] == 'hashing':
+            embedding_function = HashingEmbedding()
+        else:
+            from apps.store.recommendations.embedding_cache import (
+                get_embedding_function,
+            )
+            embedding_function = get_embedding_function()
+
+        rng = np.random.default_rng(0)
+        queries = rng.choice(
+            len(products),
+            size=min(options['queries'], len(products)),
+            replace=False
+        )
+        subcategories = np.array(
+            [product.subcategory_id for product in products]
+        )
+        builders = {
+            'name': lambda product: product.name,
+            'document': product_document,
+        }
+
+        self.stdout.write(
+            f'{len(products)} products, {len(queries)} queries, '
+            f'{len(set(subcategories.tolist()))} subcategories'
+        )
+        self.stdout.write(
+            f'{"document":>9} '
+            + ''.join(f'{f"recall@{k}":>11}' for k in options['k'])
+            + f'{"ms/query":>10}'
+        )
+        for name, builder in builders.items():
+            recalls, elapsed = self.measure(
+                products, queries, subcategories, builder,
+                embedding_function, options['k']
+            )
+            self.stdout.write(
+                f'{name:>9} '
+                + ''.join(f'{recalls[k]:>11.3f}' for k in options['k'])
+                + f'{elapsed * 1000 / len(queries):>10.2f}'
+            )
+
+    def measure(self, products, queries, subcategories, builder,
+                embedding_function, ks):
+        path = tempfile.mkdtemp()
+        try:
+            store = NumpyVectorStore(path, embedding_function)
+            ids = [str(row) for row in range(len(products))]
+            documents = [builder(product) for product in products]
+            for start in range(0, len(products), 1000):
+                end = start + 1000
+                store.upsert(
+                    ids[start:end],
+                    documents[start:end],
+                    [{} for _ in documents[start:end]]
+                )
+
+            start = time.perf_counter()
+            result = store.query(
+                [documents[row] for row in queries], max(ks) + 1
+            )
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+        recalls = {}
+        for k in ks:
+            found = []
+            for row, ids in zip(queries, result['ids']):
+                # The product itself is not a result
+                hits = [int(id_) for id_ in ids if int(id_) != row][:k]
+                relevant = (subcategories == subcategories[row]).sum() - 1
+                if relevant:
+                    same = (subcategories[hits] == subcategories[row]).sum()
+                    found.append(same / min(k, relevant))
+            recalls[k] = float(np.mean(found)) if found else 0.0
+        return recalls, elapsed
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.store.models import Product
+from apps.store.recommendations.neighbors import (
+    N_NEIGHBORS,
+    refresh_neighbors,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Precompute the nearest neighbours of every product, read at '
+        'checkout when RECOMMENDATION_SOURCE is "neighbors"'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--n-neighbors',
+            type=int,
+            default=N_NEIGHBORS,
+            help='Neighbours kept inside and outside the product category'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of products queried and written at once'
+        )
+
+    def handle(self, *args, **options):
+        ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+        batch_size = options['batch_size']
+
+        start = time.perf_counter()
+        total = 0
+        for offset in range(0, len(ids), batch_size):
+            total += refresh_neighbors(
+                ids[offset:offset + batch_size],
+                options['n_neighbors'],
+                batch_size,
+            )
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f'{total}/{len(ids)} products ({total / elapsed:.0f}/s)'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Neighbours of {total} products stored'
+        ))
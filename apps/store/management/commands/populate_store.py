@@ -1,9 +1,12 @@
 import random
+import re
 import json
+import time
 from decimal import Decimal
+from itertools import islice
 
-from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
 from faker import Faker
 
@@ -19,6 +22,13 @@ from apps.store.models import (
 
 fake = Faker()
 
+# Characters read at once when streaming a JSON array
+READ_SIZE = 1 << 16
+# Largest item of a JSON array, past it the array is considered invalid
+# instead of buffering the rest of the file
+MAX_ITEM_SIZE = 1 << 24
+SEPARATORS = re.compile(r'[\s,]*')
+
 CATEGORIES_DATA = {
     'Climatization': {
         'description': 'Category for all climatization products',
@@ -149,8 +159,32 @@ class Command(BaseCommand):
         parser.add_argument(
             '--products-file',
             type=str,
-            help='Path to a JSON file with products data'
+            help=(
+                'Path to a JSON (array) or JSON Lines file with products data'
+            )
+        )
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help='Insert clients and products with bulk queries'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows read and inserted at once in bulk mode'
+        )
+
+    def bulk_insert(self, model, objs, lookup, key, batch_size):
+        """
+            Insert the new objects and register them in the lookup map
+        """
+        model.objects.bulk_create(objs, batch_size=batch_size)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            # The primary keys were not set, read the new rows back
+            objs = model.objects.filter(name__in={obj.name for obj in objs})
+        for obj in objs:
+            lookup.setdefault(key(obj), obj)
 
     def create_stores(self):
         stores = []
@@ -214,6 +248,44 @@ class Command(BaseCommand):
 
         return clients
 
+    def bulk_create_clients(self, num_clients, batch_size):
+        lookup = {
+            (client.name, client.email): client
+            for client in Client.objects.all()
+        }
+        keys = []
+        new_clients = {}
+        for _ in range(num_clients):
+            client_name = fake.name()
+            key = (
+                client_name,
+                client_name.lower().replace(' ', '.') + '@store.com'
+            )
+            keys.append(key)
+            if key in lookup or key in new_clients:
+                continue
+            new_clients[key] = Client(
+                name=key[0],
+                email=key[1],
+                display_name=client_name.title(),
+                phone=fake.phone_number()[0:15],
+                date_of_birth=fake.date_of_birth(
+                    minimum_age=18, maximum_age=90
+                ),
+                gender=random.choice(['M', 'F', 'O']),
+                is_active=random.choice([True, True, False]),
+            )
+
+        self.bulk_insert(
+            Client,
+            list(new_clients.values()),
+            lookup,
+            lambda client: (client.name, client.email),
+            batch_size,
+        )
+
+        return [lookup[key] for key in keys]
+
     def get_product_name(self, subcategory_name):
         if subcategory_name in PRODUCT_NAMES:
             base_name = random.choice(PRODUCT_NAMES[subcategory_name])
@@ -252,6 +324,40 @@ class Command(BaseCommand):
 
         return products
 
+    def bulk_create_products(self, num_products_per_subcategory, batch_size):
+        lookup = {product.name: product for product in Product.objects.all()}
+        subcategories = SubCategory.objects.select_related('category')
+
+        names = []
+        new_products = {}
+        for subcategory in subcategories:
+            for _ in range(num_products_per_subcategory):
+                name = self.get_product_name(subcategory.name)
+                names.append(name)
+                if name in lookup or name in new_products:
+                    continue
+                price_random = Decimal(
+                    random.uniform(10.0, 1000.0)
+                ).quantize(Decimal('0.01'))
+                new_products[name] = Product(
+                    name=name,
+                    description=fake.text(),
+                    price=price_random,
+                    stock=random.randint(0, 100),
+                    category=subcategory.category,
+                    subcategory=subcategory
+                )
+
+        self.bulk_insert(
+            Product,
+            list(new_products.values()),
+            lookup,
+            lambda product: product.name,
+            batch_size,
+        )
+
+        return [lookup[name] for name in names]
+
     def create_products_from_file(self, products_data) -> list[Product]:
         products_obj = []
         for product in products_data:
@@ -270,19 +376,118 @@ class Command(BaseCommand):
             )
             product_obj = Product.objects.get_or_create(
                 name=product['name'],
-                defaults=dict(
-                    description=product['short_description'],
-                    price=Decimal(product['price']).quantize(Decimal('0.01')),
-                    stock=product['stock'],
-                    image_url=product.get('image_url'),
-                    category=category,
-                    subcategory=subcategory,
-                )
+                defaults=self.product_fields(product, category, subcategory)
             )[0]
             products_obj.append(product_obj)
 
         return products_obj
 
+    def product_fields(self, product, category, subcategory) -> dict:
+        return dict(
+            description=product['short_description'],
+            price=Decimal(product['price']).quantize(Decimal('0.01')),
+            stock=product['stock'],
+            brand=product.get('brand') or '',
+            image_url=product.get('image_url'),
+            category=category,
+            subcategory=subcategory,
+        )
+
+    def bulk_create_products_from_file(
+        self, products_data, batch_size, keep_products=False
+    ) -> tuple[int, list[Product]]:
+        """
+            Same result as `create_products_from_file`, but the rows are
+            consumed in batches of `batch_size` with one bulk insert per
+            model and batch. Categories are preloaded in lookup maps and the
+            products of each batch are looked up with a single query, so
+            memory does not grow with the size of the file unless
+            `keep_products` is set.
+        """
+        categories = {
+            category.name: category for category in Category.objects.all()
+        }
+        subcategories = {
+            (subcategory.name, subcategory.category_id): subcategory
+            for subcategory in SubCategory.objects.all()
+        }
+
+        total = 0
+        products_obj = []
+        rows = iter(products_data)
+        while batch := list(islice(rows, batch_size)):
+            total += len(batch)
+
+            new_categories = {
+                product['category']: Category(
+                    name=product['category'],
+                    description=fake.text()
+                )
+                for product in batch
+                if product['category'] not in categories
+            }
+            self.bulk_insert(
+                Category,
+                list(new_categories.values()),
+                categories,
+                lambda category: category.name,
+                batch_size,
+            )
+
+            new_subcategories = {}
+            for product in batch:
+                category = categories[product['category']]
+                key = (product['subcategory'], category.id)
+                if key in subcategories or key in new_subcategories:
+                    continue
+                new_subcategories[key] = SubCategory(
+                    name=product['subcategory'],
+                    category=category,
+                    description=fake.text()
+                )
+            self.bulk_insert(
+                SubCategory,
+                list(new_subcategories.values()),
+                subcategories,
+                lambda subcat: (subcat.name, subcat.category_id),
+                batch_size,
+            )
+
+            products = {}
+            existing = Product.objects.filter(
+                name__in={product['name'] for product in batch}
+            ).order_by('id')
+            for product in existing:
+                products.setdefault(product.name, product)
+
+            new_products = {}
+            for product in batch:
+                name = product['name']
+                if name in products or name in new_products:
+                    continue
+                category = categories[product['category']]
+                subcategory = subcategories[
+                    (product['subcategory'], category.id)
+                ]
+                new_products[name] = Product(
+                    name=name,
+                    **self.product_fields(product, category, subcategory)
+                )
+            self.bulk_insert(
+                Product,
+                list(new_products.values()),
+                products,
+                lambda product: product.name,
+                batch_size,
+            )
+
+            if keep_products:
+                products_obj.extend(
+                    products[product['name']] for product in batch
+                )
+
+        return total, products_obj
+
     def create_sales(self, num_sales, clients, stores, products):
         sales = []
         for _ in range(num_sales):
@@ -322,9 +527,50 @@ class Command(BaseCommand):
         return sales
 
     def read_products_from_file(self, file_path):
+        """
+            Yield the products of a JSON array or JSON Lines file one at a
+            time, without loading the whole file in memory.
+        """
         with open(file_path, 'r') as file:
-            products_data = json.load(file)
-        return products_data
+            first_char = file.read(1)
+            while first_char.isspace():
+                first_char = file.read(1)
+            file.seek(0)
+
+            if first_char == '[':
+                yield from self.read_json_array(file)
+            else:
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def read_json_array(self, file):
+        decoder = json.JSONDecoder()
+        buffer = file.read(READ_SIZE)
+        # Skip everything up to and including the opening bracket
+        pos = buffer.index('[') + 1
+        while True:
+            pos = SEPARATORS.match(buffer, pos).end()
+            if buffer.startswith(']', pos):
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The next item is incomplete, read more of the file
+                chunk = file.read(READ_SIZE)
+                if not chunk or len(buffer) - pos > MAX_ITEM_SIZE:
+                    raise CommandError(f'Invalid JSON array in {file.name}')
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+
+    def write_rate(self, name, total, start):
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed else total
+        self.stdout.write(
+            f'Created {total} {name} in {elapsed:.2f}s ({rate:.0f} rows/s)'
+        )
 
     @transaction.atomic
     def handle(self, *args, **options):
@@ -334,23 +580,43 @@ class Command(BaseCommand):
         stores = self.create_stores()
         self.stdout.write(f'Created {len(stores)} stores')
 
+        bulk, batch_size = options['bulk'], options['batch_size']
+
+        start = time.perf_counter()
         if options['products_file']:
             path = options['products_file']
             self.stdout.write('Reading products from file...')
             products_data = self.read_products_from_file(path)
-            products = self.create_products_from_file(products_data)
-            self.stdout.write(f'Created {len(products_data)} products')
+            if bulk:
+                total, products = self.bulk_create_products_from_file(
+                    products_data,
+                    batch_size,
+                    keep_products=bool(options['create-sales'])
+                )
+            else:
+                products = self.create_products_from_file(products_data)
+                total = len(products)
+            self.write_rate('products', total, start)
         else:
             categ = self.create_categories_and_subcategories()
             self.stdout.write(
                 f'Created {len(categ)} categories with their subcategories'
             )
-            products = self.create_products(options['products'])
-            self.stdout.write(f'Created {len(products)} products')
+            if bulk:
+                products = self.bulk_create_products(
+                    options['products'], batch_size
+                )
+            else:
+                products = self.create_products(options['products'])
+            self.write_rate('products', len(products), start)
 
         # Create main data
-        clients = self.create_clients(options['clients'])
-        self.stdout.write(f'Created {len(clients)} clients')
+        start = time.perf_counter()
+        if bulk:
+            clients = self.bulk_create_clients(options['clients'], batch_size)
+        else:
+            clients = self.create_clients(options['clients'])
+        self.write_rate('clients', len(clients), start)
 
         # Create sales with recommendations
         if options['create-sales']:
@@ -1,25 +1,84 @@
+import time
+from itertools import islice
+
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 
-from apps.store.models import Product
-from apps.store.recommendations.recommendation_service import upsert_product
+from apps.store.recommendations.documents import (
+    product_document,
+    product_metadata,
+)
+from apps.store.recommendations.recommendation_service import upsert_products
+from apps.store.recommendations.sync import (
+    advance_watermark,
+    indexed_products,
+    purge_deleted_products,
+    sync_vectors,
+)
+from apps.store.recommendations.vector_store import get_vector_store
 
 
 class Command(BaseCommand):
     help = 'Populate vectors for products'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of products embedded and upserted at once'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Number of products fetched from the database at once'
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help=(
+                'Only sync the products changed or deleted since the last '
+                'run. Safe to run periodically, e.g. every minute from cron'
+            )
+        )
+
     def handle(self, *args, **options):
-        products = Product.objects.all()
+        if options['incremental']:
+            stats = sync_vectors(options['batch_size'], options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(
+                'Vectors synced: {embedded} embedded, {updated} updated, '
+                '{unchanged} unchanged, {deleted} deleted, neighbours of '
+                '{neighbors} products refreshed'.format(**stats)
+            ))
+            return
+
+        started = timezone.now()
+        products = indexed_products().order_by('id').iterator(
+            chunk_size=options['chunk_size']
+        )
+
+        start = time.perf_counter()
         total = 0
-        for product in products:
-            metadata = {
-                'category': product.category.name,
-                'subcategory': product.subcategory.name,
-            }
-
-            upsert_product(product.name, product.id, metadata)
-            self.stdout.write(
-                self.style.SUCCESS(f'Product {product.name} added to vectors')
+        while batch := list(islice(products, options['batch_size'])):
+            upsert_products(
+                [product_document(product) for product in batch],
+                [product.id for product in batch],
+                [product_metadata(product) for product in batch],
             )
-            total += 1
+            total += len(batch)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.SUCCESS(
+                f'{total} products added to vectors '
+                f'({total / elapsed:.0f} products/s)'
+            ))
+
+        deleted = purge_deleted_products(options['batch_size'])
+        advance_watermark(started)
+        # Group the vectors by category for the filtered queries
+        get_vector_store().compact()
 
         self.stdout.write(self.style.SUCCESS(f'Total products added: {total}'))
+        self.stdout.write(
+            self.style.SUCCESS(f'Deleted products removed: {deleted}')
+        )
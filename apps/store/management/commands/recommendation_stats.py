@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.store.models import Sale
+from apps.store.recommendations.metrics import metrics
+from apps.store.utils import create_recomendation
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the stages of the recommendation pipeline by recommending '
+        'the latest sales again. The vector queries bypass the result '
+        'cache, so every search is timed, and the recommendations are '
+        'rolled back. The embedding cache, and with hybrid ranking the '
+        'co-purchase index, keep what the replay loaded into them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sales',
+            type=int,
+            default=100,
+            help='Latest sales recommended'
+        )
+        parser.add_argument(
+            '--n-results',
+            type=int,
+            default=4,
+            help='Similar products searched for every product of a sale'
+        )
+        parser.add_argument(
+            '--same-category',
+            action='store_true',
+            help='Recommend products of the same category only'
+        )
+        parser.add_argument(
+            '--prometheus',
+            action='store_true',
+            help='Print the metrics in the Prometheus text format'
+        )
+
+    def handle(self, *args, **options):
+        sales = list(Sale.objects.order_by('-id')[:options['sales']])
+        if not sales:
+            self.stdout.write(self.style.WARNING('No sales to recommend'))
+            return
+
+        enabled = metrics.enabled
+        metrics.enabled = True
+        metrics.reset()
+        try:
+            with transaction.atomic():
+                for sale in sales:
+                    create_recomendation(
+                        sale,
+                        same_category=options['same_category'],
+                        n_results=options['n_results'],
+                        use_cache=False,
+                    )
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            metrics.enabled = enabled
+
+        if options['prometheus']:
+            self.stdout.write(metrics.prometheus(), ending='')
+            return
+
+        self.stdout.write(
+            f'{"stage":>20} {"count":>7} {"mean ms":>9} {"p50 ms":>9} '
+            f'{"p95 ms":>9} {"p99 ms":>9}'
+        )
+        for stage, stats in metrics.stats().items():
+            self.stdout.write(
+                f'{stage:>20} {stats["count"]:>7}'
+                + ''.join(
+                    f'{stats[key] * 1000:>10.2f}'
+                    for key in ('mean', 'p50', 'p95', 'p99')
+                )
+            )
+        for event, value in sorted(metrics.counters.items()):
+            self.stdout.write(f'{event:>20} {value:>7}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Recommended {len(sales)} sales, nothing was saved'
+        ))
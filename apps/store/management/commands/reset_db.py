@@ -1,7 +1,13 @@
 from django.core.management.base import BaseCommand
 
-from apps.store.models import Product, Category, SubCategory
-from apps.store.recommendations.chroma_client import reset_collection
+from apps.store.models import (
+    Product,
+    Category,
+    SubCategory,
+    DeletedProduct,
+    SyncState,
+)
+from apps.store.recommendations.vector_store import get_vector_store
 
 
 class Command(BaseCommand):
@@ -25,10 +31,13 @@ class Command(BaseCommand):
         Category.objects.all().delete()
         SubCategory.objects.all().delete()
         Product.objects.all().delete()
+        # The vectors are reset below, nothing is left to sync
+        DeletedProduct.objects.all().delete()
+        SyncState.objects.all().delete()
         self.stdout.write(
             self.style.WARNING(
                 'Deleting all data in the recommendation database...'
             )
         )
-        reset_collection()
+        get_vector_store().reset()
         self.stdout.write(self.style.SUCCESS('Database restored successfully'))
@@ -0,0 +1,123 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.store.jobs import (
+    LEASE_TIMEOUT,
+    MAX_ATTEMPTS,
+    RETRY_DELAY,
+    claim_jobs,
+    process_job,
+)
+from apps.store.recommendations.warmup import setup_process, warm_up
+
+
+def run_job(job_id, max_attempts, retry_delay):
+    # Pool workers keep their own connections between jobs
+    close_old_connections()
+    try:
+        return process_job(job_id, max_attempts, retry_delay)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Process the queued recommendation jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of jobs processed in parallel'
+        )
+        parser.add_argument(
+            '--pool',
+            choices=['thread', 'process'],
+            default='thread',
+            help='Kind of pool used to process the jobs'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=20,
+            help='Number of jobs claimed from the queue at once'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait when the queue is empty'
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=MAX_ATTEMPTS,
+            help='Attempts before a job is moved to the dead letter state'
+        )
+        parser.add_argument(
+            '--retry-delay',
+            type=int,
+            default=RETRY_DELAY,
+            help='Seconds before the first retry of a failed job'
+        )
+        parser.add_argument(
+            '--lease-timeout',
+            type=int,
+            default=LEASE_TIMEOUT,
+            help='Seconds before an unfinished job is picked up again'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty instead of polling'
+        )
+
+    def handle(self, *args, **options):
+        if options['pool'] == 'process':
+            # Spawned workers get their own Django setup and connections
+            executor = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=setup_process,
+            )
+        else:
+            # The threads share the index of this process
+            warm_up()
+            executor = ThreadPoolExecutor(max_workers=options['workers'])
+
+        self.stdout.write(
+            f'Starting {options["workers"]} {options["pool"]} workers...'
+        )
+        done = failed = 0
+        with executor:
+            while True:
+                ids = claim_jobs(
+                    options['batch_size'], options['lease_timeout']
+                )
+                if not ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                results = executor.map(
+                    run_job,
+                    ids,
+                    [options['max_attempts']] * len(ids),
+                    [options['retry_delay']] * len(ids),
+                )
+                for created in results:
+                    if created:
+                        done += 1
+                    else:
+                        failed += 1
+
+                self.stdout.write(f'Processed {done} jobs, {failed} failed')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Queue empty: {done} recommendations created, {failed} failed'
+        ))
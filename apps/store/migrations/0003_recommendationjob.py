@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_product_image_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('dead', 'Dead letter')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='The job will not be picked up before this moment')),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('sale', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='store.sale')),
+            ],
+            options={
+                'verbose_name': 'Recommendation Job',
+                'verbose_name_plural': 'Recommendation Jobs',
+                'indexes': [models.Index(fields=['status', 'available_at'], name='store_recom_status_670f50_idx')],
+            },
+        ),
+    ]
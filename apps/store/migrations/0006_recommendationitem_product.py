@@ -0,0 +1,73 @@
+# Generated by Django 5.1.2 on 2026-10-18 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_products(apps, schema_editor):
+    """
+        Turn every (item, product) pair of the old many-to-many into an item
+        of its own, attached to the same recommendations
+    """
+    RecommendationItem = apps.get_model('store', 'RecommendationItem')
+    Through = RecommendationItem.products.through
+    ItemThrough = apps.get_model('store', 'Recommendation').items.through
+
+    for item in RecommendationItem.objects.all().iterator():
+        product_ids = list(
+            Through.objects.filter(recommendationitem_id=item.pk)
+            .order_by('pk')
+            .values_list('product_id', flat=True)
+        )
+        if not product_ids:
+            item.delete()
+            continue
+
+        item.product_id = product_ids[0]
+        item.save(update_fields=['product'])
+
+        recommendation_ids = list(
+            ItemThrough.objects.filter(recommendationitem_id=item.pk)
+            .values_list('recommendation_id', flat=True)
+        )
+        for product_id in product_ids[1:]:
+            copy = RecommendationItem.objects.create(
+                product_id=product_id, score=item.score
+            )
+            ItemThrough.objects.bulk_create(
+                ItemThrough(
+                    recommendation_id=recommendation_id,
+                    recommendationitem_id=copy.pk,
+                )
+                for recommendation_id in recommendation_ids
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommendationitem',
+            name='product',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='store.product'),
+        ),
+        migrations.AddField(
+            model_name='recommendationitem',
+            name='rank',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Position of the product in the recommendation'),
+        ),
+        migrations.RunPython(copy_products, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='recommendationitem',
+            name='products',
+        ),
+        migrations.AlterField(
+            model_name='recommendationitem',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.product'),
+        ),
+    ]
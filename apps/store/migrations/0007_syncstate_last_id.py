@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_recommendationitem_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncstate',
+            name='last_id',
+            field=models.BigIntegerField(blank=True, help_text='Rows up to this id are already processed', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 11:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_productneighbor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='brand',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
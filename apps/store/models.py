@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -29,6 +30,13 @@ class PaymentMethod(models.TextChoices):
     TRANSFER = 'transfer', _('Bank Transfer')
 
 
+class JobStatus(models.TextChoices):
+    PENDING = 'pending', _('Pending')
+    PROCESSING = 'processing', _('Processing')
+    DONE = 'done', _('Done')
+    DEAD = 'dead', _('Dead letter')
+
+
 #region: Models
 
 class Store(BaseModel):
@@ -69,6 +77,9 @@ class Category(BaseModel):
     class Meta:
         verbose_name = _('Category')
         verbose_name_plural = _('Categories')
+        indexes = [
+            models.Index(fields=['name'], name='category_name_idx'),
+        ]
 
 
 class SubCategory(BaseModel):
@@ -82,6 +93,12 @@ class SubCategory(BaseModel):
     class Meta:
         verbose_name = _('Subcategory')
         verbose_name_plural = _('Subcategories')
+        indexes = [
+            models.Index(
+                fields=['name', 'category'],
+                name='subcategory_name_category_idx'
+            ),
+        ]
 
 
 class Product(BaseModel):
@@ -89,10 +106,24 @@ class Product(BaseModel):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField(default=0)
+    brand = models.CharField(max_length=255, blank=True, default='')
     image_url = models.CharField(max_length=500, blank=True, null=True)
     category = models.ForeignKey('Category', on_delete=models.CASCADE)
     subcategory = models.ForeignKey('SubCategory', on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='product_name_idx'),
+            models.Index(
+                fields=['category', '-id'],
+                name='product_category_id_idx'
+            ),
+            models.Index(
+                fields=['updated_at', 'id'],
+                name='product_updated_id_idx'
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -107,22 +138,36 @@ class Sale(BaseModel):
         choices=PaymentMethod.choices
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['client', 'created_at'],
+                name='sale_client_created_idx'
+            ),
+        ]
+
     def __str__(self):
         return f'{self.client} - {self.store} - {self.total}'
 
 
 class RecommendationItem(BaseModel):
-    products = models.ManyToManyField('Product')
+    product = models.ForeignKey('Product', on_delete=models.CASCADE)
     score = models.FloatField()
+    rank = models.PositiveSmallIntegerField(
+        default=0,
+        help_text=_('Position of the product in the recommendation')
+    )
 
     class Meta:
         ordering = ['-score']
         verbose_name = _('Recommendation Item')
         verbose_name_plural = _('Recommendation Items')
+        indexes = [
+            models.Index(fields=['score'], name='recommendationitem_score_idx'),
+        ]
 
     def __str__(self):
-        str_prod = ', '.join([str(product) for product in self.products.all()])
-        return f'{str_prod} - {self.score}'
+        return f'{self.product} - {self.score}'
 
 
 class Recommendation(BaseModel):
@@ -146,3 +191,83 @@ class Recommendation(BaseModel):
     def __str__(self):
         display = f'{self.id} : {self.client} - {self.confidence_score}'
         return display
+
+
+class ProductNeighbor(BaseModel):
+    """
+        Precomputed nearest neighbour of a product in the vector index
+    """
+    product = models.ForeignKey(
+        'Product', on_delete=models.CASCADE, related_name='neighbors'
+    )
+    neighbor = models.ForeignKey(
+        'Product', on_delete=models.CASCADE, related_name='+'
+    )
+    distance = models.FloatField()
+    same_category = models.BooleanField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        verbose_name = _('Product Neighbor')
+        verbose_name_plural = _('Product Neighbors')
+        indexes = [
+            models.Index(
+                fields=['product', 'same_category', 'rank'],
+                name='productneighbor_lookup_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.neighbor_id} - {self.distance}'
+
+
+class RecommendationJob(BaseModel):
+    sale = models.OneToOneField('Sale', on_delete=models.CASCADE)
+    status = models.CharField(
+        max_length=20,
+        choices=JobStatus.choices,
+        default=JobStatus.PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(
+        default=timezone.now,
+        help_text=_('The job will not be picked up before this moment')
+    )
+    last_error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = _('Recommendation Job')
+        verbose_name_plural = _('Recommendation Jobs')
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.sale_id} - {self.status} ({self.attempts})'
+
+
+class SyncState(BaseModel):
+    name = models.CharField(max_length=100, unique=True)
+    watermark = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text=_('Rows updated before this moment are already synced')
+    )
+    last_id = models.BigIntegerField(
+        blank=True,
+        null=True,
+        help_text=_('Rows up to this id are already processed')
+    )
+
+    def __str__(self):
+        return f'{self.name} - {self.watermark}'
+
+
+class DeletedProduct(BaseModel):
+    """
+        Tombstone of a deleted product, kept until its vector is removed
+    """
+    product_id = models.BigIntegerField()
+
+    def __str__(self):
+        return str(self.product_id)
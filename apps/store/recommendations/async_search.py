@@ -0,0 +1,86 @@
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from apps.store.recommendations.recommendation_service import (
+    get_similar,
+    similar_key,
+)
+
+
+# Threads embedding and searching for the async views of a process. Requests
+# beyond them wait on the event loop, which costs no thread.
+SEARCH_WORKERS = int(os.getenv("SIMILAR_SEARCH_WORKERS", 4))
+
+_lock = threading.Lock()
+_executor = None
+# Searches running on each event loop, by `similar_key`
+_in_flight = weakref.WeakKeyDictionary()
+
+
+def get_search_executor() -> ThreadPoolExecutor:
+    """
+        The executor of the vector searches, created on first use
+    """
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=SEARCH_WORKERS,
+                thread_name_prefix='similar-search',
+            )
+    return _executor
+
+
+async def aget_similar(
+    query: str,
+    n_results: int = 4,
+    prod_category: str = None,
+    add_condition: bool = True,
+    same_category: bool = True,
+):
+    """
+    Async version of `get_similar`.
+    ---
+    The search runs in the bounded executor of the process, and concurrent
+    calls with the same arguments wait for the same search instead of
+    starting one each.
+
+    Args:
+        query (str): The query text to find similar products.
+        n_results (int, optional): The number of results to return.
+        prod_category (str, optional): The category of the product to
+            filter by.
+        add_condition (bool, optional): Whether to add a filter condition.
+        same_category (bool, optional): Whether to include products in the
+            same category.
+
+    Returns:
+        QueryResult: The result of the query.
+    """
+
+    loop = asyncio.get_running_loop()
+    in_flight = _in_flight.setdefault(loop, {})
+    key = similar_key(
+        query, n_results, prod_category, add_condition, same_category
+    )
+
+    future = in_flight.get(key)
+    if future is None:
+        future = in_flight[key] = loop.run_in_executor(
+            get_search_executor(),
+            lambda: get_similar(
+                query=query,
+                n_results=n_results,
+                prod_category=prod_category,
+                add_condition=add_condition,
+                same_category=same_category,
+            )
+        )
+        future.add_done_callback(lambda _: in_flight.pop(key, None))
+
+    # A cancelled request must not cancel the search of the others
+    return await asyncio.shield(future)
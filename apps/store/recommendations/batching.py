@@ -0,0 +1,121 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+# Single-text searches gathered into one embedding call and one query. 1
+# sends every search on its own, without waiting.
+BATCH_SIZE = int(os.getenv("SEARCH_BATCH_SIZE", 1))
+# Milliseconds the first search of a batch waits for others to join it
+BATCH_WAIT_MS = float(os.getenv("SEARCH_BATCH_WAIT_MS", 2))
+
+
+class MicroBatcher:
+    """
+        Gathers the searches submitted by concurrent callers and runs them
+        as multi-text queries.
+        ---
+        A collector thread takes the first pending search, waits up to
+        `max_wait` seconds for others until `max_batch_size` are pending,
+        and runs them all with a single call of `search`. Callers wait on a
+        future with their own result. Searches submitted while a batch runs
+        make up the next one, so batches grow with the load.
+
+        `search` receives the (query text, n_results, where) of every
+        search and returns, in the same order, the single-text result of
+        each one or the exception that failed it.
+    """
+
+    def __init__(
+        self,
+        search,
+        max_batch_size: int = BATCH_SIZE,
+        max_wait: float = BATCH_WAIT_MS / 1000,
+    ) -> None:
+        self.search = search
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.batches = 0
+        self.searches = 0
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def _start(self) -> queue.SimpleQueue:
+        # Threads don't survive a fork, every process starts its own
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                threading.Thread(
+                    target=self._collect,
+                    args=(self._queue,),
+                    name='search-batcher',
+                    daemon=True,
+                ).start()
+                self._pid = os.getpid()
+        return self._queue
+
+    def submit(
+        self,
+        query_text: str,
+        n_results: int,
+        where: dict = None,
+    ) -> Future:
+        """
+            Queue a search, its future resolves to its single-text result
+        """
+        future = Future()
+        pending = self._queue if self._pid == os.getpid() else self._start()
+        pending.put((query_text, n_results, where, future))
+        return future
+
+    def query(self, query_text: str, n_results: int, where: dict = None):
+        """
+            Run a search with the others submitted meanwhile and wait for it
+        """
+        return self.submit(query_text, n_results, where).result()
+
+    def _collect(self, pending: queue.SimpleQueue) -> None:
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch: list) -> None:
+        futures = [future for *_, future in batch]
+        try:
+            results = self.search([
+                (query_text, n_results, where)
+                for query_text, n_results, where, _ in batch
+            ])
+        except Exception as error:
+            results = [error] * len(batch)
+
+        for future, result in zip(futures, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        self.batches += 1
+        self.searches += len(batch)
+
+    def stats(self) -> dict:
+        return {
+            'batches': self.batches,
+            'searches': self.searches,
+            'average_batch': (
+                self.searches / self.batches if self.batches else 0
+            ),
+        }
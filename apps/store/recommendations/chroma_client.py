@@ -1,28 +1,77 @@
 import os
-
-import chromadb
-from chromadb.config import Settings
+import threading
 
 
 DB_PATH = os.getenv("CHROMA_DB_PATH")
 COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME")
 
+# Chroma is only opened by the first process that needs it, not on import:
+# every `manage.py` command, migration and worker boot imports this module
+_lock = threading.Lock()
+_pid = None
+_client = None
+_collection = None
+
 
 def get_chroma_client(db_path, collection_name):
+    import chromadb
+    from chromadb.config import Settings
+
+    from apps.store.recommendations.embedding_cache import (
+        get_embedding_function,
+    )
+
     client = chromadb.PersistentClient(
         path=db_path,
         settings=Settings(allow_reset=True)
     )
-    collection = client.get_or_create_collection(collection_name)
+    collection = client.get_or_create_collection(
+        collection_name,
+        embedding_function=get_embedding_function()
+    )
     return client, collection
 
 
-def reset_collection(client):
+def _connect():
+    global _pid, _client, _collection
+
+    with _lock:
+        if _collection is not None and _pid == os.getpid():
+            return
+        if _pid is not None:
+            # A forked process can't use the system of its parent, which
+            # Chroma keeps cached by path
+            from chromadb.api.shared_system_client import SharedSystemClient
+            SharedSystemClient.clear_system_cache()
+        _client, _collection = get_chroma_client(DB_PATH, COLLECTION_NAME)
+        _pid = os.getpid()
+
+
+def get_client():
+    """
+        The Chroma client of the current process, created on first use
+    """
+    if _client is None or _pid != os.getpid():
+        _connect()
+    return _client
+
+
+def get_collection():
+    """
+        The products collection of the current process, opened on first use
+    """
+    if _collection is None or _pid != os.getpid():
+        _connect()
+    return _collection
+
+
+def reset_collection(client=None):
     """
         Empties and completely resets the database.
         ⚠️ This is destructive and not reversible.
     """
-    client.reset()
-
+    global _collection
 
-client, collection = get_chroma_client(DB_PATH, COLLECTION_NAME)
+    (client or get_client()).reset()
+    # The collection was dropped, it is created again on next use
+    _collection = None
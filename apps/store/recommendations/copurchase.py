@@ -0,0 +1,325 @@
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.db.models import Count, F, Max
+
+from apps.store.models import Sale
+
+
+# Pairs bought together less often are noise, whatever their lift
+MIN_SUPPORT = int(os.getenv("COPURCHASE_MIN_SUPPORT", 2))
+TOP_K = int(os.getenv("COPURCHASE_TOP_K", 20))
+# Seconds between two reads of the new sales
+REFRESH_INTERVAL = float(os.getenv("COPURCHASE_REFRESH_INTERVAL", 60))
+
+METRICS = ('lift', 'confidence')
+
+
+class CopurchaseIndex:
+    """
+        Item-item co-occurrence counts of the sale baskets, with the top-k
+        co-purchased products of every product.
+        ---
+        The counts of the last build are kept as a sparse CSR matrix over
+        NumPy arrays, and sales added since then in a small dict that is
+        merged by the next build. Scores of a product are computed on its
+        first query and kept until one of its counts changes, so queries
+        only read precomputed lists. Lifts are kept without the factor N,
+        which every new basket changes, and multiplied by the current N when
+        they are read, so all of them stay on the same scale.
+
+        For products a and b bought in c(a, b) of N baskets:
+        confidence(a -> b) = c(a, b) / c(a) and
+        lift(a, b) = c(a, b) * N / (c(a) * c(b)).
+    """
+
+    def __init__(
+        self,
+        min_support: int = MIN_SUPPORT,
+        top_k: int = TOP_K,
+    ) -> None:
+        self.min_support = min_support
+        self.top_k = top_k
+
+        self.baskets = 0
+        self.item_counts = Counter()
+        self.watermark = 0
+
+        self.positions = {}
+        self.products = np.empty(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.delta = defaultdict(Counter)
+        self.delta_pairs = 0
+
+        self.tops = {}
+        self.refreshed = None
+        self._lock = threading.RLock()
+
+    # Building
+
+    def build(self) -> None:
+        """
+            Count every basket of the database again. The database does
+            the pair counting, only the distinct pairs are read.
+        """
+        Through = Sale.products.through
+        watermark = Through.objects.aggregate(last=Max('id'))['last'] or 0
+        stored = Through.objects.filter(id__lte=watermark)
+
+        item_counts = Counter(dict(
+            stored.values('product_id').annotate(
+                count=Count('*')
+            ).values_list('product_id', 'count')
+        ))
+        baskets = stored.values('sale_id').distinct().count()
+
+        # Sales saved while this runs can be counted again by `update`,
+        # a few extra counts don't move the statistics
+        pairs = stored.annotate(
+            other=F('sale__products')
+        ).exclude(
+            other=F('product_id')
+        ).values('product_id', 'other').annotate(
+            count=Count('*')
+        ).order_by('product_id', 'other').values_list(
+            'product_id', 'other', 'count'
+        )
+        chunks, chunk = [], []
+        for row in pairs.iterator(chunk_size=10_000):
+            chunk.append(row)
+            if len(chunk) == 100_000:
+                chunks.append(np.array(chunk, dtype=np.int64))
+                chunk = []
+        if chunk:
+            chunks.append(np.array(chunk, dtype=np.int64))
+        rows = (
+            np.concatenate(chunks) if chunks
+            else np.empty((0, 3), dtype=np.int64)
+        )
+
+        products = np.unique(rows[:, 0])
+        indptr = np.zeros(len(products) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(
+            np.bincount(np.searchsorted(products, rows[:, 0]),
+                        minlength=len(products))
+        )
+
+        with self._lock:
+            self.baskets = baskets
+            self.item_counts = item_counts
+            self.watermark = watermark
+            self.products = products
+            self.positions = {
+                int(product): index for index, product in enumerate(products)
+            }
+            self.indptr = indptr
+            self.indices = rows[:, 1].copy()
+            self.counts = rows[:, 2].copy()
+            self.delta = defaultdict(Counter)
+            self.delta_pairs = 0
+            self.tops = {}
+            self.refreshed = time.monotonic()
+
+    def add_basket(self, product_ids, existing=()) -> None:
+        """
+            Count the products added to a basket that already held
+            `existing` products, an empty one if none
+        """
+        new, existing = set(product_ids), set(existing) - set(product_ids)
+        if not new:
+            return
+
+        with self._lock:
+            if not existing:
+                self.baskets += 1
+            for product in new:
+                self.item_counts[product] += 1
+                for other in new - {product}:
+                    self.delta[product][other] += 1
+                for other in existing:
+                    self.delta[product][other] += 1
+                    self.delta[other][product] += 1
+            self.delta_pairs += (
+                len(new) * (len(new) - 1) + 2 * len(new) * len(existing)
+            )
+
+            # Lift depends on the count of the other product too
+            touched = set(new | existing)
+            for product in new:
+                touched.update(self._row(product)[0].tolist())
+            for product in touched:
+                for metric in METRICS:
+                    self.tops.pop((product, metric), None)
+
+    def update(self) -> int:
+        """
+            Count the products added to sales since the last build or
+            update. The matrix is built again once the pending counts grow
+            past a tenth of it.
+
+            Returns:
+                int: The number of sale products read.
+        """
+        Through = Sale.products.through
+        rows = list(
+            Through.objects.filter(id__gt=self.watermark).order_by(
+                'id'
+            ).values_list('id', 'sale_id', 'product_id')
+        )
+        if not rows:
+            self.refreshed = time.monotonic()
+            return 0
+
+        added = defaultdict(list)
+        for _, sale_id, product_id in rows:
+            added[sale_id].append(product_id)
+        existing = defaultdict(list)
+        for sale_id, product_id in Through.objects.filter(
+            sale_id__in=list(added), id__lte=self.watermark
+        ).values_list('sale_id', 'product_id'):
+            existing[sale_id].append(product_id)
+
+        with self._lock:
+            for sale_id, product_ids in added.items():
+                self.add_basket(product_ids, existing[sale_id])
+            self.watermark = rows[-1][0]
+            self.refreshed = time.monotonic()
+            rebuild = self.delta_pairs > max(10_000, len(self.counts) // 10)
+
+        if rebuild:
+            self.build()
+        return len(rows)
+
+    # Scores
+
+    def _row(self, product_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+            The products bought with `product_id` and how many times
+        """
+        position = self.positions.get(product_id)
+        if position is None:
+            others = np.empty(0, dtype=np.int64)
+            counts = np.empty(0, dtype=np.int64)
+        else:
+            start, end = self.indptr[position], self.indptr[position + 1]
+            others, counts = self.indices[start:end], self.counts[start:end]
+
+        delta = self.delta.get(product_id)
+        if delta:
+            merged = Counter(dict(zip(others.tolist(), counts.tolist())))
+            merged.update(delta)
+            others = np.fromiter(merged.keys(), dtype=np.int64)
+            counts = np.fromiter(merged.values(), dtype=np.int64)
+        return others, counts
+
+    def top(self, product_id: int, metric: str = 'lift') -> list:
+        """
+            The top-k (product id, score) pairs of a product
+        """
+        if metric not in METRICS:
+            raise ValueError(f'Unknown metric: {metric}')
+
+        with self._lock:
+            key = (product_id, metric)
+            best = self.tops.get(key)
+            if best is None:
+                best = self.tops[key] = self._top(product_id, metric)
+            if metric == 'lift':
+                return [(other, score * self.baskets) for other, score in best]
+            return best
+
+    def _top(self, product_id: int, metric: str) -> list:
+        others, counts = self._row(product_id)
+        supported = counts >= self.min_support
+        others, counts = others[supported], counts[supported]
+        scores = counts / max(self.item_counts[product_id], 1)
+        if metric == 'lift' and len(others):
+            # Without N, see the class docstring
+            scores = scores / np.fromiter(
+                (self.item_counts[other] for other in others.tolist()),
+                dtype=np.float64,
+                count=len(others)
+            )
+
+        k = min(self.top_k, len(others))
+        best = np.argpartition(-scores, k - 1)[:k] if k else []
+        return sorted(
+            zip(others[best].tolist(), scores[best].tolist()),
+            key=lambda pair: (-pair[1], pair[0])
+        )
+
+    def recommend(
+        self,
+        product_ids,
+        n: int = 4,
+        metric: str = 'lift',
+    ) -> list[tuple[int, float]]:
+        """
+            Products most often bought with the given ones, scored with the
+            sum of their scores for each of them
+        """
+        product_ids = set(product_ids)
+        scores = defaultdict(float)
+        for product_id in product_ids:
+            for other, score in self.top(product_id, metric):
+                if other not in product_ids:
+                    scores[other] += score
+
+        return sorted(scores.items(), key=lambda pair: (-pair[1], pair[0]))[:n]
+
+    def stats(self) -> dict:
+        return {
+            'baskets': self.baskets,
+            'products': len(self.item_counts),
+            'pairs': len(self.counts),
+            'pending_pairs': self.delta_pairs,
+            'cached_tops': len(self.tops),
+        }
+
+
+_lock = threading.Lock()
+_index = None
+
+
+def get_copurchase_index() -> CopurchaseIndex:
+    """
+        The co-purchase index of the process, built on first use and
+        updated with the new sales every REFRESH_INTERVAL seconds
+    """
+    global _index
+
+    with _lock:
+        if _index is None:
+            _index = CopurchaseIndex()
+            _index.build()
+        elif time.monotonic() - _index.refreshed > REFRESH_INTERVAL:
+            _index.update()
+    return _index
+
+
+def get_copurchase_recommendations(
+    product_ids: list[int],
+    n: int = 4,
+    metric: str = 'lift',
+) -> list[tuple[int, float]]:
+    """
+    Recommend the products most often bought together with the given ones.
+    ---
+    Args:
+        product_ids (list[int]): The products of the basket.
+        n (int, optional): The number of products to return.
+        metric (str, optional): 'lift' favours products bought together
+            more than their popularity explains, 'confidence' the ones most
+            often bought with them.
+
+    Returns:
+        list[tuple[int, float]]: (product id, score) pairs, best first. The
+            given products are never recommended.
+    """
+
+    return get_copurchase_index().recommend(product_ids, n, metric)
@@ -0,0 +1,83 @@
+import os
+from bisect import bisect_left
+from decimal import Decimal
+
+from apps.store.models import Product
+
+
+# Characters of the description embedded after the name and brand. The
+# default model reads 256 tokens at most, the rest would be cut anyway.
+DESCRIPTION_CHARS = int(os.getenv("DOCUMENT_DESCRIPTION_CHARS", 300))
+
+# Upper price limits of the price bands stored in the vector metadata,
+# comma separated. A product above the last one gets the last band + 1.
+PRICE_BANDS = [
+    Decimal(limit)
+    for limit in os.getenv("PRICE_BANDS", "10,50,100,500,1000").split(",")
+]
+
+# Bumped whenever `product_metadata` gains or changes keys. The next sync
+# then compares every product, and rewrites the metadata of the vectors
+# indexed with an older version without embedding them again.
+METADATA_VERSION = 2
+
+# Fields read by `product_document` and `product_metadata`
+DOCUMENT_FIELDS = (
+    'id', 'name', 'brand', 'description', 'price', 'stock',
+    'category__name', 'subcategory__name',
+)
+
+
+def price_band(price: Decimal) -> int:
+    """
+        Index of the first PRICE_BANDS limit the price doesn't exceed
+    """
+
+    return bisect_left(PRICE_BANDS, price)
+
+
+def product_document(product: Product) -> str:
+    """
+    Build the text embedded for a product.
+    ---
+    The same text is indexed for the product and used to query the products
+    similar to it, so both sides are embedded alike.
+
+    Args:
+        product (Product): The product, with its brand and description.
+
+    Returns:
+        str: The name, the brand unless the name already holds it, and the
+            beginning of the description, one per line.
+    """
+
+    parts = [product.name]
+    brand = (product.brand or '').strip()
+    if brand and brand.casefold() not in product.name.casefold():
+        parts.append(brand)
+
+    description = ' '.join((product.description or '').split())
+    if len(description) > DESCRIPTION_CHARS:
+        description = description[:DESCRIPTION_CHARS].rsplit(' ', 1)[0]
+    if description:
+        parts.append(description)
+
+    return '\n'.join(parts)
+
+
+def product_metadata(product: Product) -> dict:
+    """
+        The metadata indexed with a product. The product id is repeated
+        here so queries can exclude products inside the `where` filter.
+    """
+
+    return {
+        'category': product.category.name,
+        'subcategory': product.subcategory.name,
+        'product_id': product.id,
+        'brand': product.brand or '',
+        'price': float(product.price),
+        'price_band': price_band(product.price),
+        'stock': product.stock,
+        'in_stock': product.stock > 0,
+    }
@@ -0,0 +1,222 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from chromadb.api.types import (
+    DefaultEmbeddingFunction,
+    Documents,
+    EmbeddingFunction,
+    Embeddings,
+)
+
+
+CACHE_PATH = os.getenv("CHROMA_EMBEDDING_CACHE_PATH")
+CACHE_SIZE = int(os.getenv("CHROMA_EMBEDDING_CACHE_SIZE", 200_000))
+MEMORY_CACHE_SIZE = int(
+    os.getenv("CHROMA_EMBEDDING_MEMORY_CACHE_SIZE", 10_000)
+)
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+        Embedding function that remembers the embeddings of the texts it has
+        already seen, so only new texts reach the wrapped model.
+        ---
+        Embeddings are keyed by (model id, sha256 of the text) and kept in an
+        in-memory LRU and, when `path` is given, in a SQLite file shared by
+        every process. Both layers evict the least recently used entries.
+    """
+
+    def __init__(
+        self,
+        embedding_function: EmbeddingFunction = None,
+        model_id: str = None,
+        path: str = None,
+        max_entries: int = CACHE_SIZE,
+        memory_entries: int = MEMORY_CACHE_SIZE,
+    ) -> None:
+        self.embedding_function = (
+            embedding_function or DefaultEmbeddingFunction()
+        )
+        self.model_id = model_id or self.embedding_function.name()
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+        self.memory = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._db_entries = None
+
+    # Chroma checks the name against the one stored with the collection and
+    # the vectors are the ones of the wrapped function. It is an instance
+    # method so Chroma can't register this class as the wrapped one.
+    def name(self) -> str:
+        return self.embedding_function.name()
+
+    def get_config(self) -> dict:
+        return self.embedding_function.get_config()
+
+    def default_space(self):
+        return self.embedding_function.default_space()
+
+    def supported_spaces(self):
+        return self.embedding_function.supported_spaces()
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [hashlib.sha256(text.encode()).hexdigest() for text in input]
+
+        with self._lock:
+            found = {}
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+            self.memory_hits += len(found)
+
+            missing = {
+                key: text for key, text in zip(keys, input)
+                if key not in found
+            }
+            if missing and self.path:
+                stored = self._read(list(missing))
+                self.disk_hits += len(stored)
+                self._remember(stored)
+                found.update(stored)
+                for key in stored:
+                    del missing[key]
+
+        if missing:
+            embeddings = self.embedding_function(list(missing.values()))
+            computed = {
+                key: np.asarray(embedding, dtype=np.float32)
+                for key, embedding in zip(missing, embeddings)
+            }
+            with self._lock:
+                self.misses += len(computed)
+                self._remember(computed)
+                if self.path:
+                    self._write(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def stats(self) -> dict:
+        """
+            Hit and miss counters of the cache since the process started
+        """
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            'model_id': self.model_id,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': hits / total if total else 0.0,
+            'memory_entries': len(self.memory),
+        }
+
+    def _remember(self, embeddings: dict) -> None:
+        self.memory.update(embeddings)
+        for key in embeddings:
+            self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _connection(self) -> sqlite3.Connection:
+        # A forked process must not reuse the connection of its parent
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False
+            )
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                'model TEXT, key TEXT, vector BLOB, used REAL, '
+                'PRIMARY KEY (model, key))'
+            )
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS embeddings_used '
+                'ON embeddings (used)'
+            )
+            self._db.commit()
+            self._db_pid = os.getpid()
+            self._db_entries = None
+        return self._db
+
+    def _read(self, keys: list[str]) -> dict:
+        db = self._connection()
+        placeholders = ', '.join('?' * len(keys))
+        rows = db.execute(
+            f'SELECT key, vector FROM embeddings '
+            f'WHERE model = ? AND key IN ({placeholders})',
+            [self.model_id, *keys]
+        ).fetchall()
+        if rows:
+            placeholders = ', '.join('?' * len(rows))
+            db.execute(
+                f'UPDATE embeddings SET used = ? '
+                f'WHERE model = ? AND key IN ({placeholders})',
+                [time.time(), self.model_id, *(key for key, _ in rows)]
+            )
+            db.commit()
+
+        return {
+            key: np.frombuffer(vector, dtype=np.float32)
+            for key, vector in rows
+        }
+
+    def _write(self, embeddings: dict) -> None:
+        db = self._connection()
+        now = time.time()
+        cursor = db.executemany(
+            'INSERT OR REPLACE INTO embeddings (model, key, vector, used) '
+            'VALUES (?, ?, ?, ?)',
+            [
+                (self.model_id, key, embedding.tobytes(), now)
+                for key, embedding in embeddings.items()
+            ]
+        )
+        if self._db_entries is None:
+            self._db_entries = db.execute(
+                'SELECT COUNT(*) FROM embeddings'
+            ).fetchone()[0]
+        else:
+            self._db_entries += cursor.rowcount
+
+        if self._db_entries > self.max_entries:
+            # Other processes write to the same file, count again
+            self._db_entries = db.execute(
+                'SELECT COUNT(*) FROM embeddings'
+            ).fetchone()[0]
+            excess = self._db_entries - self.max_entries
+            if excess > 0:
+                db.execute(
+                    'DELETE FROM embeddings WHERE rowid IN ('
+                    'SELECT rowid FROM embeddings ORDER BY used LIMIT ?)',
+                    [excess]
+                )
+                self._db_entries -= excess
+        db.commit()
+
+
+_embedding_function = None
+
+
+def get_embedding_function() -> CachedEmbeddingFunction:
+    """
+        The cached embedding function shared by the whole process
+    """
+    global _embedding_function
+    if _embedding_function is None:
+        _embedding_function = CachedEmbeddingFunction(path=CACHE_PATH)
+    return _embedding_function
@@ -0,0 +1,20 @@
+import re
+import zlib
+
+import numpy as np
+
+
+class HashingEmbedding:
+    """
+        Bag of hashed words, for runs without the embedding model
+    """
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+
+    def __call__(self, input):
+        vectors = np.zeros((len(input), self.dim), dtype=np.float32)
+        for row, text in enumerate(input):
+            for word in re.findall(r'\w+', text.casefold()):
+                vectors[row, zlib.crc32(word.encode()) % self.dim] += 1
+        return vectors
@@ -0,0 +1,190 @@
+import functools
+import os
+import threading
+import time
+from ast import literal_eval
+from bisect import bisect_left
+
+
+# Timings and counters of the recommendation pipeline, kept in the memory of
+# every process. Disabled, a span costs one attribute check.
+ENABLED = literal_eval(os.getenv("RECOMMENDATION_METRICS", "False"))
+
+# Upper bounds in seconds of the histogram buckets
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+STAGE_METRIC = 'store_recommendation_stage_seconds'
+EVENT_METRIC = 'store_recommendation_events_total'
+
+
+class Histogram:
+    """
+        Observations counted in BUCKETS, with their sum
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+            Estimate of the q quantile, interpolated inside its bucket
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+class Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name: str) -> None:
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.metrics.increment(f'{self.name}.errors')
+        return False
+
+
+class NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Metrics:
+    """
+        Registry of the stage timings and event counters of a process.
+        ---
+        Stages are timed with `span`, a context manager observing the
+        seconds spent inside it into the histogram of the stage, and
+        events are counted with `increment`. `prometheus` renders them in
+        the Prometheus text format. Every process keeps its own values, so
+        each one is scraped on its own.
+    """
+
+    def __init__(self, enabled: bool = ENABLED) -> None:
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name)
+
+    def timed(self, name: str):
+        """
+            Decorator timing every call of a function as a span
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name: str, value: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def stats(self) -> dict:
+        """
+            Count, total, mean and p50/p95/p99 seconds of every stage
+        """
+        with self._lock:
+            return {
+                name: {
+                    'count': histogram.count,
+                    'total': histogram.sum,
+                    'mean': histogram.sum / histogram.count,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                    'p99': histogram.quantile(0.99),
+                }
+                for name, histogram in sorted(self.histograms.items())
+                if histogram.count
+            }
+
+    def prometheus(self) -> str:
+        lines = [
+            f'# HELP {STAGE_METRIC} Time spent in the stages of the '
+            'recommendation pipeline.',
+            f'# TYPE {STAGE_METRIC} histogram',
+        ]
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                label = f'stage="{name}"'
+                cumulative = 0
+                for bound, count in zip(
+                    (*map(repr, BUCKETS), '+Inf'), histogram.counts
+                ):
+                    cumulative += count
+                    lines.append(
+                        f'{STAGE_METRIC}_bucket{{{label},le="{bound}"}} '
+                        f'{cumulative}'
+                    )
+                lines.append(f'{STAGE_METRIC}_sum{{{label}}} {histogram.sum}')
+                lines.append(
+                    f'{STAGE_METRIC}_count{{{label}}} {histogram.count}'
+                )
+
+            lines += [
+                f'# HELP {EVENT_METRIC} Events of the recommendation '
+                'pipeline.',
+                f'# TYPE {EVENT_METRIC} counter',
+            ]
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{EVENT_METRIC}{{event="{name}"}} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,252 @@
+import os
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from apps.store.models import Product, ProductNeighbor
+from apps.store.recommendations.documents import (
+    DOCUMENT_FIELDS,
+    product_document,
+)
+from apps.store.recommendations.recommendation_service import (
+    get_batch_recommendations,
+)
+
+
+# 'vectors' queries the vector store at checkout, 'neighbors' reads the
+# precomputed ProductNeighbor table
+RECOMMENDATION_SOURCE = os.getenv("RECOMMENDATION_SOURCE", "vectors")
+N_NEIGHBORS = int(os.getenv("PRODUCT_NEIGHBORS", 8))
+# Nearest products of a changed product checked for listing it, as a
+# multiple of the neighbours kept
+REVERSE_SEARCH_FACTOR = int(os.getenv("PRODUCT_NEIGHBORS_SEARCH_FACTOR", 4))
+
+
+def find_neighbors(
+    products: list[Product],
+    n_neighbors: int = N_NEIGHBORS,
+) -> list[ProductNeighbor]:
+    """
+    Query the nearest neighbours of the given products, inside and outside
+    of their category.
+    ---
+    Args:
+        products (list[Product]): Products with their category and the
+            fields of their document loaded.
+        n_neighbors (int, optional): Neighbours kept of each kind.
+
+    Returns:
+        list[ProductNeighbor]: The unsaved neighbour rows.
+    """
+
+    documents = [
+        (product.category.name, product_document(product))
+        for product in products
+    ]
+    found = {}
+    for same_category in (True, False):
+        results = get_batch_recommendations(
+            documents,
+            # The product itself is the first hit of its own category
+            n_results=n_neighbors + same_category,
+            same_category=same_category,
+            use_cache=False,
+            # Stock changes often, it is filtered when the rows are read
+            in_stock=False,
+        )
+        for product, result in zip(products, results):
+            found[product.id, same_category] = [
+                (int(id_), distance)
+                for id_, distance in zip(
+                    result['ids'][0], result['distances'][0]
+                )
+                if int(id_) != product.id
+            ][:n_neighbors]
+
+    # The index can still hold products deleted since the last sync
+    existing = set(
+        Product.objects.filter(
+            id__in={id_ for hits in found.values() for id_, _ in hits}
+        ).values_list('id', flat=True)
+    )
+
+    return [
+        ProductNeighbor(
+            product_id=product_id,
+            neighbor_id=id_,
+            distance=distance,
+            same_category=same_category,
+            rank=rank,
+        )
+        for (product_id, same_category), hits in found.items()
+        for rank, (id_, distance) in enumerate(
+            (hit for hit in hits if hit[0] in existing), start=1
+        )
+    ]
+
+
+def refresh_neighbors(
+    product_ids,
+    n_neighbors: int = N_NEIGHBORS,
+    batch_size: int = 500,
+) -> int:
+    """
+    Replace the stored neighbours of the given products.
+    ---
+    Args:
+        product_ids: Ids of the products to refresh.
+        n_neighbors (int, optional): Neighbours kept of each kind.
+        batch_size (int, optional): Products queried and written at once.
+
+    Returns:
+        int: The number of products refreshed.
+    """
+
+    product_ids = sorted(set(product_ids))
+    products = Product.objects.select_related(
+        'category', 'subcategory'
+    ).only(*DOCUMENT_FIELDS)
+
+    total = 0
+    for start in range(0, len(product_ids), batch_size):
+        batch = list(
+            products.filter(id__in=product_ids[start:start + batch_size])
+        )
+        neighbors = find_neighbors(batch, n_neighbors)
+        with transaction.atomic():
+            ProductNeighbor.objects.filter(product__in=batch).delete()
+            ProductNeighbor.objects.bulk_create(neighbors)
+        total += len(batch)
+
+    return total
+
+
+def related_products(product_ids) -> set[int]:
+    """
+        Products whose stored neighbours involve the given products: the
+        products listing them and the products they list. The products
+        that should start listing them are found by `reverse_neighbors`.
+    """
+
+    product_ids = list(product_ids)
+    listing = ProductNeighbor.objects.filter(
+        neighbor_id__in=product_ids
+    ).values_list('product_id', flat=True)
+    listed = ProductNeighbor.objects.filter(
+        product_id__in=product_ids
+    ).values_list('neighbor_id', flat=True)
+
+    return set(listing) | set(listed)
+
+
+def reverse_neighbors(
+    product_ids,
+    n_neighbors: int = N_NEIGHBORS,
+    batch_size: int = 500,
+    search_factor: int = REVERSE_SEARCH_FACTOR,
+) -> set[int]:
+    """
+    Find the products whose stored neighbours should now include the given
+    products.
+    ---
+    Distances are symmetric, so a product gains a changed one when the
+    changed product is closer to it than its last stored neighbour of the
+    same kind. The candidates are the nearest products of the changed ones
+    in the index, `search_factor` times as many as the neighbours kept. Call
+    it once the changed products are indexed and before their neighbours
+    are refreshed.
+
+    Args:
+        product_ids: Ids of the new or changed products.
+        n_neighbors (int, optional): Neighbours kept of each kind.
+        batch_size (int, optional): Products queried at once.
+        search_factor (int, optional): Candidates searched per neighbour.
+
+    Returns:
+        set[int]: The ids of the products to refresh.
+    """
+
+    product_ids = sorted(set(product_ids))
+    products = Product.objects.select_related(
+        'category', 'subcategory'
+    ).only(*DOCUMENT_FIELDS)
+
+    candidates = {}
+    for start in range(0, len(product_ids), batch_size):
+        batch = list(
+            products.filter(id__in=product_ids[start:start + batch_size])
+        )
+        documents = [
+            (product.category.name, product_document(product))
+            for product in batch
+        ]
+        for same_category in (True, False):
+            results = get_batch_recommendations(
+                documents,
+                n_results=n_neighbors * search_factor + same_category,
+                same_category=same_category,
+                use_cache=False,
+                in_stock=False,
+            )
+            for product, result in zip(batch, results):
+                for id_, distance in zip(
+                    result['ids'][0], result['distances'][0]
+                ):
+                    key = (int(id_), same_category)
+                    if key[0] != product.id and distance < candidates.get(
+                        key, float('inf')
+                    ):
+                        candidates[key] = distance
+
+    # Number of stored neighbours and distance of the last one
+    stored = {
+        (product_id, same_category): (count, last)
+        for product_id, same_category, count, last in (
+            ProductNeighbor.objects.filter(
+                product_id__in={id_ for id_, _ in candidates}
+            ).values('product_id', 'same_category').annotate(
+                count=Count('id'), last=Max('distance')
+            ).values_list('product_id', 'same_category', 'count', 'last')
+        )
+    }
+
+    return {
+        id_ for (id_, same_category), distance in candidates.items()
+        if (id_, same_category) not in stored
+        or stored[id_, same_category][0] < n_neighbors
+        or distance < stored[id_, same_category][1]
+    }
+
+
+def neighbor_hits(
+    product_ids: list[int],
+    n_results: int,
+    same_category: bool,
+    exclude_ids=(),
+    in_stock: bool = True,
+) -> dict[int, list[tuple[int, float]]]:
+    """
+        The n best stored (neighbour id, distance) pairs of the given
+        products that are not excluded and, with `in_stock`, have stock,
+        read with a single indexed query. Products without stored
+        neighbours are left out.
+    """
+
+    rows = ProductNeighbor.objects.filter(
+        product_id__in=product_ids,
+        same_category=same_category,
+    ).exclude(
+        neighbor_id__in=list(exclude_ids)
+    )
+    if in_stock:
+        rows = rows.filter(neighbor__stock__gt=0)
+
+    hits = {}
+    for product_id, neighbor_id, distance in rows.order_by(
+        'product_id', 'rank'
+    ).values_list('product_id', 'neighbor_id', 'distance'):
+        found = hits.setdefault(product_id, [])
+        if len(found) < n_results:
+            found.append((neighbor_id, distance))
+
+    return hits
@@ -0,0 +1,172 @@
+import os
+from ast import literal_eval
+
+import numpy as np
+
+from apps.store.models import Client, Product, Sale
+
+
+# 'distance' keeps the vector hits ordered by distance, 'hybrid' ranks the
+# vector and co-purchase candidates with `Ranker`
+RECOMMENDATION_RANKING = os.getenv("RECOMMENDATION_RANKING", "distance")
+
+DEFAULT_WEIGHTS = {
+    'similarity': 1.0,
+    'copurchase': 0.5,
+    'popularity': 0.2,
+    'interest': 0.3,
+    'in_stock': 0.5,
+    'purchased': -0.5,
+}
+# Python dict literal overriding some of the weights, e.g. "{'interest': 1}"
+WEIGHTS = {
+    **DEFAULT_WEIGHTS,
+    **literal_eval(os.getenv("RANKING_WEIGHTS", "{}")),
+}
+FEATURES = tuple(DEFAULT_WEIGHTS)
+
+
+class Ranker:
+    """
+        Scores candidates with a weighted sum of their features, all scaled
+        to [0, 1]:
+        ---
+        - similarity: 1 - distance / 2, the cosine of the vector hit
+        - copurchase: co-purchase score relative to the best candidate
+        - popularity: log of the baskets holding the product, relative to
+          the most popular candidate
+        - interest: the category is one of the client interests
+        - in_stock: the product has stock
+        - purchased: the client already bought the product
+    """
+
+    def __init__(self, weights: dict = None) -> None:
+        weights = {**WEIGHTS, **(weights or {})}
+        unknown = set(weights) - set(FEATURES)
+        if unknown:
+            raise ValueError(f'Unknown ranking features: {unknown}')
+        self.weights = np.array(
+            [weights[feature] for feature in FEATURES], dtype=np.float64
+        )
+
+    def rank(
+        self,
+        ids: np.ndarray,
+        features: np.ndarray,
+        n: int,
+    ) -> list[tuple[int, float]]:
+        """
+            The n best (id, score) pairs, given one row of FEATURES per id
+        """
+        scores = features @ self.weights
+        k = min(n, len(ids))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return list(zip(ids[top].tolist(), scores[top].tolist()))
+
+
+def candidate_features(
+    similar: dict[int, float],
+    copurchased: dict[int, float],
+    products: dict[int, tuple[int, int]],
+    popularity: dict[int, int],
+    interests: set[int],
+    purchased: set[int],
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Build the feature matrix of the candidates.
+    ---
+    Args:
+        similar (dict[int, float]): Vector distance of the candidates found
+            by similarity.
+        copurchased (dict[int, float]): Co-purchase score of the candidates
+            bought with the basket.
+        products (dict[int, tuple[int, int]]): (category id, stock) of the
+            candidates. Candidates missing here are dropped.
+        popularity (dict[int, int]): Baskets holding each product.
+        interests (set[int]): Category ids the client is interested in.
+        purchased (set[int]): Products the client already bought.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The candidate ids and their features,
+            one row per id and one column per name in FEATURES.
+    """
+
+    ids = np.fromiter(
+        (id_ for id_ in {**similar, **copurchased} if id_ in products),
+        dtype=np.int64
+    )
+    rows = ids.tolist()
+    nan = float('nan')
+
+    distances = np.array([similar.get(id_, nan) for id_ in rows])
+    copurchase = np.array([copurchased.get(id_, 0.0) for id_ in rows])
+    baskets = np.log1p([popularity.get(id_, 0) for id_ in rows])
+    categories = np.array([products[id_][0] for id_ in rows])
+    stock = np.array([products[id_][1] for id_ in rows])
+
+    columns = {
+        'similarity': np.nan_to_num(np.clip(1 - distances / 2, 0, 1)),
+        'copurchase': copurchase / max(copurchase.max(initial=0), 1e-9),
+        'popularity': baskets / max(baskets.max(initial=0), 1e-9),
+        'interest': np.isin(categories, list(interests)),
+        'in_stock': stock > 0,
+        'purchased': np.isin(ids, list(purchased)),
+    }
+    features = np.column_stack(
+        [columns[feature] for feature in FEATURES]
+    ).astype(np.float64)
+
+    return ids, features
+
+
+def rank_products(
+    client: Client,
+    similar: dict[int, float],
+    copurchased: dict[int, float],
+    n: int,
+    popularity: dict[int, int] = None,
+    weights: dict = None,
+) -> list[tuple[int, float]]:
+    """
+    Rank the candidates of a client's recommendation.
+    ---
+    Reads the candidate products, the client interests and which
+    candidates the client already bought, with one query each. Candidates
+    without stock are dropped, as the vector query drops them, so a strong
+    co-purchase can't bring them back.
+
+    Args:
+        client (Client): The client the recommendation is for.
+        similar (dict[int, float]): Vector distance of the similar
+            candidates.
+        copurchased (dict[int, float]): Co-purchase score of the candidates.
+        n (int): The number of products to return.
+        popularity (dict[int, int], optional): Baskets holding each product.
+        weights (dict, optional): Weights overriding the configured ones.
+
+    Returns:
+        list[tuple[int, float]]: (product id, score) pairs, best first.
+    """
+
+    candidates = list({**similar, **copurchased})
+    products = {
+        id_: (category_id, stock)
+        for id_, category_id, stock in Product.objects.filter(
+            id__in=candidates, stock__gt=0
+        ).values_list('id', 'category_id', 'stock')
+    }
+    interests = set(client.interests.values_list('id', flat=True))
+    purchased = set(
+        Sale.products.through.objects.filter(
+            sale__client=client, product_id__in=candidates
+        ).values_list('product_id', flat=True)
+    )
+
+    ids, features = candidate_features(
+        similar, copurchased, products, popularity or {}, interests,
+        purchased,
+    )
+    return Ranker(weights).rank(ids, features, n)
@@ -1,56 +1,341 @@
-from chromadb.api.types import QueryResult
+from __future__ import annotations
 
-from apps.store.recommendations.chroma_client import collection
+import json
+from typing import TYPE_CHECKING
 
+from apps.store.models import Product
+from apps.store.recommendations.batching import MicroBatcher
+from apps.store.recommendations.documents import (
+    product_document,
+    product_metadata,
+)
+from apps.store.recommendations.metrics import metrics
+from apps.store.recommendations.result_cache import (
+    normalize_text,
+    result_cache,
+)
+from apps.store.recommendations.vector_store import (
+    VectorStore,
+    get_vector_store,
+)
 
-def upsert_product(prod_title: str, prod_id: int, metadata: dict) -> None:
+if TYPE_CHECKING:
+    # chromadb is only imported when the vector store is first used
+    from chromadb.api.types import QueryResult
+
+
+# Keys of a QueryResult that hold one row per query text
+ROW_KEYS = (
+    'ids', 'distances', 'documents', 'metadatas', 'embeddings', 'uris', 'data'
+)
+
+
+def category_condition(prod_category: str, same_category: bool) -> dict:
+    """
+        Build the `where` filter that keeps (or drops) the given category
+    """
+
+    return {
+        "category": {
+            "$in" if same_category else "$nin": [prod_category]
+        }
+    }
+
+
+def recommendation_condition(
+    prod_category: str,
+    same_category: bool,
+    exclude_ids=(),
+    in_stock: bool = True,
+) -> dict:
+    """
+        Build the `where` filter of a recommendation query: the category
+        condition, plus only products with stock and none of
+        `exclude_ids`, so the store returns n usable results at once
+    """
+
+    conditions = [category_condition(prod_category, same_category)]
+    if in_stock:
+        conditions.append({"in_stock": True})
+    if exclude_ids:
+        conditions.append(
+            {"product_id": {"$nin": sorted(set(exclude_ids))}}
+        )
+
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def split_result(result: QueryResult, row: int) -> QueryResult:
+    """
+        Extract the row of a multi-text query as a single-text QueryResult
+    """
+
+    single = {
+        key: [result[key][row]]
+        for key in ROW_KEYS
+        if result.get(key) is not None
+    }
+    single['included'] = result.get('included')
+
+    return single
+
+
+def search_many(
+    searches: list[tuple[str, int, dict]],
+    store: VectorStore = None,
+) -> list:
+    """
+        Run many single-text searches, given as (query text, n_results,
+        where), with one embedding call for all of them, see
+        `VectorStore.query_many`. Returns the single-text result of every
+        search, or the exception of its failed query.
+    """
+
+    store = store or get_vector_store()
+    texts, n_results, wheres = zip(*searches)
+
+    with metrics.span('embed'):
+        embeddings = store.embed(texts)
+    with metrics.span('vector_query'):
+        return store.query_many(embeddings, n_results, wheres)
+
+
+search_batcher = MicroBatcher(search_many)
+
+
+def query_single(
+    query_text: str,
+    n_results: int,
+    where: dict = None,
+) -> QueryResult:
+    """
+        Query the vector store with a single text. With SEARCH_BATCH_SIZE
+        above 1 the query is embedded and run together with the ones
+        other threads submit meanwhile, see `MicroBatcher`.
+    """
+
+    if search_batcher.max_batch_size > 1:
+        with metrics.span('batched_search'):
+            return search_batcher.query(query_text, n_results, where)
+
+    # Chroma embeds the text inside the query, both are timed together
+    with metrics.span('embed_and_query'):
+        return get_vector_store().query(
+            query_texts=[query_text],
+            n_results=n_results,
+            where=where
+        )
+
+
+def upsert_product(product: Product) -> None:
+    """
+        Update the embedding, metadata and document of a product, or create
+        them if they don't exist. The metadata is read from the product, so
+        its stock and price band are always the current ones.
+    """
+
+    upsert_products(
+        [product_document(product)], [product.id], [product_metadata(product)]
+    )
+
+    return None
+
+
+def upsert_products(
+    prod_titles: list[str],
+    prod_ids: list[int],
+    metadatas: list[dict],
+) -> None:
+    """
+        Same as `upsert_product` for many products, embedding all the titles
+        with a single call
+    """
+
+    get_vector_store().upsert(
+        documents=prod_titles,
+        ids=[str(prod_id) for prod_id in prod_ids],
+        metadatas=metadatas
+    )
+    result_cache.invalidate()
+
+    return None
+
+
+def update_metadatas(prod_ids: list[int], metadatas: list[dict]) -> None:
+    """
+        Replace the metadata of already indexed products without embedding
+        their documents again
+    """
+
+    get_vector_store().update(
+        ids=[str(prod_id) for prod_id in prod_ids],
+        metadatas=metadatas
+    )
+    result_cache.invalidate()
+
+    return None
+
+
+def get_products(prod_ids: list[int]) -> dict[int, tuple[str, dict]]:
     """
-        Update the embeddings, metadatas or documents for provided ids,
-        or create them if they don't exist
+        Return the indexed (document, metadata) of the given products, keyed
+        by product id. Products that are not indexed are left out.
     """
 
-    collection.upsert(
-        documents=[prod_title],
-        ids=[str(prod_id)],
-        metadatas=[metadata]
+    result = get_vector_store().get(
+        ids=[str(prod_id) for prod_id in prod_ids],
+        include=['documents', 'metadatas']
     )
 
+    return {
+        int(id_): (document, metadata)
+        for id_, document, metadata in zip(
+            result['ids'], result['documents'], result['metadatas']
+        )
+    }
+
+
+def delete_products(prod_ids: list[int]) -> None:
+    """
+        Remove the given products from the index
+    """
+
+    get_vector_store().delete(ids=[str(prod_id) for prod_id in prod_ids])
+    result_cache.invalidate()
+
     return None
 
 
+def recommendations_key(
+    prod_category: str,
+    prod_name: str,
+    n_results: int,
+    same_category: bool,
+    exclude_ids=(),
+    in_stock: bool = True,
+) -> tuple:
+    return (
+        'recommendations',
+        prod_category,
+        normalize_text(prod_name),
+        n_results,
+        bool(same_category),
+        tuple(sorted(set(exclude_ids))),
+        bool(in_stock),
+    )
+
+
 def get_recommendations(
     prod_category: str,
     prod_name: str,
     n_results: int = 4,
     same_category: bool = False,
+    exclude_ids=(),
+    in_stock: bool = True,
 ) -> QueryResult:
     """
     Retrieve product recommendations based on the given product name and
     category.
     ---
+    Excluded and out-of-stock products are filtered by the vector store
+    itself, so up to `n_results` usable products come back from one query.
+
     Args:
         prod_category (str): The category of the product to filter by.
-        prod_name (str): The name of the product to find recommendations for.
+        prod_name (str): The text of the product to find recommendations
+            for, its `product_document` to query like it was indexed.
         n_results (int, optional): The number of results to return.
         same_category (bool, optional): Whether to include products in the same category.
+        exclude_ids (optional): Ids of products never to recommend, e.g.
+            the ones already in the sale.
+        in_stock (bool, optional): Whether to only recommend products with
+            stock.
 
     Returns:
         QueryResult: The result of the query containing recommended products.
     """
 
-    condition = {
-        "category": {
-            "$in" if same_category else "$nin": [prod_category]
-        }
-    }
-
-    result = collection.query(
-        query_texts=[prod_name],
-        n_results=n_results,
-        where=condition
+    return result_cache.get_or_compute(
+        recommendations_key(
+            prod_category, prod_name, n_results, same_category,
+            exclude_ids, in_stock,
+        ),
+        lambda: query_single(
+            prod_name,
+            n_results,
+            recommendation_condition(
+                prod_category, same_category, exclude_ids, in_stock
+            )
+        )
     )
 
-    return result
+
+def get_batch_recommendations(
+    products: list[tuple[str, str]],
+    n_results: int = 4,
+    same_category: bool = False,
+    use_cache: bool = True,
+    exclude_ids=(),
+    in_stock: bool = True,
+) -> list[QueryResult]:
+    """
+    Retrieve product recommendations for many products at once.
+    ---
+    Products are grouped by category and every group is sent as a single
+    multi-text query, so the number of queries grows with the number of
+    distinct categories instead of the number of products. Products with a
+    cached result are not queried at all.
+
+    Args:
+        products (list[tuple[str, str]]): (category, `product_document`)
+            pairs of the products to find recommendations for.
+        n_results (int, optional): The number of results for each product.
+        same_category (bool, optional): Whether to include products in the same category.
+        use_cache (bool, optional): Whether to read and fill the result
+            cache. Batch jobs skip it so they don't evict the live results.
+        exclude_ids (optional): Ids of products never to recommend to any
+            of the products, e.g. the ones already in the sale.
+        in_stock (bool, optional): Whether to only recommend products with
+            stock.
+
+    Returns:
+        list[QueryResult]: One single-row result per product, in the same
+            order as `products`.
+    """
+
+    keys = [
+        recommendations_key(
+            prod_category, prod_name, n_results, same_category,
+            exclude_ids, in_stock,
+        )
+        for prod_category, prod_name in products
+    ]
+    version = result_cache.version()
+    cached = result_cache.get_many(keys, version) if use_cache else {}
+
+    groups = {}
+    for index, (prod_category, prod_name) in enumerate(products):
+        if keys[index] not in cached:
+            groups.setdefault(prod_category, []).append((index, prod_name))
+
+    metrics.increment('result_cache_hits', len(cached))
+    results = [cached.get(key) for key in keys]
+    computed = {}
+    for prod_category, entries in groups.items():
+        with metrics.span('embed_and_query'):
+            result = get_vector_store().query(
+                query_texts=[prod_name for _, prod_name in entries],
+                n_results=n_results,
+                where=recommendation_condition(
+                    prod_category, same_category, exclude_ids, in_stock
+                )
+            )
+        for row, (index, _) in enumerate(entries):
+            results[index] = computed[keys[index]] = split_result(result, row)
+    if use_cache:
+        result_cache.set_many(computed, version)
+
+    return results
 
 
 def get_similar(
@@ -64,6 +349,8 @@ def get_similar(
     Retrieve products similar to the given query. Optionally, add a filter
     condition based on the product category.
     ---
+    Results are cached until the collection changes, see `ResultCache`.
+
     Args:
         prod_category (str): The category of the product to filter by.
         query (str): The query text to find similar products.
@@ -75,23 +362,114 @@ def get_similar(
         QueryResult: The result of the query.
     """
 
-    if add_condition:
-        if not prod_category:
-            raise ValueError(
-                'Product category is required when adding a condition'
-            )
-        condition = {
-            "category": {
-                "$in" if same_category else "$nin": [prod_category]
-            }
-        }
-    else:
-        condition = None
+    key = similar_key(
+        query, n_results, prod_category, add_condition, same_category
+    )
+    condition = similar_condition(prod_category, add_condition, same_category)
 
-    result = collection.query(
-        query_texts=[query],
-        n_results=n_results,
-        where=condition
+    return result_cache.get_or_compute(
+        key, lambda: query_single(query, n_results, condition)
     )
 
-    return result
+
+def similar_condition(
+    prod_category: str,
+    add_condition: bool,
+    same_category: bool,
+) -> dict:
+    """
+        The `where` filter of a similarity search, None without condition
+    """
+
+    if not add_condition:
+        return None
+    if not prod_category:
+        raise ValueError(
+            'Product category is required when adding a condition'
+        )
+
+    return category_condition(prod_category, same_category)
+
+
+def similar_key(
+    query: str,
+    n_results: int,
+    prod_category: str,
+    add_condition: bool,
+    same_category: bool,
+) -> tuple:
+    return (
+        'similar',
+        normalize_text(query),
+        n_results,
+        prod_category if add_condition else None,
+        bool(same_category) if add_condition else None,
+    )
+
+
+def get_similar_batch(queries: list[dict]) -> list[QueryResult]:
+    """
+    Retrieve the products similar to many queries at once.
+    ---
+    Queries sharing the same filter are sent as a single multi-text query
+    asking for the largest `n_results` of the group, and every row is then
+    cut to the size asked for. Cached queries are not sent at all.
+
+    Args:
+        queries (list[dict]): The arguments of `get_similar` for each
+            query: `query`, and optionally `n_results`, `prod_category`,
+            `add_condition` and `same_category`.
+
+    Returns:
+        list[QueryResult]: One single-row result per query, in the same
+            order as `queries`.
+    """
+
+    specs = [
+        {
+            'n_results': 4,
+            'prod_category': None,
+            'add_condition': True,
+            'same_category': True,
+            **query,
+        }
+        for query in queries
+    ]
+    keys = [similar_key(**spec) for spec in specs]
+    version = result_cache.version()
+    cached = result_cache.get_many(keys, version)
+
+    groups = {}
+    for index, spec in enumerate(specs):
+        if keys[index] not in cached:
+            condition = similar_condition(
+                spec['prod_category'],
+                spec['add_condition'],
+                spec['same_category'],
+            )
+            groups.setdefault(
+                json.dumps(condition, sort_keys=True), (condition, [])
+            )[1].append(index)
+
+    results = [cached.get(key) for key in keys]
+    computed = {}
+    for condition, indexes in groups.values():
+        with metrics.span('embed_and_query'):
+            result = get_vector_store().query(
+                query_texts=[specs[index]['query'] for index in indexes],
+                n_results=max(
+                    specs[index]['n_results'] for index in indexes
+                ),
+                where=condition
+            )
+        for row, index in enumerate(indexes):
+            single = split_result(result, row)
+            for key in ROW_KEYS:
+                if single.get(key) is not None:
+                    single[key] = [
+                        single[key][0][:specs[index]['n_results']]
+                    ]
+            results[index] = computed[keys[index]] = single
+    result_cache.set_many(computed, version)
+
+    return results
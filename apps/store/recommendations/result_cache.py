@@ -0,0 +1,168 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+
+CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", 1024))
+CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", 300))
+# Alias of a Django cache shared by every process, e.g. 'default'
+CACHE_BACKEND = os.getenv("RECOMMENDATION_CACHE_BACKEND")
+
+VERSION_KEY = 'recommendations:version'
+
+
+def normalize_text(text: str) -> str:
+    """
+        Case and whitespace don't change the embedding of the default model
+    """
+    return ' '.join(text.split()).casefold()
+
+
+class ResultCache:
+    """
+        Cache of vector query results in front of the collection.
+        ---
+        Results are kept in an in-process LRU with a TTL and, when `backend`
+        names a Django cache, in that cache too. Every key is stored under
+        the current collection version, so writing to the collection makes
+        all the previous results unreachable. Without a shared backend other
+        processes notice the new version after at most `ttl` seconds.
+
+        Callers read the version before querying the collection and store
+        the result under it, so a result computed while the collection was
+        written is not served as a result of the new version.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_SIZE,
+        ttl: float = CACHE_TTL,
+        backend: str = CACHE_BACKEND,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend_alias = backend
+
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return caches[self.backend_alias] if self.backend_alias else None
+
+    def version(self) -> int:
+        if self.backend:
+            return self.backend.get_or_set(VERSION_KEY, 0, timeout=None)
+        return self._version
+
+    def invalidate(self) -> None:
+        """
+            Bump the collection version, called on every write to it
+        """
+        with self._lock:
+            self._version += 1
+            self.entries.clear()
+
+        if self.backend:
+            try:
+                self.backend.incr(VERSION_KEY)
+            except ValueError:
+                self.backend.set(VERSION_KEY, 1, timeout=None)
+
+    def get_many(self, keys: list[tuple], version: int = None) -> dict:
+        """
+            Return the cached results found for the given keys
+        """
+        if version is None:
+            version = self.version()
+        now = time.monotonic()
+
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self.entries.get((version, key))
+                if entry is not None and entry[0] > now:
+                    self.entries.move_to_end((version, key))
+                    found[key] = entry[1]
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.backend:
+            backend_keys = {
+                self._backend_key(version, key): key for key in missing
+            }
+            stored = self.backend.get_many(list(backend_keys))
+            shared = {
+                backend_keys[backend_key]: value
+                for backend_key, value in stored.items()
+            }
+            self._store(version, shared)
+            found.update(shared)
+            with self._lock:
+                self.backend_hits += len(shared)
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return found
+
+    def set_many(self, results: dict, version: int = None) -> None:
+        """
+            Store results under the version read before computing them
+        """
+        if version is None:
+            version = self.version()
+        self._store(version, results)
+        if self.backend:
+            self.backend.set_many(
+                {
+                    self._backend_key(version, key): value
+                    for key, value in results.items()
+                },
+                timeout=self.ttl
+            )
+
+    def get_or_compute(self, key: tuple, compute):
+        version = self.version()
+        found = self.get_many([key], version)
+        if key in found:
+            return found[key]
+        value = compute()
+        self.set_many({key: value}, version)
+        return value
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'backend_hits': self.backend_hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'entries': len(self.entries),
+            'version': self.version(),
+        }
+
+    def _store(self, version: int, results: dict) -> None:
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in results.items():
+                self.entries[(version, key)] = (expires, value)
+                self.entries.move_to_end((version, key))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _backend_key(self, version: int, key: tuple) -> str:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return f'recommendations:{version}:{digest}'
+
+
+result_cache = ResultCache()
@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+from itertools import islice
+
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from apps.store.models import DeletedProduct, Product, SyncState
+from apps.store.recommendations.documents import (
+    DOCUMENT_FIELDS,
+    METADATA_VERSION,
+    product_document,
+    product_metadata,
+)
+from apps.store.recommendations.neighbors import (
+    RECOMMENDATION_SOURCE,
+    refresh_neighbors,
+    related_products,
+    reverse_neighbors,
+)
+from apps.store.recommendations.recommendation_service import (
+    delete_products,
+    get_products,
+    update_metadatas,
+    upsert_products,
+)
+
+
+# A new metadata version starts without a watermark, see METADATA_VERSION
+VECTOR_SYNC = f'vectors:{METADATA_VERSION}'
+
+# Rows saved by transactions that were still open when the previous sync
+# started can carry an older `updated_at`, so every sync looks back a bit
+# further than the stored watermark. Unchanged rows are cheap to skip.
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+def indexed_products() -> QuerySet:
+    """
+        Products with only the fields that end up in the vector index
+    """
+
+    return Product.objects.select_related(
+        'category', 'subcategory'
+    ).only(*DOCUMENT_FIELDS)
+
+
+def changed_products(since: datetime) -> QuerySet:
+    """
+        Products whose own row, category or subcategory changed after `since`
+    """
+
+    return indexed_products().filter(
+        Q(updated_at__gt=since)
+        | Q(category__updated_at__gt=since)
+        | Q(subcategory__updated_at__gt=since)
+    )
+
+
+def purge_deleted_products(batch_size: int = 500) -> int:
+    """
+    Remove the vectors of the deleted products.
+    ---
+    Args:
+        batch_size (int, optional): Number of vectors removed at once.
+
+    Returns:
+        int: The number of tombstones processed.
+    """
+
+    total = 0
+    while tombstones := list(
+        DeletedProduct.objects.order_by('id').values_list(
+            'id', 'product_id'
+        )[:batch_size]
+    ):
+        delete_products([product_id for _, product_id in tombstones])
+        DeletedProduct.objects.filter(
+            id__in=[id_ for id_, _ in tombstones]
+        ).delete()
+        total += len(tombstones)
+
+    return total
+
+
+def advance_watermark(watermark: datetime, name: str = VECTOR_SYNC) -> None:
+    """
+        Store the watermark unless a newer one was already stored
+    """
+
+    state, _ = SyncState.objects.get_or_create(name=name)
+    SyncState.objects.filter(
+        Q(watermark__isnull=True) | Q(watermark__lt=watermark),
+        id=state.id,
+    ).update(watermark=watermark, updated_at=timezone.now())
+
+
+def sync_vectors(batch_size: int = 500, chunk_size: int = 2000) -> dict:
+    """
+    Bring the vector index up to date with the products table.
+    ---
+    Only the products changed since the last sync are read. Those whose
+    document changed are embedded again, those with only new metadata are
+    updated in place and the rest are skipped. Vectors of deleted products
+    are removed. When checkout reads the precomputed neighbours, those of
+    the changed products, of the products listing them or listed by them,
+    and of the products that should now list them are refreshed. Every
+    step is idempotent, so overlapping runs are safe and a failed run is
+    simply repeated by the next one.
+
+    Args:
+        batch_size (int, optional): Number of products compared and written
+            to the index at once.
+        chunk_size (int, optional): Number of products fetched from the
+            database at once.
+
+    Returns:
+        dict: How many products were embedded, updated, skipped as unchanged
+            and deleted, and how many had their neighbours refreshed.
+    """
+
+    started = timezone.now()
+    state, _ = SyncState.objects.get_or_create(name=VECTOR_SYNC)
+    if state.watermark is None:
+        products = indexed_products()
+    else:
+        products = changed_products(state.watermark - WATERMARK_OVERLAP)
+
+    stats = dict(embedded=0, updated=0, unchanged=0, deleted=0, neighbors=0)
+    changed = set()
+    products = products.order_by('id').iterator(chunk_size=chunk_size)
+    while batch := list(islice(products, batch_size)):
+        indexed = get_products([product.id for product in batch])
+
+        embed, update = [], []
+        for product in batch:
+            document = product_document(product)
+            metadata = product_metadata(product)
+            current = indexed.get(product.id)
+            if current is None or current[0] != document:
+                embed.append((product.id, document, metadata))
+            elif current[1] != metadata:
+                update.append((product.id, metadata))
+            else:
+                stats['unchanged'] += 1
+
+        if embed:
+            ids, documents, metadatas = zip(*embed)
+            upsert_products(list(documents), list(ids), list(metadatas))
+            stats['embedded'] += len(embed)
+            changed.update(ids)
+        if update:
+            ids, metadatas = zip(*update)
+            update_metadatas(list(ids), list(metadatas))
+            stats['updated'] += len(update)
+            # Stock, price and brand don't move the neighbours, the
+            # category does
+            changed.update(
+                id_ for id_, metadata in update
+                if metadata['category'] != indexed[id_][1].get('category')
+            )
+
+    stats['deleted'] = purge_deleted_products(batch_size)
+    if RECOMMENDATION_SOURCE == 'neighbors' and changed:
+        related = related_products(changed) | reverse_neighbors(
+            changed, batch_size=batch_size
+        )
+        stats['neighbors'] = refresh_neighbors(
+            changed | related, batch_size=batch_size
+        )
+    advance_watermark(started)
+
+    return stats
@@ -0,0 +1,913 @@
+import json
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+
+import numpy as np
+from django.core.exceptions import ImproperlyConfigured
+
+from apps.store.recommendations import chroma_client
+
+
+# 'chroma' or 'numpy'
+BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma")
+NUMPY_INDEX_PATH = os.getenv("NUMPY_INDEX_PATH")
+
+VECTORS_FILE = 'vectors.npy'
+INDEX_FILE = 'index.json'
+# Rows written since the index file, one JSON line per write. Every index
+# file starts a journal of its own generation.
+JOURNAL_FILE = 'index.{generation}.log'
+
+# The index file is written again, and a new journal started, once the
+# journal holds this share of the rows
+JOURNAL_RATIO = 0.5
+JOURNAL_MIN_ROWS = 1024
+
+# Rows added after the last compaction are kept unsorted at the end of the
+# matrix, and grouped rows moved to another partition are searched on their
+# own, until together they are this share of it
+COMPACT_RATIO = 0.25
+COMPACT_MIN_ROWS = 1024
+# Filter masks kept in memory, filters excluding given products are seldom
+# repeated
+MAX_MASKS = 64
+
+
+class VectorStore(ABC):
+    """
+        Interface of the product vector index used by the recommendation
+        service. It is the subset of the Chroma collection API in use, so
+        results keep the shape of a Chroma `QueryResult`.
+    """
+
+    @abstractmethod
+    def upsert(self, ids: list[str], documents: list[str],
+               metadatas: list[dict]) -> None:
+        ...
+
+    @abstractmethod
+    def update(self, ids: list[str], metadatas: list[dict]) -> None:
+        ...
+
+    @abstractmethod
+    def get(self, ids: list[str], include: list[str]) -> dict:
+        ...
+
+    @abstractmethod
+    def delete(self, ids: list[str]) -> None:
+        ...
+
+    @abstractmethod
+    def query(self, query_texts: list[str], n_results: int,
+              where: dict = None, query_embeddings=None) -> dict:
+        """
+            Search with `query_texts`, or with their `query_embeddings`
+            when they were already computed with `embed`
+        """
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        ...
+
+    def query_many(self, query_embeddings, n_results: list[int],
+                   wheres: list[dict]) -> list:
+        """
+            Run searches that can each have their own n_results and filter.
+            Returns the single-text result of every search, or the
+            exception of its failed query. Searches sharing both are sent
+            as one query.
+        """
+        groups = {}
+        for index, (n, where) in enumerate(zip(n_results, wheres)):
+            groups.setdefault(
+                (n, json.dumps(where, sort_keys=True)), []
+            ).append(index)
+
+        results = [None] * len(wheres)
+        for indexes in groups.values():
+            try:
+                result = self.query(
+                    query_texts=None,
+                    n_results=n_results[indexes[0]],
+                    where=wheres[indexes[0]],
+                    query_embeddings=query_embeddings[indexes]
+                )
+            except Exception as error:
+                for index in indexes:
+                    results[index] = error
+                continue
+            for row, index in enumerate(indexes):
+                results[index] = result_row(result, row)
+        return results
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+    def compact(self) -> None:
+        """
+            Reorganize the index for faster queries, if the backend can
+        """
+
+    @abstractmethod
+    def reset(self) -> None:
+        """
+            Remove every vector. ⚠️ Not reversible.
+        """
+
+
+class ChromaVectorStore(VectorStore):
+    """
+        The products collection of the Chroma database
+    """
+
+    def upsert(self, ids, documents, metadatas):
+        chroma_client.get_collection().upsert(
+            ids=ids, documents=documents, metadatas=metadatas
+        )
+
+    def update(self, ids, metadatas):
+        chroma_client.get_collection().update(ids=ids, metadatas=metadatas)
+
+    def get(self, ids, include):
+        return chroma_client.get_collection().get(ids=ids, include=include)
+
+    def delete(self, ids):
+        chroma_client.get_collection().delete(ids=ids)
+
+    def query(self, query_texts, n_results, where=None,
+              query_embeddings=None):
+        if query_embeddings is not None:
+            return chroma_client.get_collection().query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where
+            )
+        return chroma_client.get_collection().query(
+            query_texts=query_texts, n_results=n_results, where=where
+        )
+
+    def embed(self, texts):
+        from apps.store.recommendations.embedding_cache import (
+            get_embedding_function,
+        )
+
+        return np.asarray(get_embedding_function()(list(texts)))
+
+    def count(self):
+        return chroma_client.get_collection().count()
+
+    def reset(self):
+        chroma_client.reset_collection()
+
+
+class NumpyVectorStore(VectorStore):
+    """
+        Brute-force cosine index over a float32 matrix, memory-mapped from
+        `path` so every process shares the same pages.
+        ---
+        Rows are unit vectors, so the top-k of a query is one matrix product
+        and an `argpartition`. Metadata values are dictionary encoded into
+        one integer column per key, and the boolean mask of every `where`
+        filter is computed once and kept until the next write. Distances are
+        squared L2 like the default Chroma space (2 - 2 * cosine).
+
+        Rows are kept grouped by `partition_key`, so every category is a
+        contiguous range of the matrix. A query filtered on that key only
+        reads the ranges it selects, without building a mask: a `$nin` query
+        merges the top-k of the ranges around the excluded categories. New
+        rows are appended unsorted and filtered with the mask until
+        `compact` groups them again. Grouped rows whose category changed, or
+        that took the place of a deleted row, stay where they are: they are
+        left out of the scan of their range and searched with the unsorted
+        ones. Writes compact on their own once those rows grow past
+        `COMPACT_RATIO`.
+
+        The matrix grows by doubling and deleted rows are replaced by the
+        last one. Writes are persisted when they return: the rows they
+        changed are appended to a journal, and the whole index file is only
+        written again once the journal grows past `JOURNAL_RATIO` of it. A
+        single process should write at a time; readers in other processes
+        apply the new journal lines, or reload the index when its file
+        changes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedding_function=None,
+        partition_key: str = 'category',
+    ) -> None:
+        self.path = path
+        self.partition_key = partition_key
+        self._embedding_function = embedding_function
+        self._lock = threading.RLock()
+        self._loaded = None
+        self._load()
+
+    @property
+    def embedding_function(self):
+        if self._embedding_function is None:
+            from apps.store.recommendations.embedding_cache import (
+                get_embedding_function,
+            )
+            self._embedding_function = get_embedding_function()
+        return self._embedding_function
+
+    # Storage
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _stat(self, name: str):
+        try:
+            stat = os.stat(self._file(name))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load(self) -> None:
+        loaded = self._stat(INDEX_FILE)
+        if loaded == self._loaded and loaded is not None:
+            self._replay()
+            return
+
+        self.ids, self.documents, self.metadatas = [], [], []
+        # Rows before `partitioned` are grouped, `partitions` maps every
+        # value of the partition key to its (start, end) rows
+        self.partitioned = 0
+        self.partitions = {}
+        self.generation = 0
+        if loaded is not None:
+            with open(self._file(INDEX_FILE)) as file:
+                index = json.load(file)
+            self.ids = index['ids']
+            self.documents = index['documents']
+            self.metadatas = index['metadatas']
+            self.partitioned = index.get('partitioned', 0)
+            self.partitions = {
+                value: (start, end)
+                for value, start, end in index.get('partitions', [])
+            }
+            self.generation = index.get('generation', 0)
+        self._open_vectors()
+
+        self.positions = {id_: row for row, id_ in enumerate(self.ids)}
+        self.vocabularies = {}
+        self.columns = {}
+        for row, metadata in enumerate(self.metadatas):
+            self._encode(row, metadata)
+        # Grouped rows that don't hold the value of their range
+        self.misplaced = set()
+        self._index_partitions()
+        for row in range(self.partitioned):
+            self._place(row)
+        self.masks = {}
+        self._loaded = loaded
+        self._dirty = set()
+        self._journal_offset = 0
+        self._journal_rows = 0
+        self._replay()
+
+    def _vectors_inode(self):
+        stat = self._stat(VECTORS_FILE)
+        return stat and stat[0]
+
+    def _open_vectors(self) -> None:
+        self._vectors_file = self._vectors_inode()
+        self.vectors = None
+        if self._vectors_file is not None:
+            self.vectors = np.load(self._file(VECTORS_FILE), mmap_mode='r+')
+
+    def _journal(self) -> str:
+        return self._file(JOURNAL_FILE.format(generation=self.generation))
+
+    def _replay(self) -> None:
+        """
+            Apply the journal lines written since the last call
+        """
+        try:
+            size = os.path.getsize(self._journal())
+        except FileNotFoundError:
+            return
+        if size <= self._journal_offset:
+            return
+
+        with open(self._journal(), 'rb') as file:
+            file.seek(self._journal_offset)
+            data = file.read(size - self._journal_offset)
+        # A line still being written is read by the next call
+        data = data[:data.rfind(b'\n') + 1]
+        for line in data.splitlines():
+            self._apply(json.loads(line))
+        self._journal_offset += len(data)
+
+        if data:
+            # The matrix file is replaced when it grows
+            if self._vectors_inode() != self._vectors_file:
+                self._open_vectors()
+            self.masks = {}
+
+    def _apply(self, entry: dict) -> None:
+        self.partitioned = entry['partitioned']
+        self.partitions = {
+            value: (start, end) for value, start, end in entry['partitions']
+        }
+        self._index_partitions()
+
+        count = entry['count']
+        self.misplaced = {row for row in self.misplaced if row < count}
+        for row in range(count, len(self.ids)):
+            if self.positions.get(self.ids[row]) == row:
+                del self.positions[self.ids[row]]
+        del self.ids[count:], self.documents[count:], self.metadatas[count:]
+        missing = count - len(self.ids)
+        self.ids.extend([None] * missing)
+        self.documents.extend([None] * missing)
+        self.metadatas.extend([None] * missing)
+
+        for row, id_, document, metadata in entry['rows']:
+            if self.positions.get(self.ids[row]) == row:
+                del self.positions[self.ids[row]]
+            self.ids[row] = id_
+            self.documents[row] = document
+            self.metadatas[row] = metadata
+            self.positions[id_] = row
+            self._encode(row, metadata)
+            self._place(row)
+        self._journal_rows += len(entry['rows'])
+
+    def _partition_list(self) -> list:
+        return [
+            [value, start, end]
+            for value, (start, end) in self.partitions.items()
+        ]
+
+    def persist(self, snapshot: bool = False) -> None:
+        """
+            Flush the vectors and write the changed rows to the journal, or
+            the whole index file when `snapshot` is set or the journal grew
+            too long
+        """
+        with self._lock:
+            if self.vectors is not None:
+                self.vectors.flush()
+            os.makedirs(self.path, exist_ok=True)
+            rows = sorted(row for row in self._dirty if row < len(self.ids))
+            self._dirty = set()
+            self._journal_rows += len(rows)
+            if snapshot or self._loaded is None or self._journal_rows > max(
+                JOURNAL_MIN_ROWS, JOURNAL_RATIO * len(self.ids)
+            ):
+                self._snapshot()
+                return
+
+            line = json.dumps({
+                'count': len(self.ids),
+                'rows': [
+                    [row, self.ids[row], self.documents[row],
+                     self.metadatas[row]]
+                    for row in rows
+                ],
+                'partitioned': self.partitioned,
+                'partitions': self._partition_list(),
+            }) + '\n'
+            with open(self._journal(), 'ab') as file:
+                file.write(line.encode())
+            self._journal_offset += len(line.encode())
+
+    def _snapshot(self) -> None:
+        journal = self._journal()
+        self.generation += 1
+        temp = self._file(INDEX_FILE + '.tmp')
+        with open(temp, 'w') as file:
+            json.dump(
+                {
+                    'ids': self.ids,
+                    'documents': self.documents,
+                    'metadatas': self.metadatas,
+                    'partitioned': self.partitioned,
+                    'partitions': self._partition_list(),
+                    'generation': self.generation,
+                },
+                file
+            )
+        os.replace(temp, self._file(INDEX_FILE))
+        # Readers of the previous index file reload the new one
+        if os.path.exists(journal):
+            os.remove(journal)
+        self._loaded = self._stat(INDEX_FILE)
+        self._journal_offset = 0
+        self._journal_rows = 0
+
+    def _reserve(self, rows: int, dim: int) -> None:
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if rows <= capacity:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        temp = self._file(VECTORS_FILE + '.tmp')
+        vectors = np.lib.format.open_memmap(
+            temp, mode='w+', dtype=np.float32,
+            shape=(max(rows, 2 * capacity, 1024), dim)
+        )
+        if capacity:
+            vectors[:len(self.ids)] = self.vectors[:len(self.ids)]
+        vectors.flush()
+        del vectors
+        os.replace(temp, self._file(VECTORS_FILE))
+        self._open_vectors()
+
+    def compact(self) -> None:
+        """
+            Rewrite the matrix with the rows grouped by partition
+        """
+        with self._lock:
+            self._load()
+            self._compact()
+
+    def _compact(self) -> None:
+        count = len(self.ids)
+        codes = self._column(self.partition_key)[:count].copy()
+        order = np.argsort(codes, kind='stable')
+
+        if count:
+            temp = self._file(VECTORS_FILE + '.tmp')
+            vectors = np.lib.format.open_memmap(
+                temp, mode='w+', dtype=np.float32,
+                shape=self.vectors.shape
+            )
+            for start in range(0, count, 10_000):
+                rows = order[start:start + 10_000]
+                vectors[start:start + len(rows)] = self.vectors[rows]
+            vectors.flush()
+            del vectors
+            os.replace(temp, self._file(VECTORS_FILE))
+            self._open_vectors()
+
+        self.ids = [self.ids[row] for row in order]
+        self.documents = [self.documents[row] for row in order]
+        self.metadatas = [self.metadatas[row] for row in order]
+        self.positions = {id_: row for row, id_ in enumerate(self.ids)}
+        for column in self.columns.values():
+            column[:count] = column[:count][order]
+
+        values = {
+            code: value for value, code in
+            self.vocabularies.get(self.partition_key, {}).items()
+        }
+        codes = codes[order]
+        starts = np.flatnonzero(np.diff(codes, prepend=codes[:1] - 1))
+        ends = np.append(starts[1:], count)
+        self.partitions = {
+            values.get(int(codes[start])): (int(start), int(end))
+            for start, end in zip(starts, ends)
+        }
+        self.partitioned = count
+        self.misplaced = set()
+        self._index_partitions()
+        self.masks = {}
+        self.persist(snapshot=True)
+
+    def _index_partitions(self) -> None:
+        ranges = sorted(
+            (start, end, value)
+            for value, (start, end) in self.partitions.items()
+        )
+        self._starts = [start for start, _, _ in ranges]
+        self._ranges = ranges
+
+    def _place(self, row: int) -> None:
+        """
+            Record whether a grouped row still holds the partition value of
+            the range it is in
+        """
+        index = bisect_right(self._starts, row) - 1
+        if row < self.partitioned and index >= 0 and (
+            self.metadatas[row].get(self.partition_key)
+            != self._ranges[index][2]
+        ):
+            self.misplaced.add(row)
+        else:
+            self.misplaced.discard(row)
+
+    def _save(self) -> None:
+        """
+            Persist a write, compacting the matrix when it got too unsorted
+        """
+        self.masks = {}
+        unsorted = len(self.ids) - self.partitioned + len(self.misplaced)
+        if unsorted > max(COMPACT_MIN_ROWS, COMPACT_RATIO * len(self.ids)):
+            self._compact()
+        else:
+            self.persist()
+
+    # Metadata columns
+
+    def _column(self, key: str) -> np.ndarray:
+        column = self.columns.get(key)
+        if column is None or len(column) < len(self.ids):
+            grown = np.full(max(2 * len(self.ids), 1024), -1, dtype=np.int32)
+            if column is not None:
+                grown[:len(column)] = column
+            column = self.columns[key] = grown
+        return column
+
+    def _encode(self, row: int, metadata: dict) -> None:
+        for key in list(self.columns):
+            if key not in metadata:
+                self._column(key)[row] = -1
+        for key, value in metadata.items():
+            vocabulary = self.vocabularies.setdefault(key, {})
+            code = vocabulary.setdefault(value, len(vocabulary))
+            self._column(key)[row] = code
+
+    def _mask(self, where: dict) -> np.ndarray:
+        key = json.dumps(where, sort_keys=True)
+        mask = self.masks.get(key)
+        if mask is None:
+            if len(self.masks) >= MAX_MASKS:
+                del self.masks[next(iter(self.masks))]
+            mask = self.masks[key] = self._evaluate(where)
+        return mask
+
+    def _evaluate(self, where: dict) -> np.ndarray:
+        count = len(self.ids)
+        if '$and' in where:
+            mask = np.ones(count, dtype=bool)
+            for condition in where['$and']:
+                # Conditions shared by many filters are computed once
+                mask &= self._mask(condition)
+            return mask
+        if '$or' in where:
+            mask = np.zeros(count, dtype=bool)
+            for condition in where['$or']:
+                mask |= self._evaluate(condition)
+            return mask
+
+        mask = np.ones(count, dtype=bool)
+        for key, condition in where.items():
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            vocabulary = self.vocabularies.get(key, {})
+            column = self._column(key)[:count]
+            for operator, value in condition.items():
+                values = value if operator in ('$in', '$nin') else [value]
+                codes = [vocabulary[v] for v in values if v in vocabulary]
+                selected = np.isin(column, codes)
+                if operator in ('$in', '$eq'):
+                    mask &= selected
+                elif operator in ('$nin', '$ne'):
+                    # Like Chroma, rows without the key don't match
+                    mask &= ~selected & (column >= 0)
+                else:
+                    raise ValueError(f'Unsupported operator: {operator}')
+        return mask
+
+    # Collection API
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        return self._normalize(self.embedding_function(list(texts)))
+
+    def _normalize(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def embed(self, texts):
+        return self._embed(texts)
+
+    def upsert(self, ids, documents, metadatas):
+        vectors = self._embed(documents)
+        with self._lock:
+            self._load()
+            new = len({id_ for id_ in ids if id_ not in self.positions})
+            self._reserve(len(self.ids) + new, vectors.shape[1])
+            for id_, document, metadata, vector in zip(
+                ids, documents, metadatas, vectors
+            ):
+                row = self.positions.get(id_)
+                if row is None:
+                    row = self.positions[id_] = len(self.ids)
+                    self.ids.append(id_)
+                    self.documents.append(document)
+                    self.metadatas.append(metadata)
+                else:
+                    self.documents[row] = document
+                    self.metadatas[row] = metadata
+                self.vectors[row] = vector
+                self._encode(row, metadata)
+                self._place(row)
+                self._dirty.add(row)
+            self._save()
+
+    def update(self, ids, metadatas):
+        with self._lock:
+            self._load()
+            for id_, metadata in zip(ids, metadatas):
+                row = self.positions.get(id_)
+                if row is not None:
+                    self.metadatas[row] = metadata
+                    self._encode(row, metadata)
+                    self._place(row)
+                    self._dirty.add(row)
+            self._save()
+
+    def get(self, ids, include=('documents', 'metadatas')):
+        with self._lock:
+            self._load()
+            rows = [
+                self.positions[id_] for id_ in ids if id_ in self.positions
+            ]
+            return {
+                'ids': [self.ids[row] for row in rows],
+                'documents': [self.documents[row] for row in rows],
+                'metadatas': [self.metadatas[row] for row in rows],
+                'included': list(include),
+            }
+
+    def delete(self, ids):
+        with self._lock:
+            self._load()
+            for id_ in ids:
+                row = self.positions.pop(id_, None)
+                if row is None:
+                    continue
+                last = len(self.ids) - 1
+                if row != last:
+                    # Fill the hole with the last row, keeping rows contiguous
+                    self.ids[row] = self.ids[last]
+                    self.documents[row] = self.documents[last]
+                    self.metadatas[row] = self.metadatas[last]
+                    self.vectors[row] = self.vectors[last]
+                    for column in self.columns.values():
+                        column[row] = column[last]
+                    self.positions[self.ids[row]] = row
+                    self._dirty.add(row)
+                self.ids.pop()
+                self.documents.pop()
+                self.metadatas.pop()
+                self.misplaced.discard(last)
+                # The last range shrinks when there are no unsorted rows
+                self.partitioned = min(self.partitioned, last)
+                if row != last:
+                    self._place(row)
+            self._save()
+
+    def query(self, query_texts, n_results, where=None,
+              query_embeddings=None):
+        if query_embeddings is None:
+            queries = self._embed(query_texts)
+        else:
+            queries = self._normalize(query_embeddings)
+        with self._lock:
+            self._load()
+            return self._query(queries, n_results, where)
+
+    def query_many(self, query_embeddings, n_results, wheres):
+        queries = self._normalize(query_embeddings)
+        groups = {}
+        for index, where in enumerate(wheres):
+            groups.setdefault(
+                json.dumps(where, sort_keys=True), (where, [])
+            )[1].append(index)
+
+        results = [None] * len(wheres)
+        with self._lock:
+            self._load()
+            # Every filter searches its own partitions once, for all of
+            # its queries
+            for where, indexes in groups.values():
+                try:
+                    result = self._query(
+                        queries[indexes],
+                        max(n_results[index] for index in indexes),
+                        where,
+                    )
+                except ValueError as error:
+                    for index in indexes:
+                        results[index] = error
+                    continue
+                for row, index in enumerate(indexes):
+                    results[index] = result_row(
+                        result, row, n_results[index]
+                    )
+        return results
+
+    def _query(self, queries, n_results, where):
+        ranges = self._partition_ranges(where)
+        if ranges is None:
+            similarities, rows = self._search_rows(queries, n_results, where)
+        else:
+            similarities, rows = self._search_partitions(
+                queries, n_results, where, ranges
+            )
+        return self._result(similarities, rows)
+
+    def _result(self, similarities, rows):
+        result = {
+            'ids': [], 'distances': [], 'documents': [], 'metadatas': [],
+            'embeddings': None, 'uris': None, 'data': None,
+            'included': ['metadatas', 'documents', 'distances'],
+        }
+        order = np.argsort(-similarities, axis=1)
+        similarities = np.take_along_axis(similarities, order, axis=1)
+        rows = np.take_along_axis(rows, order, axis=1)
+        for row_similarities, found in zip(similarities, rows):
+            # Rows masked out of the similarities sort last
+            matched = np.isfinite(row_similarities)
+            row_similarities, found = row_similarities[matched], found[matched]
+            result['ids'].append([self.ids[row] for row in found])
+            result['distances'].append((2 - 2 * row_similarities).tolist())
+            result['documents'].append(
+                [self.documents[row] for row in found]
+            )
+            result['metadatas'].append(
+                [self.metadatas[row] for row in found]
+            )
+        return result
+
+    def _search_rows(self, queries, n_results, where):
+        count = len(self.ids)
+        if not count or not n_results:
+            empty = np.empty((len(queries), 0), dtype=np.float32)
+            return empty, empty.astype(np.int64)
+        if where:
+            rows = np.flatnonzero(self._mask(where))
+        else:
+            rows = np.arange(count)
+
+        if len(rows) > count // 2:
+            # Gathering most of the rows costs more than scanning them all
+            similarities = (queries @ self.vectors[:count].T)[:, rows]
+        else:
+            similarities = queries @ self.vectors[rows].T
+        similarities, top = top_k(similarities, n_results)
+        return similarities, rows[top]
+
+    def _partition_ranges(self, where):
+        """
+            The row ranges selected by a filter on the partition key, alone
+            or as one of the conditions of an `$and`, or None when the
+            filter can't be answered with them
+        """
+        if not where or not self.partitioned:
+            return None
+        if '$and' in where:
+            where = next(
+                (
+                    condition for condition in where['$and']
+                    if list(condition) == [self.partition_key]
+                ),
+                {}
+            )
+        if list(where) != [self.partition_key]:
+            return None
+        condition = where[self.partition_key]
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        if len(condition) != 1:
+            return None
+
+        (operator, value), = condition.items()
+        values = value if operator in ('$in', '$nin') else [value]
+        if operator in ('$in', '$eq'):
+            ranges = [
+                self.partitions[value] for value in values
+                if value in self.partitions
+            ]
+        elif operator in ('$nin', '$ne'):
+            # Like Chroma, rows without the key don't match
+            ranges = [
+                rows for value, rows in self.partitions.items()
+                if value not in values and value is not None
+            ]
+        else:
+            return None
+        # Deletes can shrink the grouped rows below the last ranges
+        ranges = [
+            (start, min(end, self.partitioned)) for start, end in ranges
+            if start < self.partitioned
+        ]
+
+        # Neighbouring partitions are read as one range
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and merged[-1][1] == start:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        return merged
+
+    def _search_partitions(self, queries, n_results, where, ranges):
+        mask = self._mask(where)
+        # Other conditions of an `$and` still drop rows inside the ranges
+        exact = list(where) == [self.partition_key]
+        inside = mask
+        misplaced = np.array(sorted(self.misplaced), dtype=np.int64)
+        if len(misplaced):
+            # Searched below with the unsorted rows
+            inside = mask.copy()
+            inside[misplaced] = False
+            exact = False
+
+        found_similarities, found_rows = [], []
+        for start, end in ranges:
+            similarities = queries @ self.vectors[start:end].T
+            if not exact and not inside[start:end].all():
+                similarities[:, ~inside[start:end]] = -np.inf
+            similarities, top = top_k(similarities, n_results)
+            found_similarities.append(similarities)
+            found_rows.append(top + start)
+
+        # Rows added since the last compaction and misplaced rows
+        tail = np.concatenate([
+            misplaced[mask[misplaced]],
+            self.partitioned + np.flatnonzero(
+                mask[self.partitioned:len(self.ids)]
+            ),
+        ])
+        if len(tail):
+            similarities, top = top_k(
+                queries @ self.vectors[tail].T, n_results
+            )
+            found_similarities.append(similarities)
+            found_rows.append(tail[top])
+
+        if not found_rows:
+            empty = np.empty((len(queries), 0))
+            return empty, empty.astype(np.int64)
+        similarities, top = top_k(
+            np.concatenate(found_similarities, axis=1), n_results
+        )
+        rows = np.take_along_axis(
+            np.concatenate(found_rows, axis=1), top, axis=1
+        )
+        return similarities, rows
+
+    def count(self):
+        with self._lock:
+            self._load()
+            return len(self.ids)
+
+    def reset(self):
+        with self._lock:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._loaded = None
+            self._load()
+
+
+def result_row(result: dict, row: int, n: int = None) -> dict:
+    """
+        The row of a multi-text query result as a single-text result, with
+        at most n results
+    """
+    single = {
+        key: None if value is None else [value[row][:n]]
+        for key, value in result.items()
+        if key != 'included'
+    }
+    single['included'] = result.get('included')
+    return single
+
+
+def top_k(similarities: np.ndarray, k: int) -> tuple:
+    """
+        The k highest similarities of every row, unsorted, and their columns
+    """
+    k = min(k, similarities.shape[1])
+    if k == 0:
+        top = np.empty((len(similarities), 0), dtype=np.int64)
+    else:
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(similarities, top, axis=1), top
+
+
+_lock = threading.Lock()
+_vector_store = None
+
+
+def get_vector_store() -> VectorStore:
+    """
+        The vector store selected by `VECTOR_STORE_BACKEND`, created on
+        first use
+    """
+    global _vector_store
+
+    with _lock:
+        if _vector_store is None:
+            if BACKEND == 'numpy':
+                if not NUMPY_INDEX_PATH:
+                    raise ImproperlyConfigured(
+                        'NUMPY_INDEX_PATH is required when '
+                        'VECTOR_STORE_BACKEND is numpy'
+                    )
+                _vector_store = NumpyVectorStore(NUMPY_INDEX_PATH)
+            elif BACKEND == 'chroma':
+                _vector_store = ChromaVectorStore()
+            else:
+                raise ValueError(f'Unknown vector store backend: {BACKEND}')
+    return _vector_store
@@ -0,0 +1,26 @@
+import django
+
+
+def warm_up() -> None:
+    """
+        Build the co-purchase index before the first hybrid recommendation
+        needs it, so no job pays for the full build
+    """
+    # The models can only be imported once Django is set up
+    from django.db import close_old_connections
+
+    from apps.store.recommendations.copurchase import get_copurchase_index
+    from apps.store.recommendations.ranking import RECOMMENDATION_RANKING
+
+    if RECOMMENDATION_RANKING == 'hybrid':
+        get_copurchase_index()
+        close_old_connections()
+
+
+def setup_process() -> None:
+    """
+        Initializer of the spawned worker processes, importable before
+        Django is set up
+    """
+    django.setup()
+    warm_up()
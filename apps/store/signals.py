@@ -1,17 +1,20 @@
-from django.db.models.signals import m2m_changed
+from django.db.models.signals import m2m_changed, post_delete
 from django.dispatch import receiver
 
-from apps.store.models import Sale
-from apps.store.utils import create_recomendation
+from apps.store.jobs import enqueue_recommendation
+from apps.store.models import DeletedProduct, Product, Sale
 
 
 @receiver(m2m_changed, sender=Sale.products.through)
 def m2m_changed_sale_products(sender, instance, action, **kwargs):
     if action == 'post_add':
-        try:
-            if not instance.products.all():
-                return
-            create_recomendation(instance)
-        except Exception as e:
-            print(f'Error creating recommendation: {e}')
-            pass
+        if not instance.products.exists():
+            return
+        # Recommendations are generated by `run_recommendation_worker`
+        enqueue_recommendation(instance)
+
+
+@receiver(post_delete, sender=Product)
+def post_delete_product(sender, instance, **kwargs):
+    # The vector is removed by `populate_vectors`
+    DeletedProduct.objects.create(product_id=instance.pk)
@@ -1,3 +1,1830 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.store.jobs import (
+    LEASE_TIMEOUT,
+    claim_jobs,
+    enqueue_recommendation,
+    process_job,
+)
+from apps.store.management.commands import (
+    backfill_recommendations,
+    populate_store,
+)
+from apps.store.models import (
+    Category,
+    Client,
+    DeletedProduct,
+    JobStatus,
+    Product,
+    ProductNeighbor,
+    Recommendation,
+    RecommendationItem,
+    RecommendationJob,
+    Sale,
+    Store,
+    SubCategory,
+    SyncState,
+)
+from apps.store.recommendations.async_search import aget_similar
+from apps.store.recommendations.batching import MicroBatcher
+from apps.store.recommendations.copurchase import CopurchaseIndex
+from apps.store.recommendations.documents import (
+    DESCRIPTION_CHARS,
+    product_document,
+    product_metadata,
+)
+from apps.store.recommendations.embedding_cache import (
+    CachedEmbeddingFunction,
+)
+from apps.store.recommendations.hashing_embedding import HashingEmbedding
+from apps.store.recommendations.metrics import Metrics
+from apps.store.recommendations.ranking import Ranker, candidate_features
+from apps.store.recommendations.recommendation_service import (
+    get_batch_recommendations,
+    recommendation_condition,
+    search_many,
+)
+from apps.store.recommendations.result_cache import (
+    ResultCache,
+    result_cache,
+)
+from apps.store.recommendations.sync import (
+    VECTOR_SYNC,
+    advance_watermark,
+    sync_vectors,
+)
+from apps.store.recommendations.vector_store import (
+    NumpyVectorStore,
+    VectorStore,
+    get_vector_store,
+)
+from apps.store.utils import (
+    create_recomendation,
+    recommendation_hits,
+    save_recommendations,
+)
+
+
+class ChromaStartupTests(SimpleTestCase):
+    def test_check_does_not_open_chroma(self):
+        # A fresh interpreter, modules imported by this test run don't count
+        code = (
+            'import sys, django;'
+            'from django.core.management import call_command;'
+            'django.setup();'
+            'call_command("check");'
+            'print("chromadb" in sys.modules)'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        self.assertEqual(result.stdout.splitlines()[-1], 'False')
+
+
+class ProductDocumentTests(SimpleTestCase):
+    def test_document_and_metadata(self):
+        product = Product(
+            id=7,
+            name='Ventilador de techo Liliana',
+            brand='Liliana',
+            description='  Cuatro aspas\nde madera ' + 'y luz ' * 100,
+            price=Decimal('75.50'),
+            stock=0,
+            category=Category(name='Climatización'),
+            subcategory=SubCategory(name='Ventiladores'),
+        )
+
+        document = product_document(product)
+        name, description = document.split('\n')
+        # The brand is already in the name
+        self.assertEqual(name, 'Ventilador de techo Liliana')
+        self.assertTrue(description.startswith('Cuatro aspas de madera y'))
+        self.assertLessEqual(len(description), DESCRIPTION_CHARS)
+        self.assertTrue(description.endswith('luz'))
+
+        product.name = 'Ventilador VT-20'
+        self.assertEqual(
+            product_document(product).split('\n')[:2],
+            ['Ventilador VT-20', 'Liliana']
+        )
+        self.assertEqual(product_metadata(product), {
+            'category': 'Climatización',
+            'subcategory': 'Ventiladores',
+            'product_id': 7,
+            'brand': 'Liliana',
+            'price': 75.5,
+            'price_band': 2,
+            'stock': 0,
+            'in_stock': False,
+        })
+
+
+@mock.patch.object(populate_store, 'READ_SIZE', 16)
+class ProductsFileTests(SimpleTestCase):
+    products = [
+        {'name': f'Fan {i}', 'tags': ['a, b', '[c]'], 'price': i}
+        for i in range(20)
+    ]
+
+    def read(self, content):
+        with tempfile.TemporaryDirectory() as path:
+            file_path = os.path.join(path, 'products.json')
+            with open(file_path, 'w') as file:
+                file.write(content)
+            return list(
+                populate_store.Command().read_products_from_file(file_path)
+            )
+
+    def test_json_array_is_read_across_chunks(self):
+        content = '  ' + json.dumps(self.products, indent=2)
+
+        self.assertEqual(self.read(content), self.products)
+        self.assertEqual(self.read('[]'), [])
+
+    def test_json_lines(self):
+        content = '\n'.join(map(json.dumps, self.products)) + '\n\n'
+
+        self.assertEqual(self.read(content), self.products)
+
+    def test_invalid_array(self):
+        with self.assertRaises(CommandError):
+            self.read('[{"name": "Fan"}, {"name": ')
+
+    @mock.patch.object(populate_store, 'MAX_ITEM_SIZE', 64)
+    def test_invalid_item_stops_buffering(self):
+        content = '[{"name": "Fan"}, {"name": "Lamp" "price": 1}, '
+        content += json.dumps(self.products * 10)[1:]
+        file = io.StringIO(content)
+        file.name = 'products.json'
+        read = []
+
+        with self.assertRaises(CommandError):
+            for item in populate_store.Command().read_json_array(file):
+                read.append(item)
+
+        self.assertEqual(read, [{'name': 'Fan'}])
+        # Stopped long before the end of the file
+        self.assertLess(file.tell(), len(content) / 4)
+
+
+class BulkPopulateStoreTests(TestCase):
+    rows = [
+        {'name': 'Fan 1', 'category': 'Fans', 'subcategory': 'Ceiling',
+         'short_description': 'New fan', 'price': '20', 'stock': 3},
+        {'name': 'Fan 2', 'category': 'Fans', 'subcategory': 'Ceiling',
+         'short_description': 'Fan', 'price': '30.555', 'stock': 0,
+         'brand': 'Aire'},
+        {'name': 'Lamp', 'category': 'Lamps', 'subcategory': 'Desk',
+         'short_description': 'Lamp', 'price': '15', 'stock': 4,
+         'image_url': 'https://example.com/lamp.png'},
+        # Duplicated name, the first row wins
+        {'name': 'Fan 2', 'category': 'Lamps', 'subcategory': 'Desk',
+         'short_description': 'Other', 'price': '1', 'stock': 1},
+        # Same subcategory name in another category
+        {'name': 'Strap', 'category': 'Cameras', 'subcategory': 'Accessories',
+         'short_description': 'Strap', 'price': '5', 'stock': 9},
+        {'name': 'Dock', 'category': 'Consoles', 'subcategory': 'Accessories',
+         'short_description': 'Dock', 'price': '50', 'stock': 2},
+        {'name': 'Lamp', 'category': 'Lamps', 'subcategory': 'Desk',
+         'short_description': 'Lamp', 'price': '15', 'stock': 4},
+    ]
+
+    def load(self, bulk):
+        """
+            The rows of the fixture file loaded on top of existing ones, in
+            a transaction that is rolled back
+        """
+        with tempfile.TemporaryDirectory() as path:
+            file_path = os.path.join(path, 'products.jsonl')
+            with open(file_path, 'w') as file:
+                file.write('\n'.join(map(json.dumps, self.rows)))
+
+            with transaction.atomic():
+                category = Category.objects.create(
+                    name='Fans', description='Existing'
+                )
+                subcategory = SubCategory.objects.create(
+                    name='Ceiling', category=category, description='Existing'
+                )
+                Product.objects.create(
+                    name='Fan 1', description='Existing', price=10, stock=1,
+                    category=category, subcategory=subcategory
+                )
+
+                command = populate_store.Command()
+                rows = command.read_products_from_file(file_path)
+                if bulk:
+                    total, products = command.bulk_create_products_from_file(
+                        rows, batch_size=2, keep_products=True
+                    )
+                    self.assertEqual(total, len(self.rows))
+                else:
+                    products = command.create_products_from_file(rows)
+
+                loaded = {
+                    'returned': [
+                        (product.name, product.description)
+                        for product in products
+                    ],
+                    'categories': sorted(
+                        Category.objects.values_list('name', flat=True)
+                    ),
+                    'existing': list(
+                        Category.objects.filter(
+                            description='Existing'
+                        ).values_list('name', flat=True)
+                    ),
+                    'subcategories': sorted(
+                        SubCategory.objects.values_list(
+                            'name', 'category__name'
+                        )
+                    ),
+                    'products': sorted(
+                        Product.objects.values_list(
+                            'name', 'description', 'price', 'stock', 'brand',
+                            'image_url', 'category__name',
+                            'subcategory__name', 'subcategory__category__name'
+                        )
+                    ),
+                }
+                transaction.set_rollback(True)
+        return loaded
+
+    def test_bulk_load_matches_the_row_by_row_load(self):
+        loaded = self.load(bulk=False)
+
+        self.assertEqual(self.load(bulk=True), loaded)
+        self.assertEqual(len(loaded['returned']), len(self.rows))
+        self.assertEqual(loaded['existing'], ['Fans'])
+        self.assertEqual(len(loaded['subcategories']), 4)
+        self.assertEqual(
+            [product[:4] for product in loaded['products']],
+            [
+                ('Dock', 'Dock', Decimal('50.00'), 2),
+                ('Fan 1', 'Existing', Decimal('10.00'), 1),
+                ('Fan 2', 'Fan', Decimal('30.56'), 0),
+                ('Lamp', 'Lamp', Decimal('15.00'), 4),
+                ('Strap', 'Strap', Decimal('5.00'), 9),
+            ]
+        )
+
+
+    def generate(self, bulk):
+        """
+            Fake products and clients with repeated names, generated in a
+            transaction that is rolled back
+        """
+        names = iter(['Fan', 'Lamp', 'Fan', 'Heater'] * 3)
+        client_names = iter(['Ana Gil', 'Bo Li', 'Ana Gil'])
+        command = populate_store.Command()
+        with transaction.atomic(), mock.patch.object(
+            command, 'get_product_name', lambda subcategory: next(names)
+        ), mock.patch.object(
+            populate_store.fake, 'name', lambda: next(client_names)
+        ):
+            category = Category.objects.create(name='Fans')
+            for name in ('Ceiling', 'Desk', 'Tower'):
+                SubCategory.objects.create(name=name, category=category)
+            Client.objects.create(name='Bo Li', email='bo.li@store.com')
+            if bulk:
+                products = command.bulk_create_products(4, batch_size=2)
+                clients = command.bulk_create_clients(3, batch_size=2)
+            else:
+                products = command.create_products(4)
+                clients = command.create_clients(3)
+
+            generated = {
+                'returned': (
+                    [product.name for product in products],
+                    [client.email for client in clients],
+                ),
+                'products': sorted(
+                    Product.objects.values_list('name', 'subcategory__name')
+                ),
+                'clients': sorted(
+                    Client.objects.values_list('name', 'email')
+                ),
+            }
+            transaction.set_rollback(True)
+        return generated
+
+    def test_bulk_generation_matches_the_row_by_row_one(self):
+        generated = self.generate(bulk=False)
+
+        self.assertEqual(self.generate(bulk=True), generated)
+        self.assertEqual(
+            generated['products'],
+            [('Fan', 'Ceiling'), ('Heater', 'Ceiling'), ('Lamp', 'Ceiling')]
+        )
+        self.assertEqual(len(generated['clients']), 2)
+
+
+class CountingEmbedding(HashingEmbedding):
+    def __init__(self):
+        super().__init__(dim=16)
+        self.calls = []
+
+    def __call__(self, input):
+        self.calls.append(list(input))
+        return super().__call__(input)
+
+
+class CachedEmbeddingFunctionTests(SimpleTestCase):
+    def cached(self, embedding, **kwargs):
+        cached = CachedEmbeddingFunction(embedding, model_id='test', **kwargs)
+        self.addCleanup(lambda: cached._db and cached._db.close())
+        return cached
+
+    def test_memory_cache_evicts_the_least_recently_used(self):
+        embedding = CountingEmbedding()
+        cached = self.cached(embedding, memory_entries=2)
+
+        first = cached(['fan', 'lamp'])
+        again = cached(['fan'])
+        cached(['heater'])  # Evicts 'lamp', 'fan' was used later
+        cached(['lamp', 'fan'])
+
+        np.testing.assert_array_equal(first[0], again[0])
+        self.assertEqual(
+            embedding.calls, [['fan', 'lamp'], ['heater'], ['lamp']]
+        )
+        stats = cached.stats()
+        self.assertEqual(
+            (stats['memory_hits'], stats['misses'], stats['memory_entries']),
+            (2, 4, 2)
+        )
+        self.assertAlmostEqual(stats['hit_ratio'], 2 / 6)
+
+    def test_disk_cache_is_shared_and_bounded(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'embeddings.sqlite3')
+        writer = self.cached(
+            CountingEmbedding(), path=path, max_entries=2, memory_entries=1
+        )
+        for text in ('fan', 'lamp', 'heater'):
+            writer([text])
+
+        embedding = CountingEmbedding()
+        reader = self.cached(embedding, path=path)
+        reader(['lamp', 'heater', 'fan'])
+
+        # 'fan' was the least recently used entry of the full file
+        self.assertEqual(embedding.calls, [['fan']])
+        self.assertEqual(reader.stats()['disk_hits'], 2)
+        self.assertEqual(reader.stats()['misses'], 1)
+
+
+class ResultCacheTests(SimpleTestCase):
+    def test_least_recently_used_entries_are_evicted(self):
+        results = ResultCache(max_entries=2, ttl=60, backend=None)
+        results.set_many({('a',): 1, ('b',): 2})
+        results.get_many([('a',)])
+        results.set_many({('c',): 3})
+
+        self.assertEqual(
+            results.get_many([('a',), ('b',), ('c',)]),
+            {('a',): 1, ('c',): 3}
+        )
+        self.assertEqual(results.stats()['hits'], 3)
+        self.assertEqual(results.stats()['misses'], 1)
+
+    @mock.patch('apps.store.recommendations.result_cache.time.monotonic')
+    def test_entries_expire_after_the_ttl(self, monotonic):
+        monotonic.return_value = 100
+        results = ResultCache(ttl=10, backend=None)
+        results.set_many({('a',): 1})
+
+        monotonic.return_value = 109
+        self.assertEqual(results.get_many([('a',)]), {('a',): 1})
+        monotonic.return_value = 111
+        self.assertEqual(results.get_many([('a',)]), {})
+
+    def test_invalidate_hides_previous_results(self):
+        results = ResultCache(backend=None)
+        results.set_many({('a',): 1})
+
+        results.invalidate()
+
+        self.assertEqual(results.get_many([('a',)]), {})
+        self.assertEqual(results.get_or_compute(('a',), lambda: 2), 2)
+        self.assertEqual(results.get_or_compute(('a',), lambda: 3), 2)
+
+    def test_result_computed_during_a_write_is_not_kept(self):
+        results = ResultCache(backend=None)
+
+        def compute():
+            # The collection is written while the old one is queried
+            results.invalidate()
+            return 'stale'
+
+        self.assertEqual(results.get_or_compute(('a',), compute), 'stale')
+        self.assertEqual(results.get_or_compute(('a',), lambda: 'new'), 'new')
+
+    def test_backend_is_shared_between_processes(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        writer = ResultCache(backend='default')
+        reader = ResultCache(backend='default')
+        writer.set_many({('a',): 1})
+
+        self.assertEqual(reader.get_many([('a',)]), {('a',): 1})
+        self.assertEqual(reader.stats()['backend_hits'], 1)
+
+        writer.invalidate()
+        self.assertEqual(reader.get_many([('a',)]), {})
+
+
+class ProductListQueryTests(TestCase):
+    url = reverse('product-list')
+
+    def create_products(self, total):
+        category = Category.objects.create(name='Climatization')
+        subcategory = SubCategory.objects.create(
+            name='Fans', category=category
+        )
+        Product.objects.bulk_create(
+            Product(
+                name=f'Fan {i}',
+                description='Standing fan',
+                price=10,
+                category=category,
+                subcategory=subcategory,
+            )
+            for i in range(total)
+        )
+
+    def test_constant_queries_per_page(self):
+        self.create_products(30)
+
+        # One COUNT(*) for the pagination and one SELECT for the page
+        for params in ({}, {'mode': 'compact'}, {'fields': 'id,name'}):
+            for limit in (1, 20):
+                with self.assertNumQueries(2):
+                    response = self.client.get(
+                        self.url, {'limit': limit, **params}
+                    )
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_compact_mode_is_flat(self):
+        self.create_products(1)
+
+        response = self.client.get(self.url, {'mode': 'compact'})
+        product = response.data['results'][0]
+
+        self.assertEqual(product['category_name'], 'Climatization')
+        self.assertEqual(product['subcategory_name'], 'Fans')
+        self.assertIsInstance(product['category'], int)
+
+    def test_sparse_fieldsets(self):
+        self.create_products(1)
+
+        response = self.client.get(self.url, {'fields': 'id,name,price'})
+
+        self.assertEqual(
+            set(response.data['results'][0]), {'id', 'name', 'price'}
+        )
+
+
+class KeysetPaginationTests(TestCase):
+    def walk(self, url, params):
+        pages = []
+        response = self.client.get(url, {'pagination': 'cursor', **params})
+        while True:
+            pages.append([row['id'] for row in response.data['results']])
+            if not response.data['next']:
+                return pages
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(response.data['next'])
+            self.assertFalse(
+                any('COUNT(' in query['sql'] for query in queries)
+            )
+
+    def test_cursor_walks_every_product_once(self):
+        category = Category.objects.create(name='Climatization')
+        subcategory = SubCategory.objects.create(
+            name='Fans', category=category
+        )
+        Product.objects.bulk_create(
+            Product(
+                name=f'Fan {i}',
+                description='',
+                price=10,
+                category=category,
+                subcategory=subcategory,
+            )
+            for i in range(25)
+        )
+
+        with self.assertNumQueries(1):
+            self.client.get(
+                reverse('product-list'), {'pagination': 'cursor'}
+            )
+        pages = self.walk(reverse('product-list'), {'limit': 10})
+
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(
+            sum(pages, []),
+            list(Product.objects.order_by('-id').values_list('id', flat=True))
+        )
+
+    def test_categories_keep_their_name_order(self):
+        for name in ('Audio', 'Climatization', 'Bikes', 'Audio'):
+            Category.objects.create(name=name)
+
+        pages = self.walk(reverse('category-list'), {'limit': 2})
+
+        self.assertEqual(
+            sum(pages, []),
+            list(
+                Category.objects.order_by('-name', '-id').values_list(
+                    'id', flat=True
+                )
+            )
+        )
+
+
+@unittest.skipUnless(
+    connection.vendor == 'sqlite', 'Query plans are checked on SQLite'
+)
+class IndexUsageTests(TestCase):
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(f'INDEX {index}', plan)
+        # The index must also give the order, without a sort step
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_category_name(self):
+        self.assertUsesIndex(
+            Category.objects.filter(name='Fans'), 'category_name_idx'
+        )
+
+    def test_subcategory_name_and_category(self):
+        self.assertUsesIndex(
+            SubCategory.objects.filter(name='Fans', category_id=1),
+            'subcategory_name_category_idx'
+        )
+
+    def test_product_name(self):
+        self.assertUsesIndex(
+            Product.objects.filter(name='Fan'), 'product_name_idx'
+        )
+
+    def test_products_of_category_newest_first(self):
+        self.assertUsesIndex(
+            Product.objects.filter(category_id=1).order_by('-id'),
+            'product_category_id_idx'
+        )
+
+    def test_products_updated_since(self):
+        self.assertUsesIndex(
+            Product.objects.filter(
+                updated_at__gt=timezone.now()
+            ).order_by('updated_at', 'id'),
+            'product_updated_id_idx'
+        )
+
+    def test_sales_of_client_by_date(self):
+        self.assertUsesIndex(
+            Sale.objects.filter(client_id=1).order_by('-created_at'),
+            'sale_client_created_idx'
+        )
+
+    def test_recommendation_item_score(self):
+        self.assertUsesIndex(
+            RecommendationItem.objects.filter(score=0.5),
+            'recommendationitem_score_idx'
+        )
+        self.assertUsesIndex(
+            RecommendationItem.objects.all(), 'recommendationitem_score_idx'
+        )
+
+
+class SalesMixin:
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Fans')
+        subcategory = SubCategory.objects.create(
+            name='Ceiling', category=category
+        )
+        cls.products = Product.objects.bulk_create(
+            Product(
+                name=f'Fan {i}',
+                description='',
+                price=1,
+                stock=1,
+                category=category,
+                subcategory=subcategory,
+            )
+            for i in range(10)
+        )
+        client = Client.objects.create(name='Client')
+        store = Store.objects.create(name='Store', local_number='1')
+        cls.sales = Sale.objects.bulk_create(
+            Sale(client=client, store=store, total=1, payment_method='cash')
+            for _ in range(5)
+        )
+
+
+class VectorStoreMixin:
+    """
+        Serves the recommendation service from a NumPy store of hashed
+        words in a temporary directory
+    """
+    embedding_function = HashingEmbedding
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = NumpyVectorStore(
+            directory.name, self.embedding_function()
+        )
+        result_cache.invalidate()
+        patcher = mock.patch(
+            'apps.store.recommendations.recommendation_service'
+            '.get_vector_store',
+            return_value=self.store
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class SaveRecommendationsTests(SalesMixin, TestCase):
+    def hits(self, count):
+        return [
+            (product.id, 0.1 * (i + 1))
+            for i, product in enumerate(self.products[:count])
+        ]
+
+    def test_constant_number_of_statements(self):
+        with self.assertNumQueries(6):
+            save_recommendations([(self.sales[0], self.hits(2))])
+        with self.assertNumQueries(6):
+            save_recommendations(
+                [(sale, self.hits(10)) for sale in self.sales]
+            )
+
+    def test_one_item_per_product_ranked_by_score(self):
+        first, second, third = (product.id for product in self.products[:3])
+        hits = [(second, 0.5), (first, 0.3), (second, 0.2), (third, 0.8)]
+
+        recommendation, = save_recommendations([(self.sales[0], hits)])
+
+        items = recommendation.items.order_by('rank')
+        self.assertEqual(
+            [(item.product_id, item.score, item.rank) for item in items],
+            [(second, 0.2, 1), (first, 0.3, 2), (third, 0.8, 3)]
+        )
+        # Average of the saved items, not of the duplicated hits
+        self.assertEqual(float(recommendation.confidence_score), 0.43)
+        self.assertEqual(recommendation.client_id, self.sales[0].client_id)
+
+    def test_missing_products_are_skipped(self):
+        recommendation, = save_recommendations(
+            [(self.sales[0], [(self.products[0].id, 0.1), (10**9, 0.2)])]
+        )
+
+        self.assertEqual(
+            list(recommendation.items.values_list('product_id', flat=True)),
+            [self.products[0].id]
+        )
+        self.assertEqual(float(recommendation.confidence_score), 0.1)
+
+
+class CreateRecommendationTests(SalesMixin, TestCase):
+    def setUp(self):
+        result_cache.invalidate()
+        self.addCleanup(result_cache.invalidate)
+        self.store = mock.Mock(spec=VectorStore)
+        self.store.query.side_effect = self.query
+        patcher = mock.patch(
+            'apps.store.recommendations.recommendation_service'
+            '.get_vector_store',
+            return_value=self.store
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def query(self, query_texts, n_results, where=None):
+        recommended = str(self.products[-1].id)
+        return {
+            'ids': [[recommended] for _ in query_texts],
+            'distances': [[0.2] for _ in query_texts],
+        }
+
+    def test_one_vector_query_per_category(self):
+        lamps = Category.objects.create(name='Lamps')
+        Product.objects.filter(
+            id__in=[product.id for product in self.products[3:5]]
+        ).update(category=lamps)
+        sale = self.sales[0]
+        sale.products.add(*self.products[:5])
+
+        recommendation = create_recomendation(sale)
+
+        self.assertEqual(self.store.query.call_count, 2)
+        self.assertEqual(
+            sorted(
+                len(call.kwargs['query_texts'])
+                for call in self.store.query.call_args_list
+            ),
+            [2, 3]
+        )
+        self.assertEqual(
+            list(recommendation.items.values_list('product_id', flat=True)),
+            [self.products[-1].id]
+        )
+
+        # Answered by the result cache
+        create_recomendation(sale)
+        self.assertEqual(self.store.query.call_count, 2)
+
+
+class RecommendationJobTests(SalesMixin, TestCase):
+    def test_enqueue_resets_the_job_of_the_sale(self):
+        sale = self.sales[0]
+        job = enqueue_recommendation(sale)
+        RecommendationJob.objects.filter(id=job.id).update(
+            status=JobStatus.DEAD, attempts=5, last_error='Error'
+        )
+
+        enqueue_recommendation(sale)
+
+        job = RecommendationJob.objects.get(sale=sale)
+        self.assertEqual(
+            (job.status, job.attempts, job.last_error),
+            (JobStatus.PENDING, 0, None)
+        )
+
+    def test_claim_returns_only_the_jobs_it_updated(self):
+        first, second = (
+            enqueue_recommendation(sale) for sale in self.sales[:2]
+        )
+        update = QuerySet.update
+
+        def racing_update(queryset, **kwargs):
+            # Another worker claims the first job after the select
+            update(
+                RecommendationJob.objects.filter(id=first.id),
+                status=JobStatus.PROCESSING,
+                updated_at=timezone.now(),
+            )
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', racing_update):
+            ids = claim_jobs(10)
+
+        self.assertEqual(ids, [second.id])
+
+    def test_expired_lease_is_claimed_again(self):
+        job = enqueue_recommendation(self.sales[0])
+        self.assertEqual(claim_jobs(10), [job.id])
+        self.assertEqual(claim_jobs(10), [])
+
+        RecommendationJob.objects.filter(id=job.id).update(
+            updated_at=timezone.now() - timedelta(seconds=LEASE_TIMEOUT + 1)
+        )
+
+        self.assertEqual(claim_jobs(10), [job.id])
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+
+    @mock.patch('apps.store.jobs.create_recomendation')
+    def test_failed_job_backs_off_then_goes_to_dead_letter(self, create):
+        create.side_effect = ValueError('No vectors')
+        job = enqueue_recommendation(self.sales[0])
+
+        for attempt, delay in ((1, 10), (2, 20)):
+            start = timezone.now()
+            self.assertEqual(claim_jobs(10), [job.id])
+            with self.assertLogs('apps.store.jobs', 'ERROR'):
+                self.assertFalse(process_job(job.id, 3, 10))
+
+            job.refresh_from_db()
+            self.assertEqual(
+                (job.status, job.attempts), (JobStatus.PENDING, attempt)
+            )
+            self.assertAlmostEqual(
+                job.available_at,
+                start + timedelta(seconds=delay),
+                delta=timedelta(seconds=1)
+            )
+            self.assertIn('No vectors', job.last_error)
+            # Not runnable before its delay
+            self.assertEqual(claim_jobs(10), [])
+            RecommendationJob.objects.filter(id=job.id).update(
+                available_at=timezone.now()
+            )
+
+        claim_jobs(10)
+        with self.assertLogs('apps.store.jobs', 'ERROR'):
+            self.assertFalse(process_job(job.id, 3, 10))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (JobStatus.DEAD, 3))
+
+    @mock.patch('apps.store.jobs.create_recomendation')
+    def test_processed_job_is_done(self, create):
+        job = enqueue_recommendation(self.sales[0])
+        claim_jobs(10)
+
+        self.assertTrue(process_job(job.id))
+
+        create.assert_called_once_with(self.sales[0])
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.DONE)
+
+    def test_job_of_a_deleted_sale_is_skipped(self):
+        sale = Sale.objects.create(
+            client=self.sales[0].client,
+            store=self.sales[0].store,
+            total=1,
+            payment_method='cash',
+        )
+        job = enqueue_recommendation(sale)
+        claim_jobs(10)
+        sale.delete()
+
+        with self.assertLogs('apps.store.jobs', 'WARNING'):
+            self.assertFalse(process_job(job.id))
+
+
+class VectorSyncTests(SalesMixin, VectorStoreMixin, TestCase):
+    def age_rows(self):
+        # Everything was saved long before the next sync
+        past = timezone.now() - timedelta(days=1)
+        for model in (Product, Category, SubCategory):
+            model.objects.update(updated_at=past)
+
+    def test_sync_reads_only_rows_changed_since_the_watermark(self):
+        self.assertEqual(sync_vectors()['embedded'], 10)
+        self.age_rows()
+        renamed, sold_out = self.products[:2]
+        renamed.name = 'Tower fan'
+        renamed.save()
+        Product.objects.filter(id=sold_out.id).update(
+            stock=0, updated_at=timezone.now()
+        )
+
+        stats = sync_vectors()
+
+        self.assertEqual(
+            stats,
+            dict(embedded=1, updated=1, unchanged=0, deleted=0, neighbors=0)
+        )
+        indexed = self.store.get([str(renamed.id), str(sold_out.id)])
+        self.assertEqual(indexed['documents'][0], 'Tower fan')
+        self.assertFalse(indexed['metadatas'][1]['in_stock'])
+
+        self.age_rows()
+        self.assertEqual(sync_vectors()['unchanged'], 0)
+
+    def test_deleted_products_are_purged(self):
+        sync_vectors()
+        deleted = self.products[0]
+        Product.objects.filter(id=deleted.id).delete()
+        self.assertEqual(DeletedProduct.objects.count(), 1)
+
+        self.assertEqual(sync_vectors()['deleted'], 1)
+
+        self.assertEqual(self.store.get([str(deleted.id)])['ids'], [])
+        self.assertEqual(self.store.count(), 9)
+        self.assertFalse(DeletedProduct.objects.exists())
+
+    @mock.patch(
+        'apps.store.recommendations.sync.RECOMMENDATION_SOURCE', 'neighbors'
+    )
+    def test_new_product_enters_the_neighbours_of_existing_ones(self):
+        sync_vectors()
+        self.age_rows()
+        first = self.products[0]
+        # Same document as the first product, its nearest neighbour
+        twin = Product.objects.create(
+            name=first.name,
+            description='',
+            price=1,
+            stock=1,
+            category=first.category,
+            subcategory=first.subcategory,
+        )
+
+        stats = sync_vectors()
+
+        # Only the first product ranks it above its last neighbour
+        self.assertEqual(stats['neighbors'], 2)
+        nearest = ProductNeighbor.objects.get(
+            product=first, same_category=True, rank=1
+        )
+        self.assertEqual(nearest.neighbor_id, twin.id)
+        self.assertEqual(
+            ProductNeighbor.objects.get(
+                product=twin, same_category=True, rank=1
+            ).neighbor_id,
+            first.id
+        )
+
+    def test_new_metadata_version_rewrites_older_metadata(self):
+        # Indexed before the stock and the product id were in the metadata
+        self.store.upsert(
+            documents=[product_document(p) for p in self.products],
+            ids=[str(product.id) for product in self.products],
+            metadatas=[
+                {'category': 'Fans', 'subcategory': 'Ceiling'}
+                for _ in self.products
+            ],
+        )
+        self.age_rows()
+        SyncState.objects.create(name='vectors', watermark=timezone.now())
+
+        stats = sync_vectors()
+
+        self.assertEqual((stats['embedded'], stats['updated']), (0, 10))
+        results = get_batch_recommendations(
+            [('Fans', product_document(self.products[0]))],
+            n_results=2,
+            same_category=True,
+            exclude_ids=[self.products[0].id],
+        )
+        self.assertEqual(len(results[0]['ids'][0]), 2)
+
+    def test_watermark_only_moves_forward(self):
+        now = timezone.now()
+        advance_watermark(now)
+        advance_watermark(now - timedelta(hours=1))
+
+        self.assertEqual(
+            SyncState.objects.get(name=VECTOR_SYNC).watermark, now
+        )
+
+
+class PopulateVectorsTests(SalesMixin, TestCase):
+    def populate(self, batch_size):
+        store = mock.Mock(spec=VectorStore)
+        with mock.patch(
+            'apps.store.recommendations.recommendation_service'
+            '.get_vector_store',
+            return_value=store
+        ), mock.patch(
+            'apps.store.management.commands.populate_vectors'
+            '.get_vector_store',
+            return_value=store
+        ), self.assertNumQueries(4):
+            # The products, the tombstones, and the watermark read and
+            # written, whatever the number of batches
+            call_command(
+                'populate_vectors', '--batch-size', str(batch_size),
+                stdout=io.StringIO()
+            )
+        return store
+
+    def test_one_upsert_per_batch(self):
+        SyncState.objects.create(name=VECTOR_SYNC)
+        for batch_size in (3, 4, 10):
+            store = self.populate(batch_size)
+
+            self.assertEqual(
+                store.upsert.call_count,
+                math.ceil(len(self.products) / batch_size)
+            )
+            upserted = [
+                id_ for call in store.upsert.call_args_list
+                for id_ in call.kwargs['ids']
+            ]
+            self.assertEqual(
+                upserted, [str(product.id) for product in self.products]
+            )
+            store.compact.assert_called_once()
+
+
+class BackfillRecommendationsTests(SalesMixin, VectorStoreMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for sale in self.sales:
+            sale.products.add(*self.products[:2])
+        sync_vectors()
+
+    def backfill(self, *args):
+        out = io.StringIO()
+        call_command(
+            'backfill_recommendations', '--workers', '1',
+            '--chunk-size', '2', '--same-category', *args, stdout=out
+        )
+        return out.getvalue()
+
+    def last_id(self):
+        return SyncState.objects.get(
+            name=backfill_recommendations.BACKFILL
+        ).last_id
+
+    def test_interrupted_run_is_resumed(self):
+        recommend_chunk = backfill_recommendations.recommend_chunk
+        calls = []
+
+        def failing(*args):
+            calls.append(args)
+            if len(calls) > 1:
+                raise RuntimeError('Vector store down')
+            return recommend_chunk(*args)
+
+        with mock.patch.object(
+            backfill_recommendations, 'recommend_chunk', failing
+        ):
+            with self.assertRaises(RuntimeError):
+                self.backfill()
+        self.assertEqual(self.last_id(), self.sales[1].id)
+
+        output = self.backfill()
+
+        self.assertIn(f'Resuming after sale {self.sales[1].id}', output)
+        self.assertIn('Backfilled 3 sales', output)
+        self.assertEqual(
+            set(
+                Recommendation.objects.values_list('sale_id', flat=True)
+            ),
+            {sale.id for sale in self.sales}
+        )
+
+    def test_completed_run_starts_over(self):
+        self.assertIn('Backfilled 5 sales', self.backfill())
+        self.assertIsNone(self.last_id())
+
+        since = (timezone.now() - timedelta(hours=1)).isoformat()
+        output = self.backfill('--since', since)
+
+        self.assertIn('Backfilled 5 sales', output)
+        self.assertEqual(Recommendation.objects.count(), 5)
+
+
+class RecommendationStatsTests(SalesMixin, VectorStoreMixin, TestCase):
+    def test_replay_bypasses_the_result_cache(self):
+        for sale in self.sales:
+            sale.products.add(*self.products[:2])
+        sync_vectors()
+        # The live recommendation leaves its searches in the result cache
+        create_recomendation(self.sales[0], same_category=True)
+        out = io.StringIO()
+
+        call_command(
+            'recommendation_stats', '--sales', '1', '--same-category',
+            stdout=out
+        )
+
+        self.assertRegex(out.getvalue(), r'result_cache_hits +0\n')
+        self.assertIn('vector_search', out.getvalue())
+        self.assertEqual(Recommendation.objects.count(), 1)
+
+
+class ProductNeighborTests(SalesMixin, TestCase):
+    @mock.patch('apps.store.utils.RECOMMENDATION_SOURCE', 'neighbors')
+    @mock.patch('apps.store.utils.get_batch_recommendations')
+    def test_checkout_reads_stored_neighbors(self, vector_query):
+        first, second, *others = self.products
+        ProductNeighbor.objects.bulk_create(
+            ProductNeighbor(
+                product=product,
+                neighbor=neighbor,
+                distance=rank / 10,
+                same_category=False,
+                rank=rank,
+            )
+            for product in (first, second)
+            for rank, neighbor in enumerate(others, start=1)
+        )
+        sale = self.sales[0]
+        sale.products.add(first, second)
+
+        recommendation = create_recomendation(sale, n_results=2)
+
+        vector_query.assert_not_called()
+        self.assertEqual(
+            list(
+                recommendation.items.order_by('rank').values_list(
+                    'product_id', 'score'
+                )
+            ),
+            [(others[0].id, 0.1), (others[1].id, 0.2)]
+        )
+
+    @mock.patch('apps.store.utils.RECOMMENDATION_SOURCE', 'neighbors')
+    @mock.patch('apps.store.utils.get_batch_recommendations')
+    def test_skips_sale_and_out_of_stock_neighbors(self, vector_query):
+        first, second, sold_out, *others = self.products
+        Product.objects.filter(id=sold_out.id).update(stock=0)
+        ProductNeighbor.objects.bulk_create(
+            ProductNeighbor(
+                product=first,
+                neighbor=neighbor,
+                distance=rank / 10,
+                same_category=False,
+                rank=rank,
+            )
+            for rank, neighbor in enumerate(
+                [second, sold_out, *others], start=1
+            )
+        )
+        sale = self.sales[0]
+        sale.products.add(first, second)
+
+        recommendation = create_recomendation(sale, n_results=2)
+
+        # The second product has no stored neighbours
+        vector_query.assert_called_once()
+        self.assertEqual(
+            vector_query.call_args.kwargs['exclude_ids'],
+            [first.id, second.id]
+        )
+        self.assertEqual(
+            list(
+                recommendation.items.order_by('rank').values_list(
+                    'product_id', flat=True
+                )
+            ),
+            [others[0].id, others[1].id]
+        )
+
+
+class AxisEmbeddingFunction:
+    """
+        Embeds 'axis N' as the unit vector of axis N
+    """
+
+    def __call__(self, input):
+        vectors = np.zeros((len(input), 8), dtype=np.float32)
+        for row, text in enumerate(input):
+            vectors[row, int(text.split()[1])] = 1
+        return vectors
+
+
+class NumpyVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        self.store = NumpyVectorStore(self.path, AxisEmbeddingFunction())
+        self.store.upsert(
+            ids=['1', '2', '3', '4'],
+            documents=['axis 1', 'axis 2', 'axis 3', 'axis 4'],
+            metadatas=[
+                {'category': 'Fans'},
+                {'category': 'Fans'},
+                {'category': 'Lamps'},
+                {'category': 'Chairs'},
+            ]
+        )
+
+    def test_query_filters_by_category(self):
+        result = self.store.query(
+            query_texts=['axis 3', 'axis 1'],
+            n_results=2,
+            where={'category': {'$in': ['Fans', 'Lamps']}}
+        )
+        self.assertEqual(result['ids'][0][0], '3')
+        self.assertEqual(result['ids'][1][0], '1')
+        self.assertEqual(result['distances'][0], [0.0, 2.0])
+
+        result = self.store.query(
+            query_texts=['axis 1'],
+            n_results=4,
+            where={'category': {'$nin': ['Fans']}}
+        )
+        self.assertEqual(sorted(result['ids'][0]), ['3', '4'])
+
+    def test_batched_searches_share_one_embedding_call(self):
+        with mock.patch(
+            'apps.store.recommendations.recommendation_service'
+            '.get_vector_store',
+            return_value=self.store
+        ), mock.patch.object(
+            self.store, 'embed', wraps=self.store.embed
+        ) as embed:
+            results = search_many([
+                ('axis 1', 1, {'category': 'Fans'}),
+                ('axis 3', 1, None),
+                ('axis 2', 1, {'category': 'Fans'}),
+                ('axis 3', 1, {'category': {'$unknown': 1}}),
+            ])
+
+        embed.assert_called_once()
+        self.assertEqual(
+            [result['ids'] for result in results[:3]],
+            [[['1']], [['3']], [['2']]]
+        )
+        self.assertIsInstance(results[3], ValueError)
+
+    def test_writes_are_seen_by_a_new_instance(self):
+        self.store.delete(ids=['1'])
+        self.store.update(ids=['4'], metadatas=[{'category': 'Fans'}])
+
+        store = NumpyVectorStore(self.path, AxisEmbeddingFunction())
+        self.assertEqual(store.count(), 3)
+        result = store.query(
+            query_texts=['axis 4'],
+            n_results=4,
+            where={'category': 'Fans'}
+        )
+        self.assertEqual(result['ids'][0], ['4', '2'])
+
+    @mock.patch.multiple(
+        'apps.store.recommendations.vector_store',
+        BACKEND='numpy', NUMPY_INDEX_PATH=None, _vector_store=None
+    )
+    def test_numpy_backend_requires_a_path(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_vector_store()
+
+    def test_interface_is_abstract(self):
+        with self.assertRaises(TypeError):
+            VectorStore()
+
+    def test_writes_are_journaled_and_replayed_by_readers(self):
+        reader = NumpyVectorStore(self.path, AxisEmbeddingFunction())
+        index_file = os.path.join(self.path, 'index.json')
+        written = os.stat(index_file).st_mtime_ns
+
+        self.store.upsert(
+            ids=['5', '2'],
+            documents=['axis 5', 'axis 6'],
+            metadatas=[{'category': 'Lamps'}, {'category': 'Lamps'}]
+        )
+        self.store.delete(ids=['1'])
+
+        # Only the journal was written
+        self.assertEqual(os.stat(index_file).st_mtime_ns, written)
+        self.assertEqual(reader.count(), 4)
+        result = reader.query(
+            query_texts=['axis 6'], n_results=4, where={'category': 'Lamps'}
+        )
+        self.assertEqual(result['ids'][0][0], '2')
+        self.assertEqual(sorted(result['ids'][0][1:]), ['3', '5'])
+        self.assertEqual(result['distances'][0], [0.0, 2.0, 2.0])
+        self.assertEqual(reader.get(ids=['1'])['ids'], [])
+
+    @mock.patch('apps.store.recommendations.vector_store.JOURNAL_RATIO', 0)
+    @mock.patch(
+        'apps.store.recommendations.vector_store.JOURNAL_MIN_ROWS', 2
+    )
+    def test_long_journal_is_folded_into_the_index_file(self):
+        reader = NumpyVectorStore(self.path, AxisEmbeddingFunction())
+
+        for i in range(5, 8):
+            self.store.upsert(
+                ids=[str(i)],
+                documents=[f'axis {i}'],
+                metadatas=[{'category': 'Lamps'}]
+            )
+
+        # The third row started a new index file, without journal yet
+        self.assertEqual(self.store.generation, 2)
+        self.assertFalse(
+            [name for name in os.listdir(self.path) if name.endswith('.log')]
+        )
+        self.assertEqual(reader.count(), 7)
+        self.assertEqual(reader.generation, 2)
+        self.assertEqual(
+            reader.query(query_texts=['axis 7'], n_results=1)['ids'],
+            [['7']]
+        )
+
+    def test_compacted_partitions_and_new_rows(self):
+        self.store.compact()
+        self.assertEqual(
+            self.store.partitions,
+            {'Fans': (0, 2), 'Lamps': (2, 3), 'Chairs': (3, 4)}
+        )
+        # Not grouped until the next compaction
+        self.store.upsert(
+            ids=['5'], documents=['axis 5'], metadatas=[{'category': 'Lamps'}]
+        )
+        self.assertEqual(self.store.partitioned, 4)
+
+        result = self.store.query(
+            query_texts=['axis 5'],
+            n_results=2,
+            where={'category': {'$nin': ['Fans', 'Chairs']}}
+        )
+        self.assertEqual(result['ids'][0], ['5', '3'])
+        self.assertEqual(result['distances'][0], [0.0, 2.0])
+
+    def test_query_of_an_empty_store(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = NumpyVectorStore(directory.name, AxisEmbeddingFunction())
+
+        for where in (None, {'category': 'Fans'}):
+            result = store.query(
+                query_texts=['axis 1'], n_results=4, where=where
+            )
+            self.assertEqual(result['ids'], [[]])
+        self.assertEqual(
+            self.store.query(query_texts=['axis 1'], n_results=0)['ids'],
+            [[]]
+        )
+
+    def test_batched_filters_search_their_partitions(self):
+        self.store.compact()
+        queries = self.store.embed(['axis 2', 'axis 3', 'axis 1'])
+        wheres = [{'category': 'Fans'}, {'category': 'Lamps'},
+                  {'category': 'Fans'}]
+
+        with mock.patch.object(
+            self.store, '_search_rows', wraps=self.store._search_rows
+        ) as search_rows:
+            results = self.store.query_many(queries, [2, 1, 1], wheres)
+
+        search_rows.assert_not_called()
+        self.assertEqual(
+            [result['ids'][0] for result in results],
+            [['2', '1'], ['3'], ['1']]
+        )
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        empty = NumpyVectorStore(directory.name, AxisEmbeddingFunction())
+        results = empty.query_many(queries, [2, 1, 1], wheres)
+        self.assertEqual([result['ids'] for result in results], [[[]]] * 3)
+
+    def test_deletes_and_moves_keep_the_partitions(self):
+        self.store.compact()
+
+        self.store.delete(ids=['1'])
+        self.store.update(ids=['4'], metadatas=[{'category': 'Lamps'}])
+
+        # No compaction: '4' took the row of '1' in the Fans range and is
+        # searched on its own
+        self.assertEqual(self.store.partitioned, 3)
+        self.assertEqual(self.store.misplaced, {0})
+        result = self.store.query(
+            query_texts=['axis 4'],
+            n_results=4,
+            where={'category': {'$in': ['Lamps']}}
+        )
+        self.assertEqual(result['ids'][0], ['4', '3'])
+        result = self.store.query(
+            query_texts=['axis 2'],
+            n_results=4,
+            where={'category': 'Fans'}
+        )
+        self.assertEqual(result['ids'][0], ['2'])
+
+        reader = NumpyVectorStore(self.path, AxisEmbeddingFunction())
+        self.assertEqual(reader.misplaced, {0})
+
+    def test_recommendation_filter_inside_partitions(self):
+        self.store.upsert(
+            ids=[str(i) for i in range(1, 8)],
+            documents=[f'axis {i}' for i in range(1, 8)],
+            metadatas=[
+                {'category': 'Fans', 'product_id': i, 'in_stock': i != 2}
+                for i in range(1, 7)
+            ] + [{'category': 'Lamps', 'product_id': 7, 'in_stock': True}]
+        )
+        self.store.compact()
+
+        where = recommendation_condition(
+            'Fans', same_category=True, exclude_ids=[1, 3]
+        )
+        self.assertEqual(self.store._partition_ranges(where), [[0, 6]])
+        result = self.store.query(
+            query_texts=['axis 1'], n_results=2, where=where
+        )
+        self.assertEqual(sorted(result['ids'][0]), ['4', '5'])
+
+        # Fewer matches than asked for
+        result = self.store.query(
+            query_texts=['axis 1'], n_results=6, where=where
+        )
+        self.assertEqual(sorted(result['ids'][0]), ['4', '5', '6'])
+
+
+class AxisStoreMixin(VectorStoreMixin):
+    """
+        Indexes the first 8 products on their own axis, the first 4 as Fans
+        and the others as Lamps
+    """
+    embedding_function = AxisEmbeddingFunction
+
+    def setUp(self):
+        super().setUp()
+        self.store.upsert(
+            ids=[str(product.id) for product in self.products[:8]],
+            documents=[f'axis {i}' for i in range(8)],
+            metadatas=[
+                {'category': 'Fans' if i < 4 else 'Lamps'} for i in range(8)
+            ]
+        )
+
+
+class SimilarProductBatchTests(SalesMixin, AxisStoreMixin, TestCase):
+    url = reverse('product-similar-batch')
+
+    def test_one_vector_query_per_filter_and_one_database_query(self):
+        queries = [
+            {'query': 'axis 1', 'n_results': 1},
+            {'query': 'axis 6', 'n_results': 2, 'add_condition': True,
+             'category_name': 'Fans', 'same_category': False},
+            {'query': 'axis 2', 'n_results': 3},
+        ]
+        with mock.patch.object(
+            self.store, 'query', wraps=self.store.query
+        ) as vector_query, self.assertNumQueries(1):
+            response = self.client.post(
+                self.url, {'queries': queries}, content_type='application/json'
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(vector_query.call_count, 2)
+        results = response.json()['results']
+        self.assertEqual(list(results), ['0', '1', '2'])
+        self.assertEqual(
+            [product['id'] for product in results['0']],
+            [self.products[1].id]
+        )
+        self.assertEqual(results['1'][0]['id'], self.products[6].id)
+        self.assertEqual(len(results['1']), 2)
+        self.assertEqual(len(results['2']), 3)
+
+    def test_condition_requires_a_category(self):
+        response = self.client.post(
+            self.url,
+            {'queries': [{'query': 'axis 1', 'n_results': 1,
+                          'add_condition': True}]},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class SimilarProductAsyncViewTests(SalesMixin, AxisStoreMixin, TestCase):
+    url = reverse('product-similar-async')
+
+    async def test_async_view(self):
+        response = await self.async_client.post(
+            self.url,
+            {'query': 'axis 5', 'n_results': 2, 'add_condition': True,
+             'category_name': 'Lamps'},
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        products = response.json()
+        self.assertEqual(len(products), 2)
+        self.assertEqual(products[0]['id'], self.products[5].id)
+        self.assertEqual(products[0]['category']['name'], 'Fans')
+
+    async def test_validated_like_the_sync_view(self):
+        body = {'query': 'axis 1', 'n_results': 1, 'add_condition': True}
+        responses = [
+            await self.async_client.post(
+                self.url, body, content_type='application/json'
+            ),
+            await self.async_client.post(
+                self.url, '{', content_type='application/json'
+            ),
+            await self.async_client.get(self.url),
+        ]
+        expected = await sync_to_async(self.client.post)(
+            reverse('product-similar'), body, content_type='application/json'
+        )
+
+        self.assertEqual(
+            [response.status_code for response in responses],
+            [400, 400, 405]
+        )
+        self.assertEqual(responses[0].json(), expected.json())
+
+    async def test_form_data(self):
+        response = await self.async_client.post(
+            self.url, {'query': 'axis 2', 'n_results': 1}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['id'], self.products[2].id)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_identical_searches_in_flight_run_once(self):
+        calls = []
+
+        def search(**kwargs):
+            calls.append(kwargs['query'])
+            time.sleep(0.05)
+            return {'ids': [[kwargs['query']]]}
+
+        async def run():
+            return await asyncio.gather(
+                *[aget_similar('fan', add_condition=False) for _ in range(5)],
+                aget_similar('lamp', add_condition=False),
+            )
+
+        with mock.patch(
+            'apps.store.recommendations.async_search.get_similar', search
+        ):
+            results = asyncio.run(run())
+
+        self.assertEqual(sorted(calls), ['fan', 'lamp'])
+        self.assertEqual(results[0], {'ids': [['fan']]})
+        self.assertEqual(results[-1], {'ids': [['lamp']]})
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def test_concurrent_searches_share_a_query(self):
+        calls = []
+
+        def search(searches):
+            calls.append(len(searches))
+            return [
+                ValueError('Broken filter') if where == 'broken'
+                else {'ids': [[query_text]]}
+                for query_text, _, where in searches
+            ]
+
+        batcher = MicroBatcher(search, max_batch_size=8, max_wait=0.1)
+        futures = [batcher.submit(f'fan {i}', 4) for i in range(5)]
+        futures.append(batcher.submit('lamp', 4, {'category': 'Lamps'}))
+        failed = batcher.submit('chair', 4, 'broken')
+
+        self.assertEqual(
+            [future.result(timeout=1) for future in futures],
+            [{'ids': [[f'fan {i}']]} for i in range(5)]
+            + [{'ids': [['lamp']]}]
+        )
+        with self.assertRaises(ValueError):
+            failed.result(timeout=1)
+        self.assertEqual(calls, [7])
+
+
+class MetricsTests(SimpleTestCase):
+    def test_disabled_registry_records_nothing(self):
+        metrics = Metrics(enabled=False)
+        with metrics.span('embed'):
+            pass
+        metrics.increment('result_cache_hits')
+
+        self.assertEqual(metrics.stats(), {})
+        self.assertEqual(metrics.counters, {})
+
+    def test_spans_render_as_prometheus_histograms(self):
+        metrics = Metrics(enabled=True)
+        for seconds in (0.002, 0.003, 0.2):
+            metrics.observe('vector_query', seconds)
+        with self.assertRaises(ValueError):
+            with metrics.span('embed'):
+                raise ValueError
+        metrics.increment('result_cache_hits', 2)
+
+        stats = metrics.stats()
+        self.assertEqual(stats['vector_query']['count'], 3)
+        self.assertAlmostEqual(stats['vector_query']['total'], 0.205)
+        self.assertLessEqual(stats['vector_query']['p50'], 0.005)
+        self.assertEqual(metrics.counters['embed.errors'], 1)
+
+        lines = metrics.prometheus().splitlines()
+        stage = 'store_recommendation_stage_seconds'
+        self.assertIn(
+            f'{stage}_bucket{{stage="vector_query",le="0.0025"}} 1', lines
+        )
+        self.assertIn(
+            f'{stage}_bucket{{stage="vector_query",le="+Inf"}} 3', lines
+        )
+        self.assertIn(f'{stage}_count{{stage="vector_query"}} 3', lines)
+        self.assertIn(
+            'store_recommendation_events_total'
+            '{event="result_cache_hits"} 2',
+            lines
+        )
+
+    def test_metrics_endpoint(self):
+        response = self.client.get(reverse('recommendation-metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(
+            b'# TYPE store_recommendation_stage_seconds histogram',
+            response.content
+        )
+
+        # What Prometheus sends
+        response = self.client.get(
+            reverse('recommendation-metrics'),
+            HTTP_ACCEPT='application/openmetrics-text;version=1.0.0,'
+                        'text/plain;version=0.0.4;q=0.5,*/*;q=0.1'
+        )
+        self.assertEqual(
+            response['Content-Type'],
+            'text/plain; version=0.0.4; charset=utf-8'
+        )
+
+
+class CopurchaseIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = CopurchaseIndex(min_support=2)
+        for basket in ([1, 2], [1, 2], [1, 3], [1, 3], [3, 4], [3, 4]):
+            self.index.add_basket(basket)
+
+    def test_scores(self):
+        # 6 baskets, 1 in 4 of them, 2 in 2, 3 in 4 and 1 with 2 in 2
+        self.assertEqual(self.index.top(1, 'confidence'), [(2, 0.5), (3, 0.5)])
+        self.assertEqual(self.index.top(1, 'lift'), [(2, 1.5), (3, 0.75)])
+        self.assertEqual(self.index.top(4, 'lift'), [(3, 1.5)])
+
+    def test_products_added_to_a_basket(self):
+        self.index.top(2)
+        self.index.add_basket([2], existing=[3, 4])
+        self.index.add_basket([3, 2])
+
+        self.assertEqual(self.index.baskets, 7)
+        self.assertEqual(self.index.top(2, 'confidence'), [
+            (1, 0.5), (3, 0.5)
+        ])
+        self.assertEqual(
+            [product for product, _ in self.index.recommend([1, 2])], [3]
+        )
+
+
+    def test_cached_lifts_follow_the_basket_count(self):
+        self.assertEqual(self.index.top(1, 'lift'), [(2, 1.5), (3, 0.75)])
+
+        # Unrelated basket: only N changes for product 1
+        self.index.add_basket([5, 6])
+
+        self.assertEqual(self.index.top(1, 'lift'), [(2, 1.75), (3, 0.875)])
+        self.assertEqual(self.index.top(4, 'lift'), [(3, 1.75)])
+
+
+class CopurchaseBuildTests(SalesMixin, TestCase):
+    baskets = ([0, 1], [0, 1], [0, 2], [0, 2], [2, 3])
+
+    def expected(self, baskets):
+        index = CopurchaseIndex(min_support=2)
+        for basket in baskets:
+            index.add_basket([self.products[i].id for i in basket])
+        return index
+
+    def assertSameScores(self, index, expected):
+        self.assertEqual(index.baskets, expected.baskets)
+        for product in self.products[:5]:
+            for metric in ('lift', 'confidence'):
+                self.assertEqual(
+                    index.top(product.id, metric),
+                    expected.top(product.id, metric)
+                )
+
+    def test_build_counts_the_stored_baskets(self):
+        for sale, basket in zip(self.sales, self.baskets):
+            sale.products.add(*(self.products[i] for i in basket))
+        index = CopurchaseIndex(min_support=2)
+
+        index.build()
+
+        self.assertSameScores(index, self.expected(self.baskets))
+        self.assertEqual(
+            index.top(self.products[0].id, 'confidence'),
+            [(self.products[1].id, 0.5), (self.products[2].id, 0.5)]
+        )
+
+    def test_update_counts_the_new_sale_products(self):
+        for sale, basket in zip(self.sales[:4], self.baskets):
+            sale.products.add(*(self.products[i] for i in basket))
+        index = CopurchaseIndex(min_support=2)
+        index.build()
+
+        self.sales[4].products.add(self.products[2], self.products[3])
+        self.sales[0].products.add(self.products[2])
+
+        self.assertEqual(index.update(), 3)
+        self.assertSameScores(
+            index, self.expected([[0, 1, 2], *self.baskets[1:]])
+        )
+
+
+class RankerTests(SimpleTestCase):
+    def test_features_and_weights(self):
+        ids, features = candidate_features(
+            similar={1: 0.2, 2: 0.2},
+            copurchased={2: 3.0, 3: 6.0},
+            products={1: (10, 0), 2: (20, 5), 3: (10, 5)},
+            popularity={},
+            interests={10},
+            purchased={3},
+        )
+        ranked = Ranker(
+            {'similarity': 1, 'copurchase': 1, 'interest': 1, 'in_stock': 0,
+             'popularity': 0, 'purchased': -1}
+        ).rank(ids, features, 3)
+
+        # 1: 0.9 + 1, 2: 0.9 + 0.5, 3: 1 + 1 - 1
+        self.assertEqual([id_ for id_, _ in ranked], [1, 2, 3])
+        self.assertAlmostEqual(ranked[0][1], 1.9)
+
+    def test_latency_budget(self):
+        rng = np.random.default_rng(0)
+        ids = rng.choice(100_000, 500, replace=False).tolist()
+        similar = dict(zip(ids[:300], rng.random(300).tolist()))
+        copurchased = dict(zip(ids[200:], rng.random(300).tolist()))
+        products = {id_: (id_ % 20, id_ % 3) for id_ in ids}
+        popularity = {id_: id_ % 50 for id_ in ids}
+        ranker = Ranker()
+
+        timings = []
+        for _ in range(20):
+            start = time.perf_counter()
+            ranker.rank(
+                *candidate_features(
+                    similar, copurchased, products, popularity,
+                    set(range(5)), set(ids[:10]),
+                ),
+                20
+            )
+            timings.append(time.perf_counter() - start)
+
+        self.assertLess(min(timings), 0.003)
+
+
+@mock.patch('apps.store.utils.RECOMMENDATION_RANKING', 'hybrid')
+@mock.patch('apps.store.recommendations.copurchase._index', None)
+@mock.patch.dict(
+    'apps.store.recommendations.ranking.WEIGHTS', {'copurchase': 2}
+)
+class HybridRecommendationTests(SalesMixin, VectorStoreMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.first, *_, self.paired = self.products
+        for sale in self.sales[1:3]:
+            sale.products.add(self.first, self.paired)
+        sync_vectors()
+
+    def test_ranks_similar_and_copurchased_products(self):
+        sale = self.sales[0]
+        sale.products.add(self.first)
+        similar = dict(recommendation_hits(get_batch_recommendations(
+            [('Fans', product_document(self.first))],
+            n_results=2,
+            same_category=True,
+            exclude_ids=[self.first.id],
+        )))
+
+        recommendation = create_recomendation(
+            sale, same_category=True, n_results=2
+        )
+
+        items = list(
+            recommendation.items.order_by('rank').values_list(
+                'product_id', 'score'
+            )
+        )
+        self.assertIn(self.paired.id, [id_ for id_, _ in items])
+        scores = [score for _, score in items]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        # The confidence stays an average distance, not a ranking score
+        found = [similar[id_] for id_, _ in items if id_ in similar]
+        self.assertTrue(found)
+        self.assertEqual(
+            recommendation.confidence_score,
+            round(Decimal(sum(found) / len(found)), 2)
+        )
+
+    def test_copurchased_products_without_stock_are_dropped(self):
+        Product.objects.filter(id=self.paired.id).update(stock=0)
+        sale = self.sales[0]
+        sale.products.add(self.first)
+
+        recommendation = create_recomendation(
+            sale, same_category=True, n_results=2
+        )
+
+        recommended = list(
+            recommendation.items.values_list('product_id', flat=True)
+        )
+        self.assertEqual(len(recommended), 2)
+        self.assertNotIn(self.paired.id, recommended)
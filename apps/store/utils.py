@@ -1,5 +1,7 @@
 from typing import Tuple
 
+from django.db import transaction
+
 from apps.store.models import (
     Sale,
     Product,
@@ -7,9 +9,26 @@ from apps.store.models import (
     Recommendation
 )
 
+from apps.store.recommendations.async_search import aget_similar
+from apps.store.recommendations.copurchase import (
+    get_copurchase_index,
+    get_copurchase_recommendations,
+)
+from apps.store.recommendations.documents import product_document
+from apps.store.recommendations.metrics import metrics
+from apps.store.recommendations.neighbors import (
+    RECOMMENDATION_SOURCE,
+    neighbor_hits,
+)
+from apps.store.recommendations.ranking import (
+    RECOMMENDATION_RANKING,
+    rank_products,
+)
 from apps.store.recommendations.recommendation_service import (
     get_similar,
+    get_similar_batch,
     get_recommendations,
+    get_batch_recommendations,
 )
 
 
@@ -59,6 +78,110 @@ def get_similar_objects(
     return Product.objects.filter(id__in=ids), result
 
 
+async def aget_similar_objects(
+    query: str,
+    add_condition: bool = False,
+    product_category: str = None,
+    same_category: bool = True,
+    n: int = 4,
+) -> Tuple[list[Product], dict]:
+    """
+    Async version of `get_similar_objects`.
+    ---
+    The vector search runs in the search executor, see `aget_similar`, and
+    the products are read with the async ORM, so the event loop is never
+    blocked.
+
+    Args:
+        query (str): The search query to find similar products.
+        add_condition (bool, optional): Whether to add an additional condition
+            based on product category. Defaults to False.
+        product_category (str, optional): The category of the product to
+            filter by when add_condition is True.
+        same_category (bool, optional): Whether to restrict results to the same
+            category.
+        n (int, optional): The number of similar products to retrieve.
+
+    Returns:
+        Tuple[list[Product], dict]: The similar products, most similar
+            first, with their category and subcategory loaded, and the
+            query result.
+
+    Raises:
+        ValueError:
+            If `add_condition` True and `product_category` is not provided.
+    """
+
+    if add_condition and not product_category:
+        raise ValueError(
+            'product_category is required when add_condition is True'
+        )
+
+    result = await aget_similar(
+        query=query,
+        n_results=n,
+        prod_category=product_category,
+        add_condition=add_condition,
+        same_category=same_category,
+    )
+    ids = [int(id_) for id_ in result.get('ids', [])[0]]
+
+    products = {
+        product.id: product
+        async for product in Product.objects.select_related(
+            'category', 'subcategory'
+        ).filter(id__in=ids)
+    }
+
+    return [products[id_] for id_ in ids if id_ in products], result
+
+
+def get_similar_objects_batch(
+    queries: list[dict],
+) -> list[list[Product]]:
+    """
+    Retrieve the similar products of many queries at once.
+    ---
+    The vector store is queried once per distinct filter and the products
+    of every query are read with a single database query.
+
+    Args:
+        queries (list[dict]): The arguments of `get_similar_objects` of each
+            query: `query`, and optionally `add_condition`,
+            `product_category`, `same_category` and `n`.
+
+    Returns:
+        list[list[Product]]: The similar products of each query, most
+            similar first, in the same order as `queries`.
+
+    Raises:
+        ValueError:
+            If a query has `add_condition` True and no `product_category`.
+    """
+
+    results = get_similar_batch([
+        {
+            'query': query['query'],
+            'n_results': query.get('n', 4),
+            'prod_category': query.get('product_category'),
+            'add_condition': query.get('add_condition', False),
+            'same_category': query.get('same_category', True),
+        }
+        for query in queries
+    ])
+    ids = [[int(id_) for id_ in result['ids'][0]] for result in results]
+
+    products = Product.objects.select_related(
+        'category', 'subcategory'
+    ).in_bulk({id_ for query_ids in ids for id_ in query_ids})
+
+    # The index can still hold products deleted since the last sync
+    return [
+        [products[id_] for id_ in query_ids if id_ in products]
+        for query_ids in ids
+    ]
+
+
 def get_recomendations_objects(
     prod_category: str,
     query: str,
@@ -94,19 +217,30 @@ def get_recomendations_objects(
     return Product.objects.filter(id__in=ids), result
 
 
+@metrics.timed('recommendation')
 def create_recomendation(
     sale: Sale,
     same_category: bool = False,
-    n_results: int = 4
+    n_results: int = 4,
+    use_cache: bool = True,
 ) -> Recommendation:
     """
     Generates product recommendations based on a given sale.
     ---
     This function creates recommendations for products in a sale by finding
-        similar products.
+        similar products. The whole sale is resolved with one vector query
+        per distinct category and one query for the recommended products.
+        With RECOMMENDATION_SOURCE set to 'neighbors' the precomputed
+        neighbours are read instead, and only the products that have none
+        yet go to the vector store. Products of the sale and products
+        without stock are filtered out by the queries themselves.
+    With RECOMMENDATION_RANKING set to 'hybrid' the similar products and
+        the products often bought with the sale ones are ranked together
+        with `rank_products`, and the items keep the ranking score.
     It calculates a confidence score based on the distances of the
         recommended products and associates these recommendations
-        with the sale.
+        with the sale. In hybrid mode it is the average distance of the
+        ranked products found by the vector search, never a ranking score.
 
     Args:
         sale (Sale): The sale object containing the products for which
@@ -115,44 +249,161 @@ def create_recomendation(
             limited to products in the same category. Defaults to False.
         n_results (int, optional): The number of similar products to retrieve
             for each product in the sale. Defaults to 4.
+        use_cache (bool, optional): Whether the vector queries read and
+            fill the result cache. Defaults to True.
 
     Returns:
         Recommendation: The created recommendation object containing the
             recommended items and confidence score.
     """
 
-    recomendations = []
-    distances = []
-    for product in sale.products.all():
-        objs, similar_products = get_recomendations_objects(
-            product.category.name,
-            product.name,
-            same_category=same_category,
-            n=n_results,
-        )
+    with metrics.span('sale_products'):
+        products = list(sale.products.select_related('category'))
+    sale_ids = [product.id for product in products]
 
-        # Take the objects of the products and the distances
-        zip_objects = zip(objs, similar_products['distances'][0])
-        for obj, distance in zip_objects:
-            # Get or create the recommendation item
-            r_item, r_item_created = RecommendationItem.objects.get_or_create(
-                score=distance
+    hits = []
+    if RECOMMENDATION_SOURCE == 'neighbors':
+        with metrics.span('stored_neighbors'):
+            stored = neighbor_hits(
+                sale_ids, n_results, same_category, exclude_ids=sale_ids
             )
-            if r_item_created:
-                r_item.products.add(obj)
-            distances.append(distance)
-            recomendations.append(r_item)
-
-    # Calculate the confidence score - the average of the distances
-    confidence_score = sum(distances) / len(distances)
-
-    # Create the recommendation object
-    recommendation = Recommendation.objects.create(
-        sale=sale,
-        client=sale.client,
-        confidence_score=round(confidence_score, 2),
+        for product in products:
+            hits.extend(stored.get(product.id, []))
+        products = [
+            product for product in products if product.id not in stored
+        ]
+
+    if products:
+        with metrics.span('vector_search'):
+            results = get_batch_recommendations(
+                [
+                    (product.category.name, product_document(product))
+                    for product in products
+                ],
+                n_results=n_results,
+                same_category=same_category,
+                exclude_ids=sale_ids,
+                use_cache=use_cache,
+            )
+        hits.extend(recommendation_hits(results))
+
+    if RECOMMENDATION_RANKING != 'hybrid':
+        return save_recommendations([(sale, hits)])[0]
+
+    similar = {}
+    for id_, distance in hits:
+        similar[id_] = min(distance, similar.get(id_, distance))
+    n = n_results * len(sale_ids)
+    with metrics.span('copurchase'):
+        copurchased = dict(get_copurchase_recommendations(sale_ids, n))
+        popularity = get_copurchase_index().item_counts
+    with metrics.span('ranking'):
+        ranked = rank_products(
+            sale.client, similar, copurchased, n, popularity=popularity
+        )
+
+    return save_recommendations(
+        [(sale, ranked)], ascending=False, distances=[similar]
+    )[0]
+
+
+def recommendation_hits(results: list[dict]) -> list[tuple[int, float]]:
+    """
+        Flatten single-row query results into (product id, distance) pairs
+    """
+
+    return [
+        (int(id_), distance)
+        for result in results
+        for id_, distance in zip(result['ids'][0], result['distances'][0])
+    ]
+
+
+def save_recommendations(
+    entries: list[tuple[Sale, list[tuple[int, float]]]],
+    ascending: bool = True,
+    distances: list[dict[int, float]] = None,
+) -> list[Recommendation]:
+    """
+    Store the recommendations of many sales with a constant number of
+    statements.
+    ---
+    Every recommended product becomes an item of its own, with its distance
+    (or ranking score) and its rank inside the recommendation. A product
+    found for several products of the sale is kept once, with its best
+    score. Indexed products that no longer exist in the database are
+    skipped. The confidence score is the average distance of the saved
+    items: their score, or their entry of `distances` when the scores are
+    not distances. The recommendations, the items and the links between
+    them are inserted with one `bulk_create` each, inside a single
+    transaction.
+
+    Args:
+        entries (list[tuple[Sale, list[tuple[int, float]]]]): Pairs of a
+            sale and its (product id, distance) hits.
+        ascending (bool, optional): Whether lower scores are better, as
+            distances are. False for ranking scores.
+        distances (list[dict[int, float]], optional): Vector distance of
+            the products of every entry, for the confidence score. Saved
+            items without one are left out of it. Defaults to the scores.
+
+    Returns:
+        list[Recommendation]: The created recommendations, in the same order
+            as `entries`.
+    """
+
+    with metrics.span('existing_products'):
+        existing = set(
+            Product.objects.filter(
+                id__in={id_ for _, hits in entries for id_, _ in hits}
+            ).values_list('id', flat=True)
+        )
+
+    recommendations = []
+    items = []
+    for index, (sale, hits) in enumerate(entries):
+        sign = 1 if ascending else -1
+        best = {}
+        for id_, score in hits:
+            if id_ in existing and sign * score < sign * best.get(
+                id_, sign * float('inf')
+            ):
+                best[id_] = score
+        ranked = sorted(best.items(), key=lambda hit: sign * hit[1])
+
+        # The confidence score is the average distance of the saved items
+        if distances is None:
+            found = list(best.values())
+        else:
+            found = [
+                distances[index][id_] for id_ in best
+                if id_ in distances[index]
+            ]
+        confidence_score = sum(found) / len(found) if found else 0
+        recommendations.append(Recommendation(
+            sale=sale,
+            client_id=sale.client_id,
+            confidence_score=round(confidence_score, 2),
+        ))
+        items.append([
+            RecommendationItem(product_id=id_, score=score, rank=rank)
+            for rank, (id_, score) in enumerate(ranked, start=1)
+        ])
+
+    Through = Recommendation.items.through
+    with metrics.span('save_items'), transaction.atomic():
+        Recommendation.objects.bulk_create(recommendations)
+        RecommendationItem.objects.bulk_create(
+            [item for sale_items in items for item in sale_items]
+        )
+        Through.objects.bulk_create(
+            Through(recommendation=recommendation, recommendationitem=item)
+            for recommendation, sale_items in zip(recommendations, items)
+            for item in sale_items
+        )
+    metrics.increment('recommendations', len(recommendations))
+    metrics.increment(
+        'recommendation_items', sum(len(sale_items) for sale_items in items)
     )
-    recommendation.items.add(*recomendations)
-    recommendation.save()
 
-    return recommendation
+    return recommendations